@@ -0,0 +1,74 @@
+# Compares the old string concatenation export with Agents.write_csv
+# Run from the project root: python -m benchmarks.agents_csv [agent count]
+from classes.scraper_classes.common import Agents
+import io
+import sys
+import time
+
+COLUMNS = [
+    "Location",
+    "Source",
+    "Scrape Date",
+    "Id",
+    "Full Name",
+    "First Name",
+    "Last Name",
+    "DRE",
+    "Phone",
+    "Email",
+]
+
+
+def create_agents(count):
+    agents = Agents(COLUMNS)
+    for i in range(count):
+        agents.add_agent(
+            {
+                "Location": "Los Angeles, CA, USA",
+                "Source": "https://www.bhhs.com",
+                "Scrape Date": "01/01/2023",
+                "Id": i,
+                "Full Name": f'Jane "JD" Doe {i}',
+                "First Name": "Jane",
+                "Last Name": "Doe",
+                "DRE": f"#{i:08d}",
+                "Phone": "(555) 555-5555",
+                "Email": f"jane.doe{i}@example.com",
+            }
+        )
+    return agents
+
+
+def concat_export(agents):
+    # How get_all_agents_as_csv_string used to build its output
+    output = ""
+    for i in range(0, len(agents.columns)):
+        output += f'"{agents.columns[i]}"'
+        output += "," if i < len(agents.columns) - 1 else "\n"
+    for agent in agents.agents:
+        for i in range(0, len(agents.columns)):
+            output += f'"{agent[agents.columns[i]]}"'
+            output += "," if i < len(agents.columns) - 1 else "\n"
+    return output
+
+
+def writer_export(agents):
+    output = io.StringIO()
+    agents.write_csv(output)
+    return output.getvalue()
+
+
+def measure(name, export, agents):
+    start = time.perf_counter()
+    export(agents)
+    seconds = time.perf_counter() - start
+    rate = len(agents.agents) / seconds
+    print(f"{name:<8} {seconds:8.3f}s {rate:12,.0f} agents/s")
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    agents = create_agents(count)
+    print(f"Exporting {count:,} agents")
+    measure("concat", concat_export, agents)
+    measure("writer", writer_export, agents)
@@ -0,0 +1,92 @@
+from python_utils import cprint, print_trace
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from .Exceptions import RestartScrape
+import threading
+
+
+# Runs (source, location) scrapes side by side, each with its own browser
+class Scheduler:
+    def __init__(
+        self,
+        create_scraper,
+        jobs: list,
+        max_browsers: int = 4,
+        browsers_per_job: int = 1,
+        max_restarts: int = 5,
+    ):
+        # create_scraper(source, location, slot) returns a scraper for one location
+        # slot is unique among running jobs, eg. for picking a proxy port
+        # jobs = [("bhhs", "Los Angeles, CA, USA"), ...]
+        self.__create_scraper = create_scraper
+        self.__jobs = jobs
+        self.__max_restarts = max_restarts
+
+        # Never run more browsers than max_browsers, counting profile workers
+        if browsers_per_job > max_browsers:
+            raise ValueError(
+                f"Each scrape uses {browsers_per_job} browsers, more than "
+                f"max_browsers ({max_browsers}). Lower workers or raise max_browsers."
+            )
+        self.__size = max_browsers // browsers_per_job
+        self.__slots = Queue()
+        for slot in range(self.__size):
+            self.__slots.put(slot)
+
+        self.__lock = threading.Lock()
+        self.__progress = {}
+        for source, _ in jobs:
+            self.__progress.setdefault(source, {"done": 0, "failed": 0, "total": 0})
+            self.__progress[source]["total"] += 1
+
+    def run(self):
+        cprint(f"Running <c>{len(self.__jobs)}<w> scrapes, {self.__size} at a time...")
+        with ThreadPoolExecutor(self.__size) as executor:
+            list(executor.map(self.run_job, self.__jobs))
+        self.print_summary()
+        return self.__progress
+
+    def run_job(self, job):
+        source, location = job
+        slot = self.__slots.get()
+        try:
+            cprint(f"<c>{source}<w> - Starting <c>{location}<w>...")
+            self.scrape(source, location, slot)
+            self.report(source, location, True)
+        except:
+            print_trace()
+            self.report(source, location, False)
+        finally:
+            self.__slots.put(slot)
+
+    def scrape(self, source, location, slot):
+        for restart in range(self.__max_restarts + 1):
+            scraper = self.__create_scraper(source, location, slot)
+            try:
+                scraper.scrape()
+                return
+            except RestartScrape:
+                cprint(f"<y>{source} - Restarting {location} ({restart + 1})...")
+            finally:
+                scraper.close()
+        raise RestartScrape
+
+    def report(self, source, location, succeeded):
+        with self.__lock:
+            progress = self.__progress[source]
+            progress["done" if succeeded else "failed"] += 1
+            finished = progress["done"] + progress["failed"]
+            status = "<g>Finished" if succeeded else "<r>Failed"
+            cprint(
+                f"<c>{source}<w> - {status}<w> {location} "
+                f"({finished} / {progress['total']} locations)"
+            )
+
+    def print_summary(self):
+        for source, progress in self.__progress.items():
+            failed = (
+                f", <r>{progress['failed']} failed<w>" if progress["failed"] else ""
+            )
+            cprint(
+                f"<c>{source}<w> - {progress['done']} / {progress['total']} locations{failed}"
+            )
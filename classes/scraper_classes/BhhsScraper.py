@@ -1,12 +1,30 @@
-from python_utils import cprint, get_last_id_in_csv_file, get_todays_date
+from python_utils import cprint, get_todays_date
 from classes.Exceptions import BadUrl, RestartScrape
 from selenium_utils import SeleniumBase, check_url, exponential_backoff
-from selenium.common.exceptions import NoSuchElementException, TimeoutException
+from selenium.common.exceptions import (
+    NoSuchElementException,
+    TimeoutException,
+    WebDriverException,
+)
 from selenium.webdriver.common.by import By
-from .common import Agents
+from .common import (
+    Agents,
+    AgentSchema,
+    ApiReplay,
+    AsyncCore,
+    DeltaScrape,
+    HarStream,
+    HttpSession,
+    ResponseWaiter,
+    WorkerPool,
+    extract_fields,
+    get_adaptive_rate_limiter,
+    get_agent_store,
+    get_profile_cache,
+    reset_tab,
+    use_lean_browsing,
+)
 from math import ceil
-import json
-import os
 import re
 import time
 import urllib.parse
@@ -28,12 +46,44 @@ class BhhsScraper:
     __COL_PHONE = "Phone"
     __COL_EMAIL = "Email"
 
+    # Columns of the output CSV, in order
+    __SCHEMA = AgentSchema(
+        [
+            __COL_LOCATION,
+            __COL_SOURCE,
+            __COL_SCRAPE_DATE,
+            __COL_ID,
+            __COL_NAME_FULL,
+            __COL_NAME_FIRST,
+            __COL_NAME_LAST,
+            __COL_DRE,
+            __COL_PHONE,
+            __COL_EMAIL,
+        ]
+    )
+
+    # Profile selectors shared by the browser and static html lookups
+    __XP_NAME = "//h1[@class='cmp-agent__name']/a"
+    __XP_DRE = "//ul[contains(@class,'cmp-agent-details__license')]"
+    __XP_PHONE = "//a[contains(@class,'cmp-agent-details__phone-number')]"
+    __XP_EMAIL = "//a[contains(@class,'cmp-agent-details__mail')]"
+
     def __init__(
         self,
         chrome_options: dict,
         bmp_options: dict,
         locations: list,
         timeout_default: int = 10,
+        http_options: dict = None,
+        workers: int = 1,
+        replay_options: dict = None,
+        lean_options: dict = None,
+        async_options: dict = None,
+        rate_options: dict = None,
+        cache_options: dict = None,
+        delta_options: dict = None,
+        store_options: dict = None,
+        pool_options: dict = None,
     ):
         self.__b = SeleniumBase(
             chrome_options=chrome_options,
@@ -41,13 +91,82 @@ class BhhsScraper:
             timeout_default=timeout_default,
         )
         self.__dr = self.__b.initialize_driver()
+        use_lean_browsing(self.__dr, lean_options)
         self.__bmp = self.__b.get_bmp()
         self.__loc = locations
 
+        # Wait on search responses instead of fixed sleeps
+        self.__waiter = ResponseWaiter(self.__dr, ["solrAgentSearchServlet"])
+
         # Count the number of retries
         self.__retries = 0
 
+        # Learn the fastest safe request rate when options are given
+        # Workers share the limiter, so they slow down together
+        self.__rate_options = rate_options
+        self.__limiter = None
+        if rate_options:
+            self.__limiter = get_adaptive_rate_limiter(rate_options)
+
+        # Reuse profiles scraped on earlier runs when options are given
+        self.__cache_options = cache_options
+        self.__cache = None
+        if cache_options:
+            self.__cache = get_profile_cache(cache_options)
+
+        # Write agents and urls to a SQLite store instead of files when given
+        self.__store = get_agent_store(store_options) if store_options else None
+
+        # Only scrape agents that changed since the last run when options are given
+        self.__delta_options = delta_options
+        self.__delta = None
+
+        # Fetch profiles over plain http when options are given
+        self.__http_options = http_options
+        self.__http = None
+        if http_options:
+            self.__http = HttpSession(**http_options, limiter=self.__limiter)
+
+        # Visit profiles with several browsers at once when workers > 1
+        self.__chrome_options = chrome_options
+        self.__timeout_default = timeout_default
+        self.__lean_options = lean_options
+        self.__workers = workers
+        self.__pool_options = pool_options
+        self.__pool = None
+
+        # Request search result pages straight from the api when options are given
+        self.__replay = None
+        if replay_options:
+            http = self.__http or HttpSession(**(http_options or {}))
+            self.__replay = ApiReplay(http, **replay_options)
+
+        # Keep many profile fetches in flight at once when options are given
+        # The rate limiter paces requests on its own, so it replaces the buckets
+        self.__async = None
+        if async_options:
+            self.__async = AsyncCore(async_options, self.__limiter)
+
+    def recover(self):
+        # Replace the tab that timed out, keeping Chrome and the proxy alive
+        # Returns False if the scraper needs a full restart instead
+        if not reset_tab(self.__dr):
+            return False
+        use_lean_browsing(self.__dr, self.__lean_options)
+        self.__waiter.install()
+        return True
+
     def close(self):
+        if self.__limiter:
+            self.__limiter.save()
+        if self.__cache:
+            self.__cache.save()
+        if self.__async:
+            self.__async.close()
+        if self.__pool:
+            self.__pool.close()
+        if self.__http:
+            self.__http.close()
         self.__b.close()
 
     def transform_location(self, location):
@@ -68,10 +187,12 @@ class BhhsScraper:
         select.click()
 
         xp_option = f"ul/li[@data-value='{selection}']"
-        select.find_element(By.XPATH, xp_option).click()
+        option = select.find_element(By.XPATH, xp_option)
 
-        # Wait 2 seconds to wait for links to populate
-        time.sleep(2)
+        # Wait for the search with the new page size to come back
+        # Fall back to waiting 2 seconds for links to populate
+        if not self.__waiter.run_and_wait("solrAgentSearchServlet", option.click):
+            time.sleep(2)
 
     def get_agent_count(self):
         xp_count = (
@@ -81,37 +202,112 @@ class BhhsScraper:
         count = count.get_attribute("textContent").split(" ")[0]
         return int(count)
 
-    def load_all_agents(self, count):
+    def load_all_agents(self, count, stream):
+        # The first page is already loaded by set_view_per_page
         xp_next = "//a[contains(@class, 'cmp-search-results-pagination__arrow--next')]"
         btn_next = self.__dr.find_element(By.XPATH, xp_next)
-        for _ in range(ceil(count / BhhsScraper.__VIEW_PER_PAGE)):
-            btn_next.click()
+        for _ in range(ceil(count / BhhsScraper.__VIEW_PER_PAGE) - 1):
+            self.__waiter.run_and_wait("solrAgentSearchServlet", btn_next.click)
+
+            # Collect each page as it comes in so the HAR stays small
+            stream.wait_for_responses()
+
+    def get_agent_urls_from_content(self, content):
+        return [result["BhhsWebsiteUrl"] for result in content["value"]]
+
+    def get_agent_urls_from_webpage(self, loc, count):
+        stream = HarStream(
+            self.__bmp,
+            f"bhhs_{loc}",
+            "solrAgentSearchServlet",
+            self.get_agent_urls_from_content,
+        )
+
+        # Start recording HAR data before changing the view per page
+        # so we can grab the first query
+        stream.start()
+
+        # Set view per page so we don't have to iterate over so many requests
+        self.set_view_per_page(BhhsScraper.__VIEW_PER_PAGE)
+        stream.wait_for_responses()
 
-        # Wait 2 seconds to ensure all requests are captured
-        time.sleep(2)
+        # Load all agent queries
+        self.load_all_agents(count, stream)
+
+        # Get the list of urls to iterate over
+        return stream.get_results()
+
+    def get_agent_urls_from_api(self, loc, count):
+        # Returns None if the api couldn't be replayed
+        self.__bmp.start_har(f"bhhs_{loc}")
+        self.set_view_per_page(BhhsScraper.__VIEW_PER_PAGE)
+
+        # Load a second page so we can see which parameter changes between pages
+        xp_next = "//a[contains(@class, 'cmp-search-results-pagination__arrow--next')]"
+        btn_next = self.__dr.find_element(By.XPATH, xp_next)
+        self.__waiter.run_and_wait("solrAgentSearchServlet", btn_next.click)
+        entries = self.__replay.wait_for_entries(
+            self.__bmp, "solrAgentSearchServlet", 2
+        )
+        if len(entries) < 2:
+            return None
+
+        paging = self.__replay.get_paging(
+            entries[-2], entries[-1], BhhsScraper.__VIEW_PER_PAGE
+        )
+        if paging is None:
+            return None
+
+        page_count = ceil(count / BhhsScraper.__VIEW_PER_PAGE)
+        contents = self.__replay.replay_pages(entries[-2], paging, page_count)
 
-    def get_agent_urls(self, har):
         urls = []
-        for entry in har["log"]["entries"]:
-            if "solrAgentSearchServlet" in entry["request"]["url"]:
-                try:
-                    content = json.loads(entry["response"]["content"]["text"])
-                    results = content["value"]
-                    for result in results:
-                        urls.append(result["BhhsWebsiteUrl"])
-                except:
-                    continue
+        for content in contents:
+            try:
+                urls += self.get_agent_urls_from_content(content)
+            except:
+                return None
+
+        # A wrong paging guess repeats pages, so check every agent came back once
+        if not self.are_urls_complete(urls, count):
+            cprint("<y>Replayed search api repeated or missed agents.")
+            return None
         return urls
 
+    def are_urls_complete(self, urls, count):
+        # Some agents have no url, so only urls that are there have to be unique
+        found = [url for url in urls if url]
+        return len(urls) == count and len(set(found)) == len(found)
+
+    def visit(self, url):
+        if not self.__limiter:
+            # Multiple requests in a short amount of time could give an error
+            # Exponential backoff could be a solution to this error
+            exponential_backoff(self.__dr, url)
+            return
+
+        # Go as fast as bhhs.com has been letting us lately
+        self.__limiter.wait(url)
+        try:
+            self.__dr.get(url)
+        except WebDriverException:
+            self.__limiter.failure(url)
+            raise TimeoutException
+
+    def report_visit(self, url, succeeded):
+        if self.__limiter:
+            if succeeded:
+                self.__limiter.success(url)
+            else:
+                self.__limiter.failure(url)
+
     def go_to_profile(self, profile_url):
-        # Multiple requests in a short amount of time could give an error
-        # Exponential backoff could be a solution to this error
-        exponential_backoff(self.__dr, profile_url)
+        self.visit(profile_url)
 
         try:
             # Wait for agent name
-            xpath = "//h1[@class='cmp-agent__name']/a"
-            self.__b.wait_for_element((By.XPATH, xpath))
+            self.__b.wait_for_element((By.XPATH, BhhsScraper.__XP_NAME))
+            self.report_visit(profile_url, True)
         except TimeoutException:
             if check_url(self.__dr, profile_url):
                 xp_error = "//h2[contains(text(), '404 Error')]"
@@ -120,48 +316,294 @@ class BhhsScraper:
                     xp_error = "//h2[contains(text(), '404 Error')]"
                     self.__dr.find_element(By.XPATH, xp_error)
                     cprint("<y>Received 404 Error. Skipping...")
+                    self.report_visit(profile_url, True)
                     raise BadUrl
                 except NoSuchElementException:
                     # If bot genuinely fails and we are on the correct link, restart scraper
+                    self.report_visit(profile_url, False)
                     raise TimeoutException
             else:
                 # If bot didn't fail but we got redirected, skip this profile
+                # Redirects are often how throttling shows up, so slow down too
+                self.report_visit(profile_url, False)
                 cprint("<y>Redirected.")
                 cprint(f"F: <c>{profile_url}")
                 cprint(f"T: <r>{self.__dr.current_url}")
                 cprint("<y>Skipping...")
                 raise BadUrl
 
-    def get_agent_name(self):
-        xpath = "//h1[@class='cmp-agent__name']/a"
-        element = self.__dr.find_element(By.XPATH, xpath)
-        return element.get_attribute("textContent")
-
-    def get_agent_dre(self):
+    def transform_dre(self, license):
+        # Transforms "CA DRE# 01234567" to "#01234567"
+        result = re.search(r"\d+", license)
+        return "#" + result.group(0)
+
+    def get_agent_info_from_browser(self, profile_url):
+        self.go_to_profile(profile_url)
+
+        # Read every field in one round trip instead of one per field
+        fields = extract_fields(
+            self.__dr,
+            {
+                "name": BhhsScraper.__XP_NAME,
+                "dre": (BhhsScraper.__XP_DRE, "data-license"),
+                "phone": BhhsScraper.__XP_PHONE,
+                "email": BhhsScraper.__XP_EMAIL,
+            },
+        )
         try:
-            xpath = "//ul[contains(@class,'cmp-agent-details__license')]"
-            element = self.__dr.find_element(By.XPATH, xpath)
-            text = element.get_attribute("data-license")
-            result = re.search(r"\d+", text)
-            return "#" + result.group(0)
+            dre = self.transform_dre(fields["dre"])
         except:
-            return ""
-
-    def get_agent_phone(self):
+            dre = ""
+        return {
+            BhhsScraper.__COL_NAME_FULL: fields["name"] or "",
+            BhhsScraper.__COL_DRE: dre,
+            BhhsScraper.__COL_PHONE: fields["phone"] or "",
+            BhhsScraper.__COL_EMAIL: fields["email"] or "",
+        }
+
+    def get_agent_info_from_html(self, profile_url, entry=None):
+        # Same lookups as the get_agent_* methods, but on the static html
+        # Missing fields are left empty so the browser can fill them in
+        # entry is a stale cache entry, only re-scraped if the page changed
+        headers = self.__cache.get_validators(entry) if entry else {}
         try:
-            xpath = "//a[contains(@class,'cmp-agent-details__phone-number')]"
-            element = self.__dr.find_element(By.XPATH, xpath)
-            return element.get_attribute("textContent")
+            response = self.__http.get(profile_url, headers=headers)
         except:
-            return ""
+            return {}
+
+        if response.status_code == 304:
+            self.__cache.revalidated(profile_url)
+            return dict(entry["fields"])
+        if response.status_code == 404:
+            cprint("<y>Received 404 Error. Skipping...")
+            raise BadUrl
+        if self.__http.is_redirected(response, profile_url):
+            cprint("<y>Redirected.")
+            cprint(f"F: <c>{profile_url}")
+            cprint(f"T: <r>{response.url}")
+            cprint("<y>Skipping...")
+            raise BadUrl
+        if response.status_code != 200:
+            return {}
+
+        tree = self.__http.parse_html(response)
+        info = {}
+
+        names = tree.xpath(BhhsScraper.__XP_NAME)
+        if names:
+            info[BhhsScraper.__COL_NAME_FULL] = names[0].text_content()
+
+        licenses = tree.xpath(BhhsScraper.__XP_DRE)
+        if licenses and re.search(r"\d+", licenses[0].get("data-license", "")):
+            info[BhhsScraper.__COL_DRE] = self.transform_dre(
+                licenses[0].get("data-license")
+            )
+
+        phones = tree.xpath(BhhsScraper.__XP_PHONE)
+        if phones:
+            info[BhhsScraper.__COL_PHONE] = phones[0].text_content()
+
+        emails = tree.xpath(BhhsScraper.__XP_EMAIL)
+        if emails:
+            info[BhhsScraper.__COL_EMAIL] = emails[0].text_content()
+
+        # Keep the validators so the next run can ask if the page changed
+        if self.is_agent_info_complete(info):
+            self.cache_agent_info(profile_url, info, response)
+        return info
+
+    def is_agent_info_complete(self, info):
+        return all(
+            info.get(col)
+            for col in [
+                BhhsScraper.__COL_NAME_FULL,
+                BhhsScraper.__COL_DRE,
+                BhhsScraper.__COL_PHONE,
+                BhhsScraper.__COL_EMAIL,
+            ]
+        )
+
+    def get_cached_agent_info(self, profile_url):
+        # Returns the cached info if it's still fresh, and the cache entry
+        if not self.__cache:
+            return None, None
+        entry = self.__cache.get(profile_url)
+        if entry and self.__cache.is_fresh(entry):
+            return entry["fields"], entry
+        return None, entry
+
+    def cache_agent_info(self, profile_url, info, response=None):
+        if not self.__cache:
+            return
+        etag, last_modified = None, None
+        if response is not None:
+            etag, last_modified = self.__http.get_validators(response)
+        self.__cache.put(profile_url, info, etag, last_modified)
+
+    def get_agent_info(self, profile_url):
+        info, entry = self.get_cached_agent_info(profile_url)
+        if info:
+            return info
+
+        # Try the static html first when http mode is enabled
+        info = {}
+        if self.__http:
+            info = self.get_agent_info_from_html(profile_url, entry)
+
+        # Only render the page if the static html is missing a field
+        if not self.is_agent_info_complete(info):
+            browser_info = self.get_agent_info_from_browser(profile_url)
+            for col, value in browser_info.items():
+                info[col] = info.get(col) or value
+            self.cache_agent_info(profile_url, info)
+
+        return info
+
+    def get_carried_info(self, profile_url):
+        # Agents unchanged since the last run are copied from the old CSV
+        if self.__delta:
+            return self.__delta.get_carried(profile_url)
+        return None
+
+    def create_agent(self, loc, scrape_date, id, info):
+        # Copied agents keep the date they were actually scraped
+        full_name = info[BhhsScraper.__COL_NAME_FULL]
+        return BhhsScraper.__SCHEMA.create_agent(
+            {
+                BhhsScraper.__COL_LOCATION: loc,
+                BhhsScraper.__COL_SOURCE: BhhsScraper.__BASE_URL,
+                BhhsScraper.__COL_SCRAPE_DATE: info.get(
+                    BhhsScraper.__COL_SCRAPE_DATE, scrape_date
+                ),
+                BhhsScraper.__COL_ID: id,
+                BhhsScraper.__COL_NAME_FULL: full_name,
+                BhhsScraper.__COL_NAME_FIRST: full_name.split(" ")[0],
+                BhhsScraper.__COL_NAME_LAST: full_name.split(" ")[-1],
+                BhhsScraper.__COL_DRE: info[BhhsScraper.__COL_DRE],
+                BhhsScraper.__COL_PHONE: info[BhhsScraper.__COL_PHONE],
+                BhhsScraper.__COL_EMAIL: info[BhhsScraper.__COL_EMAIL],
+            }
+        )
+
+    def create_worker(self, chrome_options):
+        # Workers only visit profiles, so they don't need the proxy
+        return BhhsScraper(
+            chrome_options=chrome_options,
+            bmp_options=None,
+            locations=[],
+            timeout_default=self.__timeout_default,
+            http_options=self.__http_options,
+            lean_options=self.__lean_options,
+            rate_options=self.__rate_options,
+            cache_options=self.__cache_options,
+        )
+
+    def scrape_worker_profile(self, worker, profile_url):
+        # Workers can't restart the scraper, so retry the profile in place
+        if not profile_url:
+            return None
+        carried = self.get_carried_info(profile_url)
+        if carried:
+            return carried
+        for retry in range(4):
+            try:
+                return worker.get_agent_info(profile_url)
+            except BadUrl:
+                return None
+            except TimeoutException:
+                cprint(f"<y>Scrape failed to load. Retrying ({retry + 1})...")
+                worker.recover()
+        cprint(f"Scrape failed <r>3<w> times. Skipping url (<y>{profile_url}<w>)...")
+        return None
+
+    def scrape_with_pool(self, loc, scrape_date, ids, urls, agents, output, checkpoint):
+        if self.__pool is None:
+            self.__pool = WorkerPool(
+                self.create_worker,
+                self.__workers,
+                self.__chrome_options,
+                self.__pool_options,
+            )
+
+        def write(i, info):
+            agent = self.create_agent(loc, scrape_date, i, info)
+            agents.write_agent(output, agent)
+            checkpoint.done(i, output)
+            cprint(f"<c>{loc}<w> - <y>Agent { i + 1 } / { len(urls) }")
+
+        self.__pool.run(
+            ids,
+            lambda worker, i: self.scrape_worker_profile(worker, urls[i]),
+            write,
+            lambda i: checkpoint.skip(i, output),
+        )
+
+    async def scrape_agent_async(self, profile_url):
+        # Static html goes through the http pool, the browser only fills in gaps
+        if not profile_url:
+            return None
+        carried = self.get_carried_info(profile_url)
+        if carried:
+            return carried
+
+        info, entry = self.get_cached_agent_info(profile_url)
+        if info:
+            return info
+
+        info = {}
+        if self.__http:
+            try:
+                info = await self.__async.run(
+                    profile_url, self.get_agent_info_from_html, profile_url, entry
+                )
+            except BadUrl:
+                return None
+        if self.is_agent_info_complete(info):
+            return info
+
+        for retry in range(4):
+            try:
+                browser_info = await self.__async.run_browser(
+                    profile_url, self.get_agent_info_from_browser, profile_url
+                )
+                break
+            except BadUrl:
+                return None
+            except TimeoutException:
+                cprint(f"<y>Scrape failed to load. Recovering ({retry + 1})...")
+                if not await self.__async.run_browser(profile_url, self.recover):
+                    raise RestartScrape
+        else:
+            cprint(
+                f"Scrape failed <r>3<w> times. Skipping url (<y>{profile_url}<w>)..."
+            )
+            return None
+
+        for col, value in browser_info.items():
+            info[col] = info.get(col) or value
+        self.cache_agent_info(profile_url, info)
+        return info
+
+    def scrape_with_async(
+        self, loc, scrape_date, ids, urls, agents, output, checkpoint
+    ):
+        def write(i, info):
+            if info is None:
+                checkpoint.skip(i, output)
+                return
+            agent = self.create_agent(loc, scrape_date, i, info)
+            agents.write_agent(output, agent)
+            checkpoint.done(i, output)
+            cprint(f"<c>{loc}<w> - <y>Agent { i + 1 } / { len(urls) }")
 
-    def get_agent_email(self):
         try:
-            xpath = "//a[contains(@class,'cmp-agent-details__mail')]"
-            element = self.__dr.find_element(By.XPATH, xpath)
-            return element.get_attribute("textContent")
-        except:
-            return ""
+            self.__async.run_in_order(
+                ids, lambda i: self.scrape_agent_async(urls[i]), write
+            )
+        except (RestartScrape, WebDriverException):
+            # Save progress so the restart picks up at the first unwritten agent
+            checkpoint.save(output)
+            raise RestartScrape
 
     def scrape(self):
         cprint(f"Scraping <g>{BhhsScraper.__BASE_URL}<w>...")
@@ -172,20 +614,7 @@ class BhhsScraper:
         # Iterate over locations
         for loc in self.__loc:
             cprint(f"Scraping agents for location: <c>{loc}<w>...")
-            agents = Agents(
-                [
-                    BhhsScraper.__COL_LOCATION,
-                    BhhsScraper.__COL_SOURCE,
-                    BhhsScraper.__COL_SCRAPE_DATE,
-                    BhhsScraper.__COL_ID,
-                    BhhsScraper.__COL_NAME_FULL,
-                    BhhsScraper.__COL_NAME_FIRST,
-                    BhhsScraper.__COL_NAME_LAST,
-                    BhhsScraper.__COL_DRE,
-                    BhhsScraper.__COL_PHONE,
-                    BhhsScraper.__COL_EMAIL,
-                ]
-            )
+            agents = Agents(BhhsScraper.__SCHEMA, self.__store)
 
             page_loaded = False
             while not page_loaded:
@@ -201,105 +630,137 @@ class BhhsScraper:
                 except:
                     page_loaded = False
 
+            saved_urls = None
+            if agents.are_urls_saved("bhhs", loc):
+                saved_urls = agents.get_saved_urls("bhhs", loc)
+
+            # A delta diffs fresh urls against the last run, so it always
+            # searches again unless it's resuming
+            self.__delta = None
+            if self.__delta_options:
+                self.__delta = DeltaScrape(
+                    "bhhs", loc, **self.__delta_options, store=self.__store
+                )
+                if not self.__delta.can_start() or saved_urls is None:
+                    self.__delta = None
+
+            if self.__delta and self.__delta.is_running():
+                cprint(f"<c>{loc} - Resuming delta scrape...")
+                urls = self.__delta.get_urls()
             # Check if urls are saved in agent_urls/bhhs and confirm if array length matches agent count
-            if (
-                agents.are_urls_saved("bhhs", loc)
-                and len(agents.get_saved_urls("bhhs", loc)) == count
+            elif (
+                not self.__delta and saved_urls is not None and len(saved_urls) == count
             ):
                 cprint(f"Pulling agent urls (<c>agent_urls/bhhs/{loc}.json<w>)...")
-                urls = agents.get_saved_urls("bhhs", loc)
+                urls = saved_urls
             else:
-                cprint(f"<c>Retrieving agent urls from webpage...")
-                # Start recording HAR data before changing the view per page
-                # so we can grab the first query
-                self.__bmp.start_har(f"bhhs_{loc}")
-
-                # Set view per page so we don't have to iterate over so many requests
-                self.set_view_per_page(BhhsScraper.__VIEW_PER_PAGE)
-
-                # Load all agent queries
-                self.load_all_agents(count)
-
-                # Get the HAR data after loading all agents
-                har = self.__bmp.har()
-
-                # Get the list of urls to iterate over
-                urls = self.get_agent_urls(har)
+                urls = None
+                if self.__replay:
+                    cprint(f"<c>Retrieving agent urls from search api...")
+                    urls = self.get_agent_urls_from_api(loc, count)
+                    if urls is None:
+                        cprint(f"<y>Could not replay search api.")
+                        self.search_location(loc)
+
+                if urls is None:
+                    cprint(f"<c>Retrieving agent urls from webpage...")
+                    urls = self.get_agent_urls_from_webpage(loc, count)
+
+                # Record the old urls before they're overwritten, so a crash
+                # in between doesn't lose the delta's baseline
+                if self.__delta:
+                    self.__delta.start(saved_urls, urls)
 
                 # Save the links so we won't have to search for them again
                 cprint(f"Saving agent urls (<c>agent_urls/bhhs/{loc}.json<w>)...")
                 agents.save_urls("bhhs", loc, urls)
 
-            # Create file for writing
-            file_name = f"agent_data/bhhs/{loc}.csv"
-            os.makedirs("agent_data/bhhs", exist_ok=True)
-            output = open(file_name, "a+", encoding="utf-8")
+            # Open the CSV or store for writing
+            output_loc = loc
+            if self.__delta:
+                self.__delta.plan(BhhsScraper.__COL_ID)
+                output_loc = self.__delta.get_output_location()
+            checkpoint = agents.get_checkpoint("bhhs", output_loc)
+            output = checkpoint.open()
 
-            # Grab the last id of the CSV file
-            last_id = get_last_id_in_csv_file(file_name, BhhsScraper.__COL_ID)
+            # Grab the last id from the checkpoint
+            last_id = checkpoint.get_last_id(BhhsScraper.__COL_ID)
 
             if last_id == -1:
                 cprint(f"<c>{loc} - Agent 0 / { len(urls) }")
-                output.write(agents.get_headers_as_csv_string())
+                agents.write_headers(output)
             elif last_id + 1 != len(urls):
                 cprint(f"<c>{loc} - Continuing from Agent {last_id + 1}")
 
-            # for i in range(last_id + 1, 5): # For testing
-            for i in range(last_id + 1, len(urls)):
+            ids = list(range(last_id + 1, len(urls)))
+            # ids = list(range(last_id + 1, 5)) # For testing
+
+            # The pool and async paths scrape every id themselves, so the
+            # loop below only runs for sequential scrapes
+            if self.__async:
+                self.scrape_with_async(
+                    loc, scrape_date, ids, urls, agents, output, checkpoint
+                )
+                ids = []
+            elif self.__workers > 1:
+                self.scrape_with_pool(
+                    loc, scrape_date, ids, urls, agents, output, checkpoint
+                )
+                ids = []
+
+            for i in ids:
                 # Skip empty urls
                 if not urls[i]:
                     cprint(
                         f"<c>{loc}<w> - <y>Agent { i + 1 } / { len(urls) } (empty url)"
                     )
+                    checkpoint.skip(i, output)
                     continue
 
-                try:
-                    self.go_to_profile(urls[i])
-                    self.__retries = 0
-                except BadUrl:
-                    self.__retries = 0
-                    continue
-                except TimeoutException:
-                    if self.__retries >= 3:
-                        cprint(
-                            f"Scrape failed <r>3<w> times. Skipping url (<y>{urls[i]}<w>)..."
-                        )
+                info = self.get_carried_info(urls[i])
+                while info is None:
+                    try:
+                        info = self.get_agent_info(urls[i])
+                        self.__retries = 0
+                    except BadUrl:
                         self.__retries = 0
-                        continue
-                    else:
+                        break
+                    except TimeoutException:
+                        if self.__retries >= 3:
+                            cprint(
+                                f"Scrape failed <r>3<w> times. Skipping url (<y>{urls[i]}<w>)..."
+                            )
+                            self.__retries = 0
+                            break
                         cprint(
-                            f"<y>Scrape failed to load. Restarting ({self.__retries + 1})..."
+                            f"<y>Scrape failed to load. Recovering ({self.__retries + 1})..."
                         )
                         self.__retries += 1
-                    raise RestartScrape
 
-                # Gather info on agent profile page
-                full_name = self.get_agent_name()
-                first_name = full_name.split(" ")[0]
-                last_name = full_name.split(" ")[-1]
-                dre = self.get_agent_dre()
-                phone = self.get_agent_phone()
-                email = self.get_agent_email()
-
-                # Put all the agent agents into a props object
-                agent = {
-                    BhhsScraper.__COL_LOCATION: loc,
-                    BhhsScraper.__COL_SOURCE: BhhsScraper.__BASE_URL,
-                    BhhsScraper.__COL_SCRAPE_DATE: scrape_date,
-                    BhhsScraper.__COL_ID: i,
-                    BhhsScraper.__COL_NAME_FULL: full_name,
-                    BhhsScraper.__COL_NAME_FIRST: first_name,
-                    BhhsScraper.__COL_NAME_LAST: last_name,
-                    BhhsScraper.__COL_DRE: dre,
-                    BhhsScraper.__COL_PHONE: phone,
-                    BhhsScraper.__COL_EMAIL: email,
-                }
-
-                output.write(agents.get_agent_as_csv_string(agent))
+                        # Retry the same agent in a fresh tab
+                        if self.recover():
+                            continue
+
+                        # Save progress so the restart picks up at this agent
+                        checkpoint.save(output)
+                        raise RestartScrape
+
+                if info is None:
+                    checkpoint.skip(i, output)
+                    continue
+
+                agent = self.create_agent(loc, scrape_date, i, info)
+                agents.write_agent(output, agent)
+                checkpoint.done(i, output)
 
                 cprint(f"<c>{loc}<w> - <y>Agent { i + 1 } / { len(urls) }")
                 # End of iterating through agent profiles
 
+            checkpoint.save(output)
+            output.close()
+            if self.__delta:
+                self.__delta.finish(scrape_date)
+
             # End of iterating through locations
 
         cprint(f"Finished scraping <g>{BhhsScraper.__BASE_URL}<w>.")
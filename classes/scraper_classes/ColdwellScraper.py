@@ -1,9 +1,24 @@
-from python_utils import cprint, get_last_id_in_csv_file, get_todays_date
+from python_utils import cprint, get_todays_date
+from classes.Exceptions import RestartScrape
 from selenium_utils import SeleniumBase, exponential_backoff
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.common.by import By
-from .common import Agents
-import json
-import os
+from math import ceil
+from .common import (
+    Agents,
+    AgentSchema,
+    ApiReplay,
+    AsyncCore,
+    DeltaScrape,
+    HarStream,
+    HttpSession,
+    ResponseWaiter,
+    WorkerPool,
+    get_adaptive_rate_limiter,
+    get_agent_store,
+    get_profile_cache,
+    use_lean_browsing,
+)
 import re
 import urllib
 
@@ -25,12 +40,45 @@ class ColdwellScraper:
     __COL_EMAIL = "Email"
     __COL_URL = "Url"
 
+    # License line on the profile, eg. "CalRE# 01234567"
+    # Found the same way in the rendered page, the static html and its json
+    __XP_DRE = '//div[contains(text(), "CalRE")]'
+    __RE_DRE = re.compile(r"CalRE\D{0,20}(\d+)")
+
+    # Columns of the output CSV, in order
+    __SCHEMA = AgentSchema(
+        [
+            __COL_LOCATION,
+            __COL_SOURCE,
+            __COL_SCRAPE_DATE,
+            __COL_ID,
+            __COL_NAME_FULL,
+            __COL_NAME_FIRST,
+            __COL_NAME_LAST,
+            __COL_DRE,
+            __COL_PHONE_M,
+            __COL_PHONE_O,
+            __COL_EMAIL,
+            __COL_URL,
+        ]
+    )
+
     def __init__(
         self,
         chrome_options: dict,
         bmp_options: dict,
         locations: list,
         timeout_default: int = 10,
+        workers: int = 1,
+        lean_options: dict = None,
+        rate_options: dict = None,
+        cache_options: dict = None,
+        delta_options: dict = None,
+        store_options: dict = None,
+        http_options: dict = None,
+        async_options: dict = None,
+        replay_options: dict = None,
+        pool_options: dict = None,
     ):
         self.__b = SeleniumBase(
             chrome_options=chrome_options,
@@ -38,13 +86,78 @@ class ColdwellScraper:
             timeout_default=timeout_default,
         )
         self.__dr = self.__b.get_driver()
+        use_lean_browsing(self.__dr, lean_options)
         self.__bmp = self.__b.get_bmp()
         self.__loc = locations
 
+        # Wait on agents.json responses instead of page buttons
+        self.__waiter = ResponseWaiter(self.__dr, ["agents.json"])
+
+        # Learn the fastest safe request rate when options are given
+        # Workers share the limiter, so they slow down together
+        self.__rate_options = rate_options
+        self.__limiter = None
+        if rate_options:
+            self.__limiter = get_adaptive_rate_limiter(rate_options)
+
+        # Reuse DREs scraped on earlier runs when options are given
+        self.__cache_options = cache_options
+        self.__cache = None
+        if cache_options:
+            self.__cache = get_profile_cache(cache_options)
+
+        # Write agents and urls to a SQLite store instead of files when given
+        self.__store = get_agent_store(store_options) if store_options else None
+
+        # Only scrape agents that changed since the last run when options are given
+        self.__delta_options = delta_options
+        self.__delta = None
+
+        # Fetch DREs over plain http when options are given
+        # Profiles are Next.js pages, so their data comes as json from
+        # /_next/data/<build id>/<profile path>.json
+        self.__http_options = http_options
+        self.__http = None
+        if http_options:
+            self.__http = HttpSession(**http_options, limiter=self.__limiter)
+        self.__build_id = None
+
+        # Keep many DRE fetches in flight at once when options are given
+        # The rate limiter paces requests on its own, so it replaces the buckets
+        self.__async = None
+        if async_options:
+            self.__async = AsyncCore(async_options, self.__limiter)
+
+        # Request every agents.json page at once instead of clicking through
+        # the pages when options are given
+        self.__replay = None
+        if replay_options:
+            http = self.__http or HttpSession(**(http_options or {}))
+            self.__replay = ApiReplay(http, **replay_options)
+
+        # Visit profiles with several browsers at once when workers > 1
+        self.__chrome_options = chrome_options
+        self.__timeout_default = timeout_default
+        self.__lean_options = lean_options
+        self.__workers = workers
+        self.__pool_options = pool_options
+        self.__pool = None
+
     def close(self):
+        if self.__limiter:
+            self.__limiter.save()
+        if self.__cache:
+            self.__cache.save()
+        if self.__pool:
+            self.__pool.close()
+        if self.__async:
+            self.__async.close()
+        if self.__http:
+            self.__http.close()
         self.__dr.close()
         self.__dr.quit()
-        self.__bmp.close()
+        if self.__bmp:
+            self.__bmp.close()
 
     def transform_location(self, location):
         # Transforms "Los Angeles, CA" to "CA/Los%20Angeles/"
@@ -60,6 +173,16 @@ class ColdwellScraper:
         exponential_backoff(self.__dr, url)
         cprint(f"Loading <c>{location}<w> agents...")
 
+    def get_build_id(self):
+        # Next.js puts the build id in every page it renders
+        # Returns None if the page isn't a Next.js page
+        try:
+            return self.__dr.execute_script(
+                "return window.__NEXT_DATA__ ? window.__NEXT_DATA__.buildId : null;"
+            )
+        except WebDriverException:
+            return None
+
     def get_agent_count(self):
         xp_ctn_count = '//div[@id="header-container"]//h1'
         ctn_count = self.__b.wait_for_element((By.XPATH, xp_ctn_count))
@@ -67,7 +190,7 @@ class ColdwellScraper:
         count = count.split(" ")[0]
         return int(count)
 
-    def request_all_agents(self):
+    def request_all_agents(self, stream):
         # Grab last page number from button
         xp_last = "//nav/ul/li[last() - 1]/button"
         btn_last = self.__dr.find_element(By.XPATH, xp_last)
@@ -80,20 +203,60 @@ class ColdwellScraper:
             # Next page
             xp_pg = f'//nav/ul/li/button[@aria-label="Go to page {i}"]'
             btn_pg = self.__dr.find_element(By.XPATH, xp_pg)
-            btn_pg.click()
-            xp_cur = f'//nav/ul/li/button[@aria-label="page {i}"]'
-            self.__b.wait_for_element((By.XPATH, xp_cur))
+            if not self.__waiter.run_and_wait("agents.json", btn_pg.click):
+                xp_cur = f'//nav/ul/li/button[@aria-label="page {i}"]'
+                self.__b.wait_for_element((By.XPATH, xp_cur))
+
+            # Collect each page as it comes in so the HAR stays small
+            stream.wait_for_responses()
 
         # Go back to page 1 to load first agents.json
         cprint(f"<c>Page {i_last_page} / {i_last_page}")
         xp_pg = f'//nav/ul/li/button[@aria-label="Go to page 1"]'
         btn_pg = self.__dr.find_element(By.XPATH, xp_pg)
-        btn_pg.click()
-        xp_cur = f'//nav/ul/li/button[@aria-label="page 1"]'
-        self.__b.wait_for_element((By.XPATH, xp_cur))
+        if not self.__waiter.run_and_wait("agents.json", btn_pg.click):
+            xp_cur = f'//nav/ul/li/button[@aria-label="page 1"]'
+            self.__b.wait_for_element((By.XPATH, xp_cur))
+        stream.wait_for_responses()
 
         return
 
+    def get_agent_data_from_api(self, location, agent_count):
+        # Requests agents.json for every page straight from the Next.js data
+        # route, eg. /_next/data/<build id>/city/ca/davis/agents.json?page=2
+        # Returns None if any page couldn't be requested
+        url = f"{ColdwellScraper.__BASE_URL}/_next/data/{self.__build_id}"
+        url += f"/city/{self.transform_location(location)}/agents.json?page=1"
+        template = {
+            "request": {
+                "method": "GET",
+                "url": url,
+                "headers": [{"name": "x-nextjs-data", "value": "1"}],
+            }
+        }
+        paging = ("query", ("page",), 1, 1)
+
+        try:
+            first = self.__replay.request(template, paging, 1)
+            agent_data = self.get_agent_data_from_content(first)
+        except:
+            return None
+        # An empty first page is more likely a changed route than no agents
+        if not agent_data:
+            return None
+
+        # The rest of the pages are requested together
+        page_count = ceil(agent_count / len(agent_data))
+        cprint(f"<c>Requesting {page_count} pages of agents.json...")
+        contents = self.__replay.replay_pages(template, paging, page_count, 1)
+
+        for content in contents:
+            try:
+                agent_data += self.get_agent_data_from_content(content)
+            except:
+                return None
+        return agent_data
+
     def transform_phone_number(self, phone_number):
         # Remove the "+1"
         formatted_number = phone_number[2:]
@@ -105,48 +268,53 @@ class ColdwellScraper:
 
         return formatted_number
 
-    def get_agent_data_from_har(self, har):
-        # Filter the HAR data for network requests that have 'graphql' in the url
+    def get_agent_data_from_content(self, content):
+        # content is the json of one agents.json response
         data = []
-        for entry in har["log"]["entries"]:
-            if "agents.json" in entry["request"]["url"]:
-                content = json.loads(entry["response"]["content"]["text"])
-                results = content["pageProps"]["results"]["agents"]
-
-                for result in results:
-                    phone_m = (
-                        ""
-                        if "cellPhoneNumber" not in result
-                        else self.transform_phone_number(result["cellPhoneNumber"])
-                    )
-                    phone_o = (
-                        ""
-                        if "businessPhoneNumber" not in result
-                        else self.transform_phone_number(result["businessPhoneNumber"])
-                    )
-                    email = (
-                        "" if "emailAddress" not in result else result["emailAddress"]
-                    )
-                    data.append(
-                        {
-                            ColdwellScraper.__COL_NAME_FULL: result["fullName"],
-                            ColdwellScraper.__COL_PHONE_M: phone_m,
-                            ColdwellScraper.__COL_PHONE_O: phone_o,
-                            ColdwellScraper.__COL_EMAIL: email,
-                            ColdwellScraper.__COL_URL: f'{ColdwellScraper.__BASE_URL}{result["url"]}',
-                        }
-                    )
+        results = content["pageProps"]["results"]["agents"]
+
+        for result in results:
+            phone_m = (
+                ""
+                if "cellPhoneNumber" not in result
+                else self.transform_phone_number(result["cellPhoneNumber"])
+            )
+            phone_o = (
+                ""
+                if "businessPhoneNumber" not in result
+                else self.transform_phone_number(result["businessPhoneNumber"])
+            )
+            email = "" if "emailAddress" not in result else result["emailAddress"]
+            data.append(
+                {
+                    ColdwellScraper.__COL_NAME_FULL: result["fullName"],
+                    ColdwellScraper.__COL_PHONE_M: phone_m,
+                    ColdwellScraper.__COL_PHONE_O: phone_o,
+                    ColdwellScraper.__COL_EMAIL: email,
+                    ColdwellScraper.__COL_URL: f'{ColdwellScraper.__BASE_URL}{result["url"]}',
+                }
+            )
         return data
 
     def go_to_profile(self, profile_url):
-        # Multiple requests in a short amount of time could give an error
-        # Exponential backoff could be a solution to this error
-        exponential_backoff(self.__dr, profile_url)
+        if not self.__limiter:
+            # Multiple requests in a short amount of time could give an error
+            # Exponential backoff could be a solution to this error
+            exponential_backoff(self.__dr, profile_url)
+            return
+
+        # Go as fast as coldwellbanker.com has been letting us lately
+        self.__limiter.wait(profile_url)
+        try:
+            self.__dr.get(profile_url)
+            self.__limiter.success(profile_url)
+        except WebDriverException:
+            self.__limiter.failure(profile_url)
+            exponential_backoff(self.__dr, profile_url)
 
     def get_agent_dre(self):
         try:
-            xpath = '//div[contains(text(), "CalRE")]'
-            element = self.__dr.find_element(By.XPATH, xpath)
+            element = self.__dr.find_element(By.XPATH, ColdwellScraper.__XP_DRE)
             text = element.get_attribute("textContent")
             result = re.search(r"\d+", text)
             return result.group(0)
@@ -166,6 +334,189 @@ class ColdwellScraper:
         except:
             return ""
 
+    def get_data_url(self, profile_url):
+        # eg. https://www.coldwellbanker.com/ca/davis/agents/jane-doe/aid-123
+        #  to https://www.coldwellbanker.com/_next/data/<build id>/ca/davis/agents/jane-doe/aid-123.json
+        path = urllib.parse.urlsplit(profile_url).path.rstrip("/")
+        return f"{ColdwellScraper.__BASE_URL}/_next/data/{self.__build_id}{path}.json"
+
+    def get_agent_dre_from_http(self, profile_url, entry=None):
+        # Tries the profile's Next.js json, then its static html
+        # Returns None if neither had the DRE, so the browser can try, since
+        # the static html doesn't always carry what the page renders
+        # entry is a stale cache entry, only re-scraped if the page changed
+        urls = [profile_url]
+        if self.__build_id:
+            urls.insert(0, self.get_data_url(profile_url))
+
+        headers = self.__cache.get_validators(entry) if entry else {}
+        for url in urls:
+            try:
+                response = self.__http.get(url, headers=headers)
+            except:
+                continue
+            if response.status_code == 304:
+                self.__cache.revalidated(profile_url)
+                return entry["fields"][ColdwellScraper.__COL_DRE]
+            if response.status_code != 200:
+                continue
+
+            result = ColdwellScraper.__RE_DRE.search(response.text)
+            if result:
+                # Keep the validators so the next run can ask if the page changed
+                self.cache_dre(profile_url, result.group(1), response)
+                return result.group(1)
+        return None
+
+    def get_agent_dre_from_browser(self, profile_url):
+        self.go_to_profile(profile_url)
+        return self.get_agent_dre()
+
+    def get_cached_dre(self, profile_url):
+        # Everything else comes from agents.json, so only the DRE is cached
+        # Returns the DRE, or None if it has to be scraped, and the cache entry
+        if not self.__cache:
+            return None, None
+        entry = self.__cache.get(profile_url)
+        if entry and self.__cache.is_fresh(entry):
+            return entry["fields"][ColdwellScraper.__COL_DRE], entry
+        return None, entry
+
+    def cache_dre(self, profile_url, dre, response=None):
+        if not self.__cache or not dre:
+            return
+        etag, last_modified = None, None
+        if response is not None:
+            etag, last_modified = self.__http.get_validators(response)
+        self.__cache.put(
+            profile_url, {ColdwellScraper.__COL_DRE: dre}, etag, last_modified
+        )
+
+    def get_agent_dre_from_profile(self, profile_url):
+        dre, entry = self.get_cached_dre(profile_url)
+        if dre is not None:
+            return dre
+
+        # Only render the profile if http didn't find the DRE
+        if self.__http:
+            dre = self.get_agent_dre_from_http(profile_url, entry)
+        if dre is None:
+            dre = self.get_agent_dre_from_browser(profile_url)
+            self.cache_dre(profile_url, dre)
+        return dre
+
+    def get_dre(self, scraper, data, scrape_date):
+        # Returns the agent's DRE and the date it was scraped
+        # Agents unchanged since the last run keep the DRE from the old CSV
+        url = data[ColdwellScraper.__COL_URL]
+        carried = self.__delta.get_carried(url) if self.__delta else None
+        if carried:
+            return (
+                carried[ColdwellScraper.__COL_DRE],
+                carried[ColdwellScraper.__COL_SCRAPE_DATE],
+            )
+        return scraper.get_agent_dre_from_profile(url), scrape_date
+
+    def create_agent(self, loc, scrape_date, id, data, dre):
+        # data is an entry from get_agent_data_from_har
+        full_name = data[ColdwellScraper.__COL_NAME_FULL]
+        return ColdwellScraper.__SCHEMA.create_agent(
+            {
+                ColdwellScraper.__COL_LOCATION: loc,
+                ColdwellScraper.__COL_SOURCE: ColdwellScraper.__BASE_URL,
+                ColdwellScraper.__COL_SCRAPE_DATE: scrape_date,
+                ColdwellScraper.__COL_ID: id,
+                ColdwellScraper.__COL_NAME_FULL: full_name,
+                ColdwellScraper.__COL_NAME_FIRST: full_name.split(" ")[0],
+                ColdwellScraper.__COL_NAME_LAST: full_name.split(" ")[-1],
+                ColdwellScraper.__COL_DRE: dre,
+                ColdwellScraper.__COL_PHONE_M: data[ColdwellScraper.__COL_PHONE_M],
+                ColdwellScraper.__COL_PHONE_O: data[ColdwellScraper.__COL_PHONE_O],
+                ColdwellScraper.__COL_EMAIL: data[ColdwellScraper.__COL_EMAIL],
+                ColdwellScraper.__COL_URL: data[ColdwellScraper.__COL_URL],
+            }
+        )
+
+    def create_worker(self, chrome_options):
+        # Workers only visit profiles, so they don't need the proxy
+        return ColdwellScraper(
+            chrome_options=chrome_options,
+            bmp_options=None,
+            locations=[],
+            timeout_default=self.__timeout_default,
+            lean_options=self.__lean_options,
+            rate_options=self.__rate_options,
+            cache_options=self.__cache_options,
+            http_options=self.__http_options,
+        )
+
+    def scrape_with_pool(
+        self, loc, scrape_date, ids, agent_data, agents, output, checkpoint
+    ):
+        if self.__pool is None:
+            self.__pool = WorkerPool(
+                self.create_worker,
+                self.__workers,
+                self.__chrome_options,
+                self.__pool_options,
+            )
+
+        def write(i, result):
+            dre, date = result
+            agent = self.create_agent(loc, date, i, agent_data[i], dre)
+            agents.write_agent(output, agent)
+            checkpoint.done(i, output)
+            cprint(f"<c>{loc} - Agent { i + 1 } / { len(agent_data) }")
+
+        self.__pool.run(
+            ids,
+            lambda worker, i: self.get_dre(worker, agent_data[i], scrape_date),
+            write,
+        )
+
+    async def get_dre_async(self, data, scrape_date):
+        # Same as get_dre, with the http fetches running side by side
+        # and the browser only used for profiles http couldn't fetch
+        url = data[ColdwellScraper.__COL_URL]
+        carried = self.__delta.get_carried(url) if self.__delta else None
+        if carried:
+            return (
+                carried[ColdwellScraper.__COL_DRE],
+                carried[ColdwellScraper.__COL_SCRAPE_DATE],
+            )
+
+        dre, entry = self.get_cached_dre(url)
+        if dre is not None:
+            return dre, scrape_date
+
+        if self.__http:
+            dre = await self.__async.run(url, self.get_agent_dre_from_http, url, entry)
+        if dre is None:
+            dre = await self.__async.run_browser(
+                url, self.get_agent_dre_from_browser, url
+            )
+            self.cache_dre(url, dre)
+        return dre, scrape_date
+
+    def scrape_with_async(
+        self, loc, scrape_date, ids, agent_data, agents, output, checkpoint
+    ):
+        def write(i, result):
+            dre, date = result
+            agent = self.create_agent(loc, date, i, agent_data[i], dre)
+            agents.write_agent(output, agent)
+            checkpoint.done(i, output)
+            cprint(f"<c>{loc} - Agent { i + 1 } / { len(agent_data) }")
+
+        try:
+            self.__async.run_in_order(
+                ids, lambda i: self.get_dre_async(agent_data[i], scrape_date), write
+            )
+        except WebDriverException:
+            # Save progress so the restart picks up at the first unwritten agent
+            checkpoint.save(output)
+            raise RestartScrape
+
     def scrape(self):
         cprint(f"Scraping <g>{ColdwellScraper.__BASE_URL}<w>...")
 
@@ -175,100 +526,123 @@ class ColdwellScraper:
         # Iterate over locations
         for loc in self.__loc:
             cprint(f"Scraping agents for location: <c>{loc}<w>...")
-            agents = Agents(
-                [
-                    ColdwellScraper.__COL_LOCATION,
-                    ColdwellScraper.__COL_SOURCE,
-                    ColdwellScraper.__COL_SCRAPE_DATE,
-                    ColdwellScraper.__COL_ID,
-                    ColdwellScraper.__COL_NAME_FULL,
-                    ColdwellScraper.__COL_NAME_FIRST,
-                    ColdwellScraper.__COL_NAME_LAST,
-                    ColdwellScraper.__COL_DRE,
-                    ColdwellScraper.__COL_PHONE_M,
-                    ColdwellScraper.__COL_PHONE_O,
-                    ColdwellScraper.__COL_EMAIL,
-                    ColdwellScraper.__COL_URL,
-                ]
-            )
+            agents = Agents(ColdwellScraper.__SCHEMA, self.__store)
 
             self.search_location(loc)
             agent_count = self.get_agent_count()
+            self.__build_id = self.get_build_id()
 
             agent_data = []
             # Check if urls are saved in agent_urls/coldwell and confirm if array length matches agent count
             if agents.are_urls_saved("coldwell", loc):
                 agent_data = agents.get_saved_urls("coldwell", loc)
-            if len(agent_data) == agent_count:
+
+            # A delta diffs fresh agent data against the last run, so it
+            # always requests it again unless it's resuming
+            self.__delta = None
+            if self.__delta_options and agent_data:
+                self.__delta = DeltaScrape(
+                    "coldwell", loc, **self.__delta_options, store=self.__store
+                )
+                if not self.__delta.can_start():
+                    self.__delta = None
+
+            if self.__delta and self.__delta.is_running():
+                cprint(f"<c>{loc} - Resuming delta scrape...")
+            elif not self.__delta and len(agent_data) == agent_count:
                 cprint(f"Pulling agent data (<c>agent_urls/coldwell/{loc}.json<w>)...")
             else:
-                cprint(f"<c>Retrieving agent data from network requests...")
-
-                # Start recording HAR data before requesting agents
-                self.__bmp.start_har(ColdwellScraper.__BASE_URL)
+                old_data = agent_data
+                agent_data = None
+                if self.__replay and self.__build_id:
+                    cprint(f"<c>Retrieving agent data from agents.json...")
+                    agent_data = self.get_agent_data_from_api(loc, agent_count)
+                    if agent_data is None:
+                        cprint(f"<y>Could not request agents.json directly.")
+
+                if agent_data is None:
+                    cprint(f"<c>Retrieving agent data from network requests...")
+
+                    # Start recording HAR data before requesting agents
+                    stream = HarStream(
+                        self.__bmp,
+                        ColdwellScraper.__BASE_URL,
+                        "agents.json",
+                        self.get_agent_data_from_content,
+                    )
+                    stream.start()
 
-                self.request_all_agents()
+                    self.request_all_agents(stream)
 
-                agent_data = self.get_agent_data_from_har(self.__bmp.har())
+                    agent_data = stream.get_results()
 
                 if len(agent_data) != agent_count:
                     cprint(f"<y>Warning: len(agent_data) != agent_count")
                     cprint(f"<y>{loc} - len(agent_data): {len(agent_data)}")
                     cprint(f"<y>{loc} - agent_count: {agent_count}")
-                    continue
-                else:
-                    agents.save_urls("coldwell", loc, agent_data)
+                    # The count on the page drifts, a delta can live with that
+                    if not self.__delta:
+                        continue
+
+                # Record the old urls before they're overwritten, so a crash
+                # in between doesn't lose the delta's baseline
+                if self.__delta:
+                    self.__delta.start(
+                        [data[ColdwellScraper.__COL_URL] for data in old_data],
+                        [data[ColdwellScraper.__COL_URL] for data in agent_data],
+                    )
+                agents.save_urls("coldwell", loc, agent_data)
 
-            # Create file for writing
-            file_name = f"agent_data/coldwell/{loc}.csv"
-            os.makedirs("agent_data/coldwell", exist_ok=True)
-            output = open(file_name, "a+", encoding="utf-8")
+            # Open the CSV or store for writing
+            output_loc = loc
+            if self.__delta:
+                self.__delta.plan(
+                    ColdwellScraper.__COL_ID,
+                    lambda row: row[ColdwellScraper.__COL_URL],
+                )
+                output_loc = self.__delta.get_output_location()
+            checkpoint = agents.get_checkpoint("coldwell", output_loc)
+            output = checkpoint.open()
 
-            # Grab the last id of the CSV file
-            last_id = get_last_id_in_csv_file(file_name, ColdwellScraper.__COL_ID)
+            # Grab the last id from the checkpoint
+            last_id = checkpoint.get_last_id(ColdwellScraper.__COL_ID)
 
             if last_id == -1:
-                cprint(f"<c>{loc} - Agent 0 / { agent_count }")
-                output.write(agents.get_headers_as_csv_string())
-            elif last_id + 1 != agent_count:
+                cprint(f"<c>{loc} - Agent 0 / { len(agent_data) }")
+                agents.write_headers(output)
+            elif last_id + 1 != len(agent_data):
                 cprint(f"<c>{loc} - Continuing from Agent {last_id + 1}")
 
-            for i in range(last_id + 1, agent_count):
-                self.go_to_profile(agent_data[i][ColdwellScraper.__COL_URL])
-
-                # Gather info on agent profile page
-                full_name = agent_data[i][ColdwellScraper.__COL_NAME_FULL]
-                first_name = full_name.split(" ")[0]
-                last_name = full_name.split(" ")[-1]
-                dre = self.get_agent_dre()
-
-                # Put all the agent agents into a props object
-                agent = {
-                    ColdwellScraper.__COL_LOCATION: loc,
-                    ColdwellScraper.__COL_SOURCE: ColdwellScraper.__BASE_URL,
-                    ColdwellScraper.__COL_SCRAPE_DATE: scrape_date,
-                    ColdwellScraper.__COL_ID: i,
-                    ColdwellScraper.__COL_NAME_FULL: full_name,
-                    ColdwellScraper.__COL_NAME_FIRST: first_name,
-                    ColdwellScraper.__COL_NAME_LAST: last_name,
-                    ColdwellScraper.__COL_DRE: dre,
-                    ColdwellScraper.__COL_PHONE_M: agent_data[i][
-                        ColdwellScraper.__COL_PHONE_M
-                    ],
-                    ColdwellScraper.__COL_PHONE_O: agent_data[i][
-                        ColdwellScraper.__COL_PHONE_O
-                    ],
-                    ColdwellScraper.__COL_EMAIL: agent_data[i][
-                        ColdwellScraper.__COL_EMAIL
-                    ],
-                    ColdwellScraper.__COL_URL: agent_data[i][ColdwellScraper.__COL_URL],
-                }
-
-                output.write(agents.get_agent_as_csv_string(agent))
-
-                cprint(f"<c>{loc} - Agent { i + 1 } / { agent_count }")
+            ids = list(range(last_id + 1, len(agent_data)))
+
+            # The pool and async paths scrape every id themselves, so the
+            # loop below only runs for sequential scrapes
+            if self.__async:
+                self.scrape_with_async(
+                    loc, scrape_date, ids, agent_data, agents, output, checkpoint
+                )
+                ids = []
+            elif self.__workers > 1:
+                self.scrape_with_pool(
+                    loc, scrape_date, ids, agent_data, agents, output, checkpoint
+                )
+                ids = []
+
+            for i in ids:
+                dre, date = self.get_dre(self, agent_data[i], scrape_date)
+
+                agent = self.create_agent(loc, date, i, agent_data[i], dre)
+                agents.write_agent(output, agent)
+                checkpoint.done(i, output)
+
+                cprint(f"<c>{loc} - Agent { i + 1 } / { len(agent_data) }")
                 # End of iterating through agent profiles
 
+            checkpoint.save(output)
+            output.close()
+            if self.__delta:
+                self.__delta.finish(scrape_date)
+
             # End of iterating through locations
 
         cprint(f"Finished scraping <g>{ColdwellScraper.__BASE_URL}<w>.")
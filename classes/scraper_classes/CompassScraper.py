@@ -1,15 +1,39 @@
-from python_utils import cprint, get_last_id_in_csv_file, get_todays_date
+from python_utils import cprint, get_todays_date
 from selenium_utils import SeleniumBase
 from selenium.webdriver.common.by import By
-from classes.scraper_classes.common.agents import Agents
-import os
+from classes.Exceptions import RestartScrape
+from classes.scraper_classes.common import (
+    Agents,
+    AgentSchema,
+    ApiReplay,
+    HttpSession,
+    ResponseWaiter,
+    extract_cards,
+    get_agent_store,
+    use_lean_browsing,
+)
+from math import ceil
+import json
 import re
 
 
 # Class for scraping compass.com
+#
+# The agent search page loads its results from a search api. With
+# replay_options the first two pages of that api are captured in the page,
+# and the rest are requested straight from the api, several at a time.
+# The first page's records are checked against its agent cards first, and
+# when they don't read the same, or without replay_options, the pages are
+# clicked through and read from the DOM
 class CompassScraper:
     __BASE_URL = "https://www.compass.com"
 
+    # Agent search api the search page calls
+    __API_PATTERN = "/api/v3/agents/search"
+
+    # Pages requested at once before they're written and checkpointed
+    __PAGES_PER_BATCH = 10
+
     # Column Headers
     __COL_LOCATION = "Location"
     __COL_SOURCE = "Source"
@@ -22,15 +46,52 @@ class CompassScraper:
     __COL_PHONE = "Phone"
     __COL_EMAIL = "Email"
 
+    # Columns of the output CSV, in order
+    __SCHEMA = AgentSchema(
+        [
+            __COL_LOCATION,
+            __COL_SOURCE,
+            __COL_SCRAPE_DATE,
+            __COL_ID,
+            __COL_NAME_FULL,
+            __COL_NAME_FIRST,
+            __COL_NAME_LAST,
+            __COL_DRE,
+            __COL_PHONE,
+            __COL_EMAIL,
+        ]
+    )
+
     def __init__(
-        self, chrome_options: dict, locations: list, timeout_default: int = 10
+        self,
+        chrome_options: dict,
+        locations: list,
+        timeout_default: int = 10,
+        lean_options: dict = None,
+        http_options: dict = None,
+        replay_options: dict = None,
+        store_options: dict = None,
     ):
         self.__b = SeleniumBase(
             chrome_options=chrome_options, timeout_default=timeout_default
         )
         self.__dr = self.__b.get_driver()
+        use_lean_browsing(self.__dr, lean_options)
         self.__loc = locations
 
+        # There's no proxy, so the search api is captured in the page
+        self.__waiter = ResponseWaiter(self.__dr, [CompassScraper.__API_PATTERN])
+
+        # Write agents to a SQLite store instead of files when options are given
+        self.__store = get_agent_store(store_options) if store_options else None
+
+        # Request search result pages straight from the api when options are given
+        self.__http = None
+        self.__replay = None
+        if replay_options:
+            self.__http = HttpSession(**(http_options or {}))
+            self.__replay = ApiReplay(self.__http, **replay_options)
+
     def transform_location(self, location):
         # Transforms 'Los Angeles, CA' to 'los-angeles_ca'
         # This transformation is necessary for getting to the right
@@ -48,24 +109,235 @@ class CompassScraper:
         link = self.__b.wait_until_clickable(
             (By.XPATH, f"//ul//a[contains(@href, '{location_url}')]")
         )
-        link.click()
+        self.__waiter.run_and_wait(CompassScraper.__API_PATTERN, link.click)
 
     def get_agent_count(self):
         agent_count = self.__dr.find_element(
             By.XPATH, "//h1[contains(@class, 'searchResults-count')]"
         )
-        return agent_count.get_attribute("textContent").split(" ")[0]
+        count = agent_count.get_attribute("textContent").split(" ")[0]
+        return int(count.replace(",", ""))
 
     def get_page_count(self):
         last_page = self.__dr.find_element(By.XPATH, "//nav/button[last() - 1]")
         return int(last_page.get_attribute("aria-label").split(" ")[-1])
 
     def get_agents_on_page(self):
-        return self.__dr.find_elements(By.XPATH, "//div[@class='agentCard']")
+        # Every card's fields come back from one script instead of
+        # a find_element per field per card
+        return extract_cards(
+            self.__dr,
+            "//div[@class='agentCard']",
+            {
+                "name": ".//div[contains(@class, 'agentCard-name')]",
+                "phone": ".//a[contains(@class, 'agentCard-phone')]",
+                "email": ".//a[contains(@class, 'agentCard-email')]",
+                "title": ".//div[contains(@class, 'agentCard-title')]",
+            },
+        )
 
     def next_page(self):
         next = self.__dr.find_element(By.XPATH, "//nav/button[last()]")
-        next.click()
+        self.__waiter.run_and_wait(CompassScraper.__API_PATTERN, next.click)
+
+    def get_agent_info_from_card(self, card):
+        # card is a dict from get_agents_on_page
+        try:
+            dre = card["title"].split("DRE# ")[1]
+        except:
+            dre = ""
+        return {
+            "name": (card["name"] or "").strip(),
+            "phone": re.sub(r"M:\s+", "", (card["phone"] or "").strip()),
+            "email": (card["email"] or "").strip(),
+            "dre": dre.strip(),
+        }
+
+    def get_records(self, content):
+        # eg. {"agents": [...], "totalCount": 1843}
+        return content.get("agents") or []
+
+    def normalize_value(self, key, value):
+        # How agent cards and api records are compared
+        if key == "phone":
+            return "".join(filter(str.isdigit, value))[-10:]
+        return " ".join(value.lower().split())
+
+    def records_match(self, records, cards):
+        # Checks the api's records read the same as the agent cards they
+        # were shown as, so a renamed key isn't written blank
+        if not records or len(records) != len(cards):
+            return False
+        for record, card in zip(records, cards):
+            from_record = self.get_agent_info_from_record(record)
+            from_card = self.get_agent_info_from_card(card)
+            if not from_record["name"]:
+                return False
+            for key, value in from_card.items():
+                expected = self.normalize_value(key, value)
+                if expected and self.normalize_value(key, from_record[key]) != expected:
+                    return False
+        return True
+
+    def get_agent_info_from_record(self, record):
+        # Reads one agent record of the search api
+        name = record.get("displayName") or record.get("name") or ""
+        phone = record.get("mobilePhone") or record.get("phone") or ""
+        dre = record.get("licenseNumber") or ""
+        if not dre:
+            result = re.search(r"DRE# (\S+)", record.get("title") or "")
+            dre = result.group(1) if result else ""
+        return {
+            "name": name.strip(),
+            "phone": phone.strip(),
+            "email": (record.get("email") or "").strip(),
+            "dre": dre.strip(),
+        }
+
+    def create_agent(self, agents, loc, scrape_date, id, info):
+        full_name = info["name"]
+        return agents.create_agent(
+            {
+                CompassScraper.__COL_LOCATION: loc,
+                CompassScraper.__COL_SOURCE: CompassScraper.__BASE_URL,
+                CompassScraper.__COL_SCRAPE_DATE: scrape_date,
+                CompassScraper.__COL_ID: id,
+                CompassScraper.__COL_NAME_FULL: full_name,
+                CompassScraper.__COL_NAME_FIRST: full_name.split(" ")[0],
+                CompassScraper.__COL_NAME_LAST: full_name.split(" ")[-1],
+                CompassScraper.__COL_DRE: info["dre"],
+                CompassScraper.__COL_PHONE: info["phone"],
+                CompassScraper.__COL_EMAIL: info["email"],
+            }
+        )
+
+    def get_api_template(self):
+        # Captures the first two pages of the search api
+        # Returns (first request, its json, paging) or None if it can't be replayed
+        try:
+            cards = self.get_agents_on_page()
+            self.next_page()
+        except:
+            return None
+        entries = [
+            entry
+            for entry in self.__waiter.get_entries(CompassScraper.__API_PATTERN)
+            if entry["response"]["status"] == 200
+        ]
+        if len(entries) < 2:
+            return None
+
+        first, second = entries[-2], entries[-1]
+        try:
+            content = json.loads(first["response"]["content"]["text"])
+        except:
+            return None
+        if not self.records_match(self.get_records(content), cards):
+            cprint("<y>Search api records don't match the agent cards.")
+            return None
+
+        page_size = len(self.get_records(content))
+        paging = self.__replay.get_paging(first, second, page_size)
+        if paging is None:
+            return None
+
+        # The captured requests don't carry the browser's cookies
+        cookies = "; ".join(
+            f"{cookie['name']}={cookie['value']}" for cookie in self.__dr.get_cookies()
+        )
+        first["request"]["headers"].append({"name": "Cookie", "value": cookies})
+
+        # Replay the second page and check it against the cards now on
+        # screen, so a wrong paging guess isn't replayed for every page
+        replayed = self.__replay.replay_pages(first, paging, 2, 1)[0]
+        if replayed is None or not self.records_match(
+            self.get_records(replayed), self.get_agents_on_page()
+        ):
+            cprint("<y>Replayed search api pages don't match the agent cards.")
+            return None
+        return first, content, paging
+
+    def scrape_from_api(self, loc, scrape_date, agents, output, checkpoint, last_id):
+        # Returns False if the api couldn't be replayed
+        captured = self.get_api_template()
+        if captured is None:
+            return False
+        template, first, paging = captured
+
+        try:
+            agent_count = self.get_agent_count()
+        except:
+            return False
+        page_size = len(self.get_records(first))
+        if page_size == 0:
+            return True
+        page_count = ceil(agent_count / page_size)
+
+        # Ids are positions in the search results, so resuming starts at
+        # the page holding the next id
+        first_page = (last_id + 1) // page_size
+        if last_id + 1 >= agent_count:
+            first_page = page_count
+        for batch in range(first_page, page_count, CompassScraper.__PAGES_PER_BATCH):
+            end = min(batch + CompassScraper.__PAGES_PER_BATCH, page_count)
+            cprint(f"<c>{loc} - Pages {batch + 1}-{end} / {page_count}")
+
+            # The first page already came in with the search
+            if batch == 0:
+                contents = [first] + self.__replay.replay_pages(
+                    template, paging, end, 1
+                )
+            else:
+                contents = self.__replay.replay_pages(template, paging, end, batch)
+
+            for page, content in zip(range(batch, end), contents):
+                if content is None:
+                    cprint(f"<r>{loc} - Could not load page {page + 1}.")
+
+                    # Save progress so the restart picks up at this page
+                    checkpoint.save(output)
+                    output.close()
+                    raise RestartScrape
+
+                for n, record in enumerate(self.get_records(content)):
+                    i = page * page_size + n
+                    if i <= last_id:
+                        continue
+                    info = self.get_agent_info_from_record(record)
+                    agent = self.create_agent(agents, loc, scrape_date, i, info)
+                    agents.write_agent(output, agent)
+                    checkpoint.done(i, output)
+
+            checkpoint.save(output)
+            cprint(
+                f"<c>{loc}<w> - <y>Agent {min(end * page_size, agent_count)} / {agent_count}"
+            )
+        return True
+
+    def scrape_from_pages(self, loc, scrape_date, agents, output, checkpoint, last_id):
+        try:
+            page_count = self.get_page_count()
+        except:
+            cprint(f"<c>{loc} - 0 pages")
+            return
+
+        id = 0
+        # Iterate over pages
+        for p in range(1, page_count + 1):
+            cprint(f"<c>{loc} - Page: {p} / {page_count}")
+            agents_on_page = self.get_agents_on_page()
+
+            # Iterate over agents
+            for a in agents_on_page:
+                if id > last_id:
+                    info = self.get_agent_info_from_card(a)
+                    agent = self.create_agent(agents, loc, scrape_date, id, info)
+                    agents.write_agent(output, agent)
+                    checkpoint.done(id, output)
+                id += 1
+
+            if p < page_count:
+                self.next_page()
 
     def scrape(self):
         cprint("<g>Scraping compass.com...")
@@ -76,91 +348,41 @@ class CompassScraper:
         # Iterate over locations
         for loc in self.__loc:
             self.search_location(loc)
-            agents = Agents(
-                [
-                    CompassScraper.__COL_LOCATION,
-                    CompassScraper.__COL_SOURCE,
-                    CompassScraper.__COL_SCRAPE_DATE,
-                    CompassScraper.__COL_ID,
-                    CompassScraper.__COL_NAME_FULL,
-                    CompassScraper.__COL_NAME_FIRST,
-                    CompassScraper.__COL_NAME_LAST,
-                    CompassScraper.__COL_DRE,
-                    CompassScraper.__COL_PHONE,
-                    CompassScraper.__COL_EMAIL,
-                ]
-            )
+            agents = Agents(CompassScraper.__SCHEMA, self.__store)
+
+            # Open the CSV or store for writing
+            checkpoint = agents.get_checkpoint("compass", loc)
+            output = checkpoint.open()
+
+            # Grab the last id from the checkpoint
+            last_id = checkpoint.get_last_id(CompassScraper.__COL_ID)
+
+            if last_id == -1:
+                agents.write_headers(output)
+            else:
+                cprint(f"<c>{loc} - Continuing from Agent {last_id + 1}")
+
+            done = False
+            if self.__replay:
+                done = self.scrape_from_api(
+                    loc, scrape_date, agents, output, checkpoint, last_id
+                )
+                if not done:
+                    cprint(f"<y>Could not replay search api.")
+                    self.search_location(loc)
+
+            if not done:
+                self.scrape_from_pages(
+                    loc, scrape_date, agents, output, checkpoint, last_id
+                )
 
-            try:
-                page_count = self.get_page_count()
-            except:
-                cprint(f"<c>{loc} - 0 pages")
-                continue
-
-            # Create file for writing
-            file_name = f"agent_data/compass/{loc}.csv"
-            os.makedirs("agent_data/compass", exist_ok=True)
-            output = open(file_name, "w", encoding="utf-8")
-
-            id = 0
-            # Iterate over pages
-            for p in range(1, page_count + 1):
-                cprint(f"<c>{loc} - Page: {p} / {page_count}")
-                agents_on_page = self.get_agents_on_page()
-
-                # Iterate over agents
-                for a in agents_on_page:
-                    full_name = a.find_element(
-                        By.XPATH, ".//div[contains(@class, 'agentCard-name')]"
-                    ).get_attribute("textContent")
-                    full_name = full_name.strip()
-                    first_name = full_name.split(" ")[0]
-                    last_name = full_name.split(" ")[-1]
-                    try:
-                        phone = a.find_element(
-                            By.XPATH, ".//a[contains(@class, 'agentCard-phone')]"
-                        ).get_attribute("textContent")
-                        phone = phone.strip()
-                        phone = re.sub("M:\s+", "", phone)
-                    except:
-                        phone = ""
-                    try:
-                        email = a.find_element(
-                            By.XPATH, ".//a[contains(@class, 'agentCard-email')]"
-                        ).get_attribute("textContent")
-                        email = email.strip()
-                    except:
-                        email = ""
-                    try:
-                        dre = a.find_element(
-                            By.XPATH, ".//div[contains(@class, 'agentCard-title')]"
-                        )
-                        dre = dre.get_attribute("textContent")
-                        dre = dre.split("DRE# ")
-                        dre = dre[1]
-                    except:
-                        dre = ""
-                    agent = {
-                        CompassScraper.__COL_LOCATION: loc,
-                        CompassScraper.__COL_SOURCE: CompassScraper.__BASE_URL,
-                        CompassScraper.__COL_SCRAPE_DATE: scrape_date,
-                        CompassScraper.__COL_ID: id,
-                        CompassScraper.__COL_NAME_FULL: full_name,
-                        CompassScraper.__COL_NAME_FIRST: first_name,
-                        CompassScraper.__COL_NAME_LAST: last_name,
-                        CompassScraper.__COL_DRE: dre,
-                        CompassScraper.__COL_PHONE: phone,
-                        CompassScraper.__COL_EMAIL: email,
-                    }
-
-                    output.write(agents.get_agent_as_csv_string(agent))
-                    id += 1
-
-                if p < page_count:
-                    self.next_page()
+            checkpoint.save(output)
+            output.close()
 
         cprint("<g>Finished scraping compass.com!")
 
     def close(self):
+        if self.__http:
+            self.__http.close()
         self.__dr.close()
         self.__dr.quit()
@@ -1,10 +1,23 @@
-from python_utils import cprint, get_last_id_in_csv_file, get_todays_date
+from python_utils import cprint, get_todays_date
+from classes.Exceptions import RestartScrape
 from selenium_utils import SeleniumBase
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.by import By
-from .common.agents import Agents
+from .common import (
+    Agents,
+    AgentSchema,
+    ApiReplay,
+    HarStream,
+    HttpSession,
+    ResponseWaiter,
+    WorkerPool,
+    extract_fields,
+    get_agent_store,
+    reset_tab,
+    use_lean_browsing,
+)
+from math import ceil
 import json
-import os
 import urllib.parse
 
 
@@ -23,12 +36,38 @@ class KellerWilliamsScraper:
     __COL_PHONE = "Phone"
     __COL_EMAIL = "Email"
 
+    # Profiles asked for in one batched graphql request
+    __PROFILES_PER_QUERY = 50
+
+    # Fields read from the profile query's json instead of the profile page
+    __QUERY_FIELDS = [__COL_NAME_FULL, __COL_PHONE, __COL_EMAIL]
+
+    # Columns of the output CSV, in order
+    __SCHEMA = AgentSchema(
+        [
+            __COL_LOCATION,
+            __COL_SOURCE,
+            __COL_SCRAPE_DATE,
+            __COL_ID,
+            __COL_NAME_FULL,
+            __COL_NAME_FIRST,
+            __COL_NAME_LAST,
+            __COL_PHONE,
+            __COL_EMAIL,
+        ]
+    )
+
     def __init__(
         self,
         chrome_options: dict,
         bmp_options: dict,
         locations: dict,
         timeout_default: int = 10,
+        workers: int = 1,
+        replay_options: dict = None,
+        lean_options: dict = None,
+        store_options: dict = None,
+        pool_options: dict = None,
     ):
         self.__b = SeleniumBase(
             chrome_options=chrome_options,
@@ -36,15 +75,45 @@ class KellerWilliamsScraper:
             timeout_default=timeout_default,
         )
         self.__dr = self.__b.get_driver()
+        use_lean_browsing(self.__dr, lean_options)
         self.__bmp = self.__b.get_bmp()
         self.__loc = locations
         self.__ac = self.__b.use_actions()
         self.__loc = locations
 
+        # Wait on graphql responses instead of polling for new cards
+        self.__waiter = ResponseWaiter(self.__dr, ["graphql"])
+
+        # Write agents and urls to a SQLite store instead of files when given
+        self.__store = get_agent_store(store_options) if store_options else None
+
+        # Visit profiles with several browsers at once when workers > 1
+        self.__chrome_options = chrome_options
+        self.__timeout_default = timeout_default
+        self.__lean_options = lean_options
+        self.__workers = workers
+        self.__pool_options = pool_options
+        self.__pool = None
+
+        # Request search result pages straight from the api when options are given
+        self.__replay = (
+            ApiReplay(HttpSession(), **replay_options) if replay_options else None
+        )
+
+    def recover(self):
+        # Replace a stuck tab, keeping Chrome and the proxy alive
+        if not reset_tab(self.__dr):
+            raise RestartScrape
+        use_lean_browsing(self.__dr, self.__lean_options)
+        self.__waiter.install()
+
     def close(self):
+        if self.__pool:
+            self.__pool.close()
         self.__dr.close()
         self.__dr.quit()
-        self.__bmp.close()
+        if self.__bmp:
+            self.__bmp.close()
 
     def transform_location(self, location):
         # Transforms 'Los Angeles, CA' to 'CA/Los%20Angeles/'
@@ -65,7 +134,7 @@ class KellerWilliamsScraper:
         count = int(count)
         return count
 
-    def load_all_agents(self):
+    def load_all_agents(self, stream):
         agent_count = self.get_agent_count()
 
         # Grab agent cards on page
@@ -74,61 +143,272 @@ class KellerWilliamsScraper:
 
         # If current agents on page is less than index, scroll down.
         while agent_count > len(agents):
-            # Scroll down to last agent loaded and load more agents if needed
-            self.__ac.move_to_element(agents[-1]).perform()
+            # Scroll down to last agent loaded and wait for the next page of
+            # agents to come back and render
+            last = agents[-1]
+            self.__waiter.run_and_wait(
+                "graphql", lambda: self.__ac.move_to_element(last).perform()
+            )
+            try:
+                xp_next = f"({xp_agents})[{len(agents) + 1}]"
+                self.__b.wait_for_element((By.XPATH, xp_next))
+            except:
+                cprint(f"<y>Stopped loading at {len(agents)} / {agent_count} agents")
+                break
+
+            # Collect new agents as soon as their cards show up so the HAR stays small
+            stream.poll()
             agents = self.__dr.find_elements(By.XPATH, xp_agents)
 
-        return
+        stream.poll()
+
+    def get_agent_urls_from_content(self, content):
+        query = content["data"]["SearchAgentQuery"]
+        results = query["result"]["agents"]["edges"]
+        return [result["node"]["id"] for result in results]
+
+    def get_agent_urls_from_api(self, agent_count):
+        # Returns None if the api couldn't be replayed
+        # The first page was requested on page load, scroll once for the second
+        xp_agents = "//div[@class='AgentCard']"
+        agents = self.__b.wait_for_all_elements((By.XPATH, xp_agents))
+        self.__waiter.run_and_wait(
+            "graphql", lambda: self.__ac.move_to_element(agents[-1]).perform()
+        )
+
+        entries = self.__replay.wait_for_entries(
+            self.__bmp, "graphql", 2, body_pattern="SearchAgentQuery"
+        )
+        if len(entries) < 2:
+            return None
+
+        try:
+            content = json.loads(entries[0]["response"]["content"]["text"])
+            page_size = len(self.get_agent_urls_from_content(content))
+        except:
+            return None
+
+        # Relay cursors (eg. "after") aren't numbers, so they can't be replayed
+        paging = self.__replay.get_paging(entries[0], entries[1], page_size)
+        if paging is None:
+            return None
+
+        page_count = ceil(agent_count / page_size)
+        contents = self.__replay.replay_pages(entries[0], paging, page_count)
 
-    def get_agent_urls(self, har):
-        # Filter the HAR data for network requests that have "graphql" in the url
         urls = []
-        for entry in har["log"]["entries"]:
-            if "graphql" in entry["request"]["url"]:
-                try:
-                    content = json.loads(entry["response"]["content"]["text"])
-                    query = content["data"]["SearchAgentQuery"]
-                    results = query["result"]["agents"]["edges"]
-
-                    for result in results:
-                        urls.append(result["node"]["id"])
-                except:
-                    continue
+        for content in contents:
+            try:
+                urls += self.get_agent_urls_from_content(content)
+            except:
+                return None
+
+        # A wrong paging guess repeats pages, so check every agent came back once
+        if not self.are_urls_complete(urls, agent_count):
+            cprint("<y>Replayed search api repeated or missed agents.")
+            return None
         return urls
 
+    def are_urls_complete(self, urls, count):
+        # Some agents have no url, so only urls that are there have to be unique
+        found = [url for url in urls if url]
+        return len(urls) == count and len(set(found)) == len(found)
+
     def load_agent_profile(self, profile_url):
+        # Returns False if the profile didn't load after 3 tries
         base_url = f"{KellerWilliamsScraper.__BASE_URL}/agent"
         url = f"{base_url}/{profile_url}"
-        loaded = False
-        while loaded == False:
+        for retry in range(3):
             self.__dr.get(url)
             try:
                 xpath = "//div[@class='AgentContent__name']"
                 self.__b.wait_for_element((By.XPATH, xpath))
-                loaded = True
+                return True
             except:
-                loaded = False
+                cprint(f"<y>Profile failed to load. Recovering ({retry + 1})...")
+                self.recover()
+        cprint(f"Scrape failed <r>3<w> times. Skipping url (<y>{url}<w>)...")
+        return False
+
+    def get_agent_info(self, profile_url):
+        # load_agent_profile waits for the name, so everything can be read
+        # in one round trip instead of one per field
+        # Returns None if the profile didn't load
+        if not self.load_agent_profile(profile_url):
+            return None
+        return self.read_agent_info()
+
+    def read_agent_info(self):
+        # Reads the profile that's loaded in the browser
+        fields = extract_fields(
+            self.__dr,
+            {
+                "name": "//div[@class='AgentContent__name']",
+                "phone": "//div[@class='AgentInformation__phoneMobileNumber']",
+                "email": "//a[@aria-label='Agent E-mail']",
+            },
+        )
+        return {
+            KellerWilliamsScraper.__COL_NAME_FULL: fields["name"] or "",
+            KellerWilliamsScraper.__COL_PHONE: fields["phone"] or "",
+            KellerWilliamsScraper.__COL_EMAIL: fields["email"] or "",
+        }
+
+    def normalize_field(self, col, value):
+        # How the profile page and the profile query's json are compared
+        if not isinstance(value, str):
+            return None
+        if col == KellerWilliamsScraper.__COL_PHONE:
+            return "".join(filter(str.isdigit, value))[-10:] or None
+        return " ".join(value.lower().split()) or None
+
+    def learn_field_paths(self, content, info, paths):
+        # Finds where each field the profile page showed is in the profile
+        # query's json, for fields that aren't known yet
+        # info is from read_agent_info, content is the query's json
+        for col in KellerWilliamsScraper.__QUERY_FIELDS:
+            if paths.get(col) or not self.normalize_field(col, info[col]):
+                continue
+            paths[col] = self.__replay.find_path(
+                content, info[col], lambda value: self.normalize_field(col, value)
+            )
 
-    def get_agent_name(self):
-        xpath = "//div[@class='AgentContent__name']"
-        name = self.__b.wait_for_element((By.XPATH, xpath))
-        return name.get_attribute("textContent")
+    def get_agent_info_from_content(self, content, paths):
+        # content is one result of the profile query
+        # Returns None if a field isn't where the first profile had it
+        info = {}
+        for col in KellerWilliamsScraper.__QUERY_FIELDS:
+            value = None
+            if paths.get(col):
+                value = self.__replay.get_value(content, paths[col])
+            if not isinstance(value, str) or not value.strip():
+                return None
+            info[col] = value.strip()
+        return info
+
+    def get_profile_template(self, profile_url):
+        # Loads one profile in the browser and finds the graphql request
+        # that asked for it, where the agent's id goes in its body, and
+        # where the page's fields are in its response
+        # Returns (entry, id path, { column: field path }) or None
+        self.__bmp.start_har(f"kw_{profile_url}")
+        if not self.load_agent_profile(profile_url):
+            return None
+        info = self.read_agent_info()
+        entries = self.__replay.wait_for_entries(
+            self.__bmp, "graphql", 1, body_pattern=profile_url
+        )
+        for entry in entries:
+            try:
+                body = json.loads(self.__replay.get_body_text(entry))
+                content = json.loads(entry["response"]["content"]["text"])
+            except:
+                continue
+            path = self.__replay.find_path(body, profile_url)
+            if not path:
+                continue
+            paths = {}
+            self.learn_field_paths(content, info, paths)
+            if paths.get(KellerWilliamsScraper.__COL_NAME_FULL):
+                return entry, path, paths
+        return None
+
+    def scrape_with_graphql(
+        self, loc, scrape_date, ids, urls, agents, output, checkpoint
+    ):
+        # Asks for many profiles per graphql request instead of loading each
+        # profile in the browser
+        # Returns the ids that still need to be scraped in the browser
+        captured = self.get_profile_template(urls[ids[0]])
+        if captured is None:
+            cprint(f"<y>Could not find the profile query.")
+            return ids
+        template, path, paths = captured
+
+        per_query = KellerWilliamsScraper.__PROFILES_PER_QUERY
+        for start in range(0, len(ids), per_query):
+            batch = ids[start : start + per_query]
+            try:
+                contents = self.__replay.request_batch(
+                    template, path, [urls[i] for i in batch]
+                )
+            except:
+                cprint(f"<y>Could not batch the profile query.")
+                return ids[start:]
+
+            for i, content in zip(batch, contents):
+                info = self.get_agent_info_from_content(content, paths)
+
+                # Load agents the query is missing a field for from their
+                # profile, and learn where fields the first profile didn't
+                # have are from them
+                if info is None:
+                    info = self.get_agent_info(urls[i])
+                    if info:
+                        self.learn_field_paths(content, info, paths)
+                if info is None:
+                    checkpoint.skip(i, output)
+                    continue
 
-    def get_agent_phone(self):
-        try:
-            xpath = "//div[@class='AgentInformation__phoneMobileNumber']"
-            phone = self.__dr.find_element(By.XPATH, xpath)
-            return phone.get_attribute("textContent")
-        except:
-            return ""
+                agent = self.create_agent(loc, scrape_date, i, info)
+                agents.write_agent(output, agent)
+                checkpoint.done(i, output)
+
+            checkpoint.save(output)
+            cprint(f"<c>{loc} - Agent {batch[-1] + 1} / {len(urls)}")
+        return []
+
+    def create_agent(self, loc, scrape_date, id, info):
+        full_name = info[KellerWilliamsScraper.__COL_NAME_FULL]
+        return KellerWilliamsScraper.__SCHEMA.create_agent(
+            {
+                KellerWilliamsScraper.__COL_LOCATION: loc,
+                KellerWilliamsScraper.__COL_SOURCE: KellerWilliamsScraper.__BASE_URL,
+                KellerWilliamsScraper.__COL_SCRAPE_DATE: scrape_date,
+                KellerWilliamsScraper.__COL_ID: id,
+                KellerWilliamsScraper.__COL_NAME_FULL: full_name,
+                KellerWilliamsScraper.__COL_NAME_FIRST: full_name.split(" ")[0],
+                KellerWilliamsScraper.__COL_NAME_LAST: full_name.split(" ")[-1],
+                KellerWilliamsScraper.__COL_PHONE: info[
+                    KellerWilliamsScraper.__COL_PHONE
+                ],
+                KellerWilliamsScraper.__COL_EMAIL: info[
+                    KellerWilliamsScraper.__COL_EMAIL
+                ],
+            }
+        )
 
-    def get_agent_email(self):
-        try:
-            xpath = "//a[@aria-label='Agent E-mail']"
-            email = self.__dr.find_element(By.XPATH, xpath)
-            return email.get_attribute("textContent")
-        except:
-            return ""
+    def create_worker(self, chrome_options):
+        # Workers only visit profiles, so they don't need the proxy
+        return KellerWilliamsScraper(
+            chrome_options=chrome_options,
+            bmp_options=None,
+            locations=[],
+            timeout_default=self.__timeout_default,
+            lean_options=self.__lean_options,
+        )
+
+    def scrape_with_pool(self, loc, scrape_date, ids, urls, agents, output, checkpoint):
+        if self.__pool is None:
+            self.__pool = WorkerPool(
+                self.create_worker,
+                self.__workers,
+                self.__chrome_options,
+                self.__pool_options,
+            )
+
+        def write(i, info):
+            agent = self.create_agent(loc, scrape_date, i, info)
+            agents.write_agent(output, agent)
+            checkpoint.done(i, output)
+            cprint(f"<c>{loc} - Agent {i + 1} / {len(urls)}")
+
+        self.__pool.run(
+            ids,
+            lambda worker, i: worker.get_agent_info(urls[i]),
+            write,
+            lambda i: checkpoint.skip(i, output),
+        )
 
     def scrape(self):
         cprint(f"Scraping <g>{KellerWilliamsScraper.__BASE_URL}<w>...")
@@ -138,23 +418,14 @@ class KellerWilliamsScraper:
 
         # Iterate over locations
         for loc in self.__loc:
-            agents = Agents(
-                [
-                    KellerWilliamsScraper.__COL_LOCATION,
-                    KellerWilliamsScraper.__COL_SOURCE,
-                    KellerWilliamsScraper.__COL_SCRAPE_DATE,
-                    KellerWilliamsScraper.__COL_ID,
-                    KellerWilliamsScraper.__COL_NAME_FULL,
-                    KellerWilliamsScraper.__COL_NAME_FIRST,
-                    KellerWilliamsScraper.__COL_NAME_LAST,
-                    KellerWilliamsScraper.__COL_PHONE,
-                    KellerWilliamsScraper.__COL_EMAIL,
-                ]
-            )
+            agents = Agents(KellerWilliamsScraper.__SCHEMA, self.__store)
 
             # Start recording HAR data before loading the page
             # so we can grab the first query
-            self.__bmp.start_har(f"kw_{loc}")
+            stream = HarStream(
+                self.__bmp, f"kw_{loc}", "graphql", self.get_agent_urls_from_content
+            )
+            stream.start()
 
             self.search_location(loc)
 
@@ -168,18 +439,21 @@ class KellerWilliamsScraper:
                 cprint(f"Pulling agent urls (<c>agent_urls/kw/{loc}.json<w>)...")
                 urls = agents.get_saved_urls("kw", loc)
             else:
-                cprint(f"<c>Retrieving agent urls from webpage...")
-
-                urls = []
+                urls = None
+                if self.__replay:
+                    cprint(f"<c>Retrieving agent urls from search api...")
+                    urls = self.get_agent_urls_from_api(agent_count)
+                    if urls is None:
+                        cprint(f"<y>Could not replay search api.")
 
-                # Load all agent queries
-                self.load_all_agents()
+                if urls is None:
+                    cprint(f"<c>Retrieving agent urls from webpage...")
 
-                # Get the HAR data after loading all agents
-                har = self.__bmp.har()
+                    # Load all agent queries
+                    self.load_all_agents(stream)
 
-                # Get the list of urls to iterate over
-                urls = self.get_agent_urls(har)
+                    # Get the list of urls to iterate over
+                    urls = stream.get_results()
 
                 cprint(f"<y>len(urls): {len(urls)}")
 
@@ -187,41 +461,45 @@ class KellerWilliamsScraper:
                 cprint(f"Saving agent urls (<c>agent_urls/kw/{loc}.json<w>)...")
                 agents.save_urls("kw", loc, urls)
 
-            # Create file for writing
-            file_name = f"agent_data/kw/{loc}.csv"
-            os.makedirs("agent_data/kw", exist_ok=True)
-            output = open(file_name, "a+", encoding="utf-8")
+            # Open the CSV or store for writing
+            checkpoint = agents.get_checkpoint("kw", loc)
+            output = checkpoint.open()
 
-            # Grab the last id of the CSV file
-            last_id = get_last_id_in_csv_file(file_name, KellerWilliamsScraper.__COL_ID)
+            # Grab the last id from the checkpoint
+            last_id = checkpoint.get_last_id(KellerWilliamsScraper.__COL_ID)
 
             if last_id == -1:
                 cprint(f"<c>{loc} - Agent 0 / { len(urls) }")
-                output.write(agents.get_headers_as_csv_string())
+                agents.write_headers(output)
             elif last_id + 1 != len(urls):
                 cprint(f"<c>{loc}<w> - <y>Continuing from Agent {last_id + 1}")
 
-            for i in range(0, len(urls)):
-                self.load_agent_profile(urls[i])
-
-                # Gather info on agent profile page
-                full_name = self.get_agent_name()
-                first_name = full_name.split(" ")[0]
-                last_name = full_name.split(" ")[-1]
-                phone = self.get_agent_phone()
-                email = self.get_agent_email()
+            ids = list(range(last_id + 1, len(urls)))
+
+            # Profiles the graphql query couldn't batch fall through to the
+            # pool or the loop below
+            if self.__replay and ids:
+                ids = self.scrape_with_graphql(
+                    loc, scrape_date, ids, urls, agents, output, checkpoint
+                )
+
+            if self.__workers > 1:
+                self.scrape_with_pool(
+                    loc, scrape_date, ids, urls, agents, output, checkpoint
+                )
+                ids = []
+
+            for i in ids:
+                info = self.get_agent_info(urls[i])
+                if info is None:
+                    checkpoint.skip(i, output)
+                    continue
 
                 # Add agent info to instance of Agents data object
-                agent = {
-                    KellerWilliamsScraper.__COL_LOCATION: loc,
-                    KellerWilliamsScraper.__COL_SOURCE: KellerWilliamsScraper.__BASE_URL,
-                    KellerWilliamsScraper.__COL_SCRAPE_DATE: scrape_date,
-                    KellerWilliamsScraper.__COL_ID: i,
-                    KellerWilliamsScraper.__COL_NAME_FULL: full_name,
-                    KellerWilliamsScraper.__COL_NAME_FIRST: first_name,
-                    KellerWilliamsScraper.__COL_NAME_LAST: last_name,
-                    KellerWilliamsScraper.__COL_PHONE: phone,
-                    KellerWilliamsScraper.__COL_EMAIL: email,
-                }
-                output.write(agents.get_agent_as_csv_string(agent))
+                agent = self.create_agent(loc, scrape_date, i, info)
+                agents.write_agent(output, agent)
+                checkpoint.done(i, output)
                 cprint(f"<c>{loc} - Agent {i + 1} / {agent_count}")
+
+            checkpoint.save(output)
+            output.close()
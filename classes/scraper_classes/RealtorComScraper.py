@@ -1,15 +1,46 @@
-from python_utils import cprint, get_last_id_in_csv_file, get_todays_date
+from python_utils import cprint, get_todays_date
 from selenium_utils import SeleniumBase
 from selenium.webdriver.common.by import By
-from classes.scraper_classes.common.agents import Agents
-import os
+from classes.Exceptions import RestartScrape
+from classes.scraper_classes.common import (
+    Agents,
+    AgentSchema,
+    ApiReplay,
+    HarStream,
+    HttpSession,
+    extract_cards,
+    get_agent_store,
+    use_lean_browsing,
+)
+from math import ceil
+from urllib.parse import parse_qsl, urlsplit
+import json
 
 
 # Class for scraping realtor.com
+#
+# The agent search page loads its results from a search? api, eg.
+# /realestateagents/api/v3/search?offset=0&limit=20&marketing_area_cities=...
+# The first response is read from the HAR for the agent count, and the rest
+# of the pages are requested straight from the api, several at a time.
+# The first page's records are checked against its agent cards first, and
+# when they don't read the same, every page is loaded and read from the DOM
 class RealtorComScraper:
     __BASE_URL = "https://www.realtor.com"
     __PREFIX__ = "realtor_com"
 
+    # Search api the agent search page calls
+    __API_PATTERN = "search?"
+
+    # Agent cards on the search page
+    __XP_CARD = '//div[@data-testid="component-agentCard"]'
+
+    # Agents per page when the search request doesn't say
+    __PAGE_SIZE = 20
+
+    # Pages requested at once before they're written and checkpointed
+    __PAGES_PER_BATCH = 10
+
     # Column Headers
     __COL_LOCATION = "Location"
     __COL_SOURCE = "Source"
@@ -20,6 +51,23 @@ class RealtorComScraper:
     __COL_NAME_LAST = "Last Name"
     __COL_PHONE = "Phone"
     __COL_BROKERAGE = "Brokerage"
+    __COL_URL = "Url"
+
+    # Columns of the output CSV, in order
+    __SCHEMA = AgentSchema(
+        [
+            __COL_LOCATION,
+            __COL_SOURCE,
+            __COL_SCRAPE_DATE,
+            __COL_ID,
+            __COL_NAME_FULL,
+            __COL_NAME_FIRST,
+            __COL_NAME_LAST,
+            __COL_PHONE,
+            __COL_BROKERAGE,
+            __COL_URL,
+        ]
+    )
 
     def __init__(
         self,
@@ -28,6 +76,10 @@ class RealtorComScraper:
         bmp_options: dict,
         locations: list,
         timeout_default: int = 10,
+        lean_options: dict = None,
+        http_options: dict = None,
+        replay_options: dict = None,
+        store_options: dict = None,
     ):
         self.__b = SeleniumBase(
             chrome_options=chrome_options,
@@ -35,11 +87,21 @@ class RealtorComScraper:
             timeout_default=timeout_default,
         )
         self.__dr = self.__b.get_driver()
+        use_lean_browsing(self.__dr, lean_options)
         self.__bmp = self.__b.get_bmp()
         self.__loc = locations
         self.__cookies = cookies
 
+        # Write agents to a SQLite store instead of files when options are given
+        self.__store = get_agent_store(store_options) if store_options else None
+
+        # The search api is the only way agents are read, so it's replayed
+        # with default options when none are given
+        self.__http = HttpSession(**(http_options or {}))
+        self.__replay = ApiReplay(self.__http, **(replay_options or {}))
+
     def close(self):
+        self.__http.close()
         self.__b.close()
 
     def transform_location(self, location):
@@ -51,45 +113,215 @@ class RealtorComScraper:
         loc = loc.replace(" ", "-")
         return loc
 
-    def search_location(self, location):
+    def get_location_url(self, location):
         base_url = f"{RealtorComScraper.__BASE_URL}/realestateagents"
-        loc_transformed = self.transform_location(location)
-        loc_url = f"{base_url}/{loc_transformed}"
+        return f"{base_url}/{self.transform_location(location)}"
+
+    def search_location(self, location):
+        loc_url = self.get_location_url(location)
         self.__b.set_referer(loc_url)
         self.__b.visit_with_delay(loc_url)
 
-    def get_agent_count(self, responses: list):
-        # Get HAR data after loading all page requests
-        print(responses)
-        return
+    def get_first_page(self, har):
+        # Returns the first search request and its json, or (None, None)
+        for entry in self.__replay.get_entries(har, RealtorComScraper.__API_PATTERN):
+            try:
+                return entry, json.loads(entry["response"]["content"]["text"])
+            except:
+                continue
+        return None, None
+
+    def get_agent_count(self, content):
+        # eg. {"matching_rows": 1843, "agents": [...]}
+        # Returns None if the response doesn't say
+        try:
+            return int(content.get("matching_rows"))
+        except:
+            return None
 
     def get_page_count(self):
         xpath = '//div[@role="navigation"]/a[position() = last() - 1]'
         last_page = self.__dr.find_element(By.XPATH, xpath)
         return int(last_page.get_attribute("textContent"))
 
-    def get_agents_on_page(self):
-        xpath = '//div[@data-testid="component-agentCard"]'
-        return self.__dr.find_elements(By.XPATH, xpath)
+    def get_records(self, content):
+        return content.get("agents") or []
 
-    def next_page(self, location, page):
+    def get_paging(self, entry):
+        # The search api pages with offset and limit, eg. offset=20&limit=20
+        # Returns None if the request doesn't page that way
+        query = dict(parse_qsl(urlsplit(entry["request"]["url"]).query))
         try:
-            xpath = '//a[text()="Next"]'
-            next = self.__dr.find_element(By.XPATH, xpath)
-            next.click()
+            start = int(query["offset"])
+            step = int(query.get("limit", RealtorComScraper.__PAGE_SIZE))
         except:
-            base_url = f"{RealtorComScraper.__BASE_URL}/realestateagents"
-            location_url = self.transform_location(location)
-            self.__dr.get(f"{base_url}/{location_url}/pg-{page}")
+            return None
+        return ("query", ("offset",), start, step)
+
+    def get_page_in_browser(self, location, page):
+        # page starts at 0, realtor.com's page urls start at 1
+        stream = HarStream(
+            self.__bmp,
+            f"{RealtorComScraper.__PREFIX__}_{location}",
+            RealtorComScraper.__API_PATTERN,
+            lambda content: [content],
+        )
+        stream.start()
+        self.__dr.get(f"{self.get_location_url(location)}/pg-{page + 1}")
+        stream.wait_for_responses()
+        results = stream.get_results()
+        return results[-1] if results else None
+
+    def get_pages(self, location, template, paging, first_page, page_count):
+        # Returns the json of pages first_page to page_count - 1, loading any
+        # page the api refused in the browser instead
+        if paging:
+            contents = self.__replay.replay_pages(
+                template, paging, page_count, first_page
+            )
+        else:
+            contents = [None] * (page_count - first_page)
+
+        for n, content in enumerate(contents):
+            if content is None:
+                contents[n] = self.get_page_in_browser(location, first_page + n)
+        return contents
+
+    def get_agents_on_page(self):
+        # Returns [] if no cards showed up in time
+        try:
+            self.__b.wait_for_element((By.XPATH, RealtorComScraper.__XP_CARD))
+        except:
+            return []
+        return extract_cards(
+            self.__dr,
+            RealtorComScraper.__XP_CARD,
+            {
+                "name": './/div[contains(@class, "agent-name")]',
+                "brokerage": './/div[contains(@class, "agent-group")]/span',
+                "phone": './/div[contains(@class, "agent-phone")]',
+                "url": ('.//a[contains(@href, "/realestateagents/")]', "href"),
+            },
+        )
+
+    def get_cards_in_browser(self, location, page):
+        # page starts at 0, realtor.com's page urls start at 1
+        # Returns None if the page has no agent cards
+        self.__dr.get(f"{self.get_location_url(location)}/pg-{page + 1}")
+        return self.get_agents_on_page() or None
+
+    def get_agent_info_from_card(self, card):
+        # card is a dict from get_agents_on_page
+        url = (card["url"] or "").strip()
+        if url.startswith("/"):
+            url = f"{RealtorComScraper.__BASE_URL}{url}"
+        return {
+            "full_name": (card["name"] or "").strip(),
+            "phone": (card["phone"] or "").strip(),
+            "brokerage": (card["brokerage"] or "").strip(),
+            "url": url,
+        }
+
+    def normalize_value(self, key, value):
+        # How agent cards and api records are compared
+        if key == "phone":
+            return "".join(filter(str.isdigit, value))[-10:]
+        if key == "url":
+            return urlsplit(value).path.rstrip("/")
+        return " ".join(value.lower().split())
+
+    def records_match(self, records, cards):
+        # Checks the api's records read the same as the agent cards they
+        # were shown as, so a renamed key isn't written blank
+        if not records or len(records) != len(cards):
+            return False
+        for record, card in zip(records, cards):
+            from_record = self.get_agent_info(record)
+            from_card = self.get_agent_info_from_card(card)
+            if not from_record["full_name"]:
+                return False
+            for key, value in from_card.items():
+                expected = self.normalize_value(key, value)
+                if expected and self.normalize_value(key, from_record[key]) != expected:
+                    return False
+        return True
+
+    def get_infos(self, location, template, paging, first_page, page_count, use_api):
+        # Returns the agents of pages first_page to page_count - 1, one list
+        # per page, or None for pages that couldn't be loaded
+        pages = []
+        if not use_api:
+            for page in range(first_page, page_count):
+                cards = self.get_cards_in_browser(location, page)
+                pages.append(self.get_infos_from_cards(cards) if cards else None)
+            return pages
+
+        contents = self.get_pages(location, template, paging, first_page, page_count)
+        for content in contents:
+            pages.append(
+                self.get_infos_from_content(content) if content is not None else None
+            )
+        return pages
+
+    def get_infos_from_cards(self, cards):
+        return [self.get_agent_info_from_card(card) for card in cards]
+
+    def get_infos_from_content(self, content):
+        return [self.get_agent_info(record) for record in self.get_records(content)]
+
+    def get_agent_info(self, record):
+        # Reads one agent record of the search api
+        full_name = (record.get("full_name") or record.get("person_name") or "").strip()
+
+        phone = ""
+        for p in record.get("phones") or []:
+            if p.get("number"):
+                phone = p["number"]
+                break
+
+        broker = record.get("broker") or {}
+        office = record.get("office") or {}
+        brokerage = broker.get("name") or office.get("name") or ""
+
+        url = record.get("web_url") or record.get("href") or ""
+        if url.startswith("/"):
+            url = f"{RealtorComScraper.__BASE_URL}{url}"
+
+        return {
+            "full_name": full_name,
+            "phone": phone,
+            "brokerage": brokerage,
+            "url": url,
+        }
+
+    def create_agent(self, agents, loc, scrape_date, id, info):
+        full_name = info["full_name"]
+        return agents.create_agent(
+            {
+                RealtorComScraper.__COL_LOCATION: loc,
+                RealtorComScraper.__COL_SOURCE: RealtorComScraper.__BASE_URL,
+                RealtorComScraper.__COL_SCRAPE_DATE: scrape_date,
+                RealtorComScraper.__COL_ID: id,
+                RealtorComScraper.__COL_NAME_FULL: full_name,
+                RealtorComScraper.__COL_NAME_FIRST: full_name.split(" ")[0],
+                RealtorComScraper.__COL_NAME_LAST: full_name.split(" ")[-1],
+                RealtorComScraper.__COL_PHONE: info["phone"],
+                RealtorComScraper.__COL_BROKERAGE: info["brokerage"],
+                RealtorComScraper.__COL_URL: info["url"],
+            }
+        )
 
     def scrape(self):
-        cprint(f"<g>Scraping {RealtorComScraper.__BASE_URL}...")
+        cprint(f"Scraping <g>{RealtorComScraper.__BASE_URL}<w>...")
 
         # Record scrape_date so we know how "fresh" the data is
         scrape_date = get_todays_date()
 
         # Iterate over locations
         for loc in self.__loc:
+            cprint(f"Scraping agents for location: <c>{loc}<w>...")
+            agents = Agents(RealtorComScraper.__SCHEMA, self.__store)
+
             # Record network traffic on page load
             self.__bmp.start_har(f"{RealtorComScraper.__PREFIX__}_{loc}")
 
@@ -97,101 +329,103 @@ class RealtorComScraper:
 
             # self.__b.add_cookies(self.__cookies)
 
-            self.__bmp.wait_for_response("search?")
-
-            responses = self.__bmp.get_responses("search?")
-
-            agent_count = self.get_agent_count(responses)
-
-            return
-            agents = Agents(
-                [
-                    RealtorComScraper.__COL_LOCATION,
-                    RealtorComScraper.__COL_SOURCE,
-                    RealtorComScraper.__COL_SCRAPE_DATE,
-                    RealtorComScraper.__COL_ID,
-                    RealtorComScraper.__COL_NAME_FULL,
-                    RealtorComScraper.__COL_NAME_FIRST,
-                    RealtorComScraper.__COL_NAME_LAST,
-                    RealtorComScraper.__COL_PHONE,
-                    RealtorComScraper.__COL_BROKERAGE,
-                ]
-            )
-
-            cprint(f"<c>Found {agent_count} agents for {loc}.")
+            self.__bmp.wait_for_response(RealtorComScraper.__API_PATTERN)
 
-            try:
-                page_count = self.get_page_count()
-            except:
-                cprint(f"<c>{loc} - 0 pages")
+            template, first = self.get_first_page(self.__bmp.har())
+            if first is None:
+                cprint(f"<y>{loc} - Search api didn't respond, skipping location")
                 continue
 
-            # Create file for writing
-            file_name = f"agent_data/{RealtorComScraper.__PREFIX__}/{loc}.csv"
-            os.makedirs(f"agent_data/{RealtorComScraper.__PREFIX__}", exist_ok=True)
-            output = open(file_name, "a+", encoding="utf-8")
+            # Read agents from the DOM if the api's records can't be trusted
+            cards = self.get_agents_on_page()
+            agent_count = self.get_agent_count(first)
+            use_api = agent_count is not None and self.records_match(
+                self.get_records(first), cards
+            )
+            if agent_count is None:
+                # Count the pages instead, the last one may not be full
+                cprint(f"<y>Search api didn't give the agent count.")
+                try:
+                    page_count = self.get_page_count()
+                except:
+                    page_count = 1
+                agent_count = page_count * (len(cards) or RealtorComScraper.__PAGE_SIZE)
+            cprint(f"<c>Found {agent_count} agents for {loc}.")
 
-            # Grab the last id of the CSV file
-            last_id = get_last_id_in_csv_file(file_name, RealtorComScraper.__COL_ID)
+            paging = self.get_paging(template)
+            if not use_api:
+                cprint(f"<y>Reading agents from the agent cards.")
+                page_size = len(cards) or RealtorComScraper.__PAGE_SIZE
+            elif paging:
+                page_size = paging[3]
+            else:
+                cprint(f"<y>Could not replay search api, loading pages in browser.")
+                page_size = (
+                    len(self.get_records(first)) or RealtorComScraper.__PAGE_SIZE
+                )
+            page_count = ceil(agent_count / page_size)
+
+            # Open the CSV or store for writing
+            checkpoint = agents.get_checkpoint(RealtorComScraper.__PREFIX__, loc)
+            output = checkpoint.open()
+
+            # Grab the last id from the checkpoint
+            last_id = checkpoint.get_last_id(RealtorComScraper.__COL_ID)
 
             if last_id == -1:
                 cprint(f"<c>{loc} - Agent 0 / {agent_count}")
-                output.write(agents.get_headers_as_csv_string())
-            elif last_id + 1 != agent_count:
+                agents.write_headers(output)
+            elif last_id + 1 < agent_count:
                 cprint(f"<c>{loc} - Continuing from Agent {last_id + 1}")
 
-            i = 0
-            # Iterate over pages
-            for p in range(1, page_count + 1):
-                cprint(f"<c>{loc} - Page: {p} / {page_count}")
-                agents_on_page = self.get_agents_on_page()
+            # Ids are positions in the search results, so resuming starts at
+            # the page holding the next id
+            first_page = (last_id + 1) // page_size
+            if last_id + 1 >= agent_count:
+                first_page = page_count
+            for batch in range(
+                first_page, page_count, RealtorComScraper.__PAGES_PER_BATCH
+            ):
+                end = min(batch + RealtorComScraper.__PAGES_PER_BATCH, page_count)
+                cprint(f"<c>{loc} - Pages {batch + 1}-{end} / {page_count}")
+
+                # The first page already came in with the search
+                if batch == 0:
+                    if use_api:
+                        first_infos = self.get_infos_from_content(first)
+                    else:
+                        first_infos = self.get_infos_from_cards(cards)
+                    pages = [first_infos] + self.get_infos(
+                        loc, template, paging, 1, end, use_api
+                    )
+                else:
+                    pages = self.get_infos(loc, template, paging, batch, end, use_api)
+
+                for page, infos in zip(range(batch, end), pages):
+                    if infos is None:
+                        cprint(f"<r>{loc} - Could not load page {page + 1}.")
 
-                # Iterate over agents
-                for a in agents_on_page:
-                    if i < last_id:
-                        i += 1
-                        continue
+                        # Save progress so the restart picks up at this page
+                        checkpoint.save(output)
+                        output.close()
+                        raise RestartScrape
 
-                    cprint(f"<c>{loc} - Agent {i + 1} / {agent_count}")
+                    for n, info in enumerate(infos):
+                        i = page * page_size + n
+                        if i <= last_id:
+                            continue
+                        agent = self.create_agent(agents, loc, scrape_date, i, info)
+                        agents.write_agent(output, agent)
+                        checkpoint.done(i, output)
 
-                    name_xpath = './/div[contains(@class, "agent-name")]'
-                    full_name = a.find_element(By.XPATH, name_xpath).get_attribute(
-                        "textContent"
-                    )
-                    first_name = full_name.split(" ")[0]
-                    last_name = full_name.split(" ")[-1]
-                    try:
-                        brokerage_xpath = './/div[contains(@class, "agent-group")]/span'
-                        brokerage = a.find_element(
-                            By.XPATH, brokerage_xpath
-                        ).get_attribute("textContent")
-                    except:
-                        brokerage = ""
-                    try:
-                        phone_xpath = './/div[contains(@class, "agent-phone")]'
-                        phone = a.find_element(By.XPATH, phone_xpath).get_attribute(
-                            "textContent"
-                        )
-                    except:
-                        phone = ""
-                    agent = {
-                        RealtorComScraper.__COL_LOCATION: loc,
-                        RealtorComScraper.__COL_SOURCE: RealtorComScraper.__BASE_URL,
-                        RealtorComScraper.__COL_SCRAPE_DATE: scrape_date,
-                        RealtorComScraper.__COL_ID: i,
-                        RealtorComScraper.__COL_NAME_FULL: full_name,
-                        RealtorComScraper.__COL_NAME_FIRST: first_name,
-                        RealtorComScraper.__COL_NAME_LAST: last_name,
-                        RealtorComScraper.__COL_PHONE: phone,
-                        RealtorComScraper.__COL_BROKERAGE: brokerage,
-                    }
-
-                    output.write(agents.get_agent_as_csv_string(agent))
-
-                    i += 1
-
-                # After iterating over agents, go to next page
-                if p < page_count:
-                    self.next_page(loc, p + 1)
-
-            cprint(f"<g>Finished scraping {RealtorComScraper.__BASE_URL}.")
+                checkpoint.save(output)
+                cprint(
+                    f"<c>{loc}<w> - <y>Agent {min(end * page_size, agent_count)} / {agent_count}"
+                )
+
+            checkpoint.save(output)
+            output.close()
+
+            # End of iterating through locations
+
+        cprint(f"Finished scraping <g>{RealtorComScraper.__BASE_URL}<w>.")
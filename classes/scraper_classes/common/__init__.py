@@ -1 +1,26 @@
-from .agents import Agents
\ No newline at end of file
+from .agent_store import AgentStore, StoreCheckpoint, StoreOutput, get_agent_store
+from .agents import Agent, AgentCsvWriter, Agents, AgentSchema
+from .api_replay import ApiReplay
+from .arrow_export import AgentArrowExporter, read_agents
+from .async_core import AsyncCore
+from .checkpoint import Checkpoint
+from .delta import DeltaScrape
+from .dom_extract import extract_cards, extract_fields
+from .har import HarStream
+from .http import HttpSession
+from .lean import use_lean_browsing
+from .merge import AgentMerger
+from .network_wait import ResponseWaiter
+from .profile_cache import ProfileCache, get_profile_cache
+from .recovery import reset_tab
+from .rate_limiter import (
+    AdaptiveRateLimiter,
+    RateLimiter,
+    get_adaptive_rate_limiter,
+)
+from .worker_pool import (
+    WorkerPool,
+    clone_chrome_profile,
+    get_worker_chrome_options,
+    remove_chrome_profile,
+)
@@ -0,0 +1,348 @@
+import csv
+import json
+import os
+import sqlite3
+import threading
+
+
+# SQLite database holding every scraped agent, the discovered agent urls and
+# the progress of each (source, location), in place of the per-location CSV
+# and agent_urls json files
+#
+# store_options = {
+#     "path": "agent_data/agents.sqlite3",
+#     "batch_size": 100,  # Agents written per transaction
+# }
+#
+# Every row keeps its columns as json, in the source's own layout, so each
+# scraper can store whatever it scrapes. The fields used for lookups across
+# sources are copied into indexed columns.
+#
+# Scheduled jobs share one connection, so added agents are held per
+# (source, location) and only written, together with the progress, when
+# that location saves. One job's commit never carries another's rows.
+class AgentStore:
+    # Indexed column: the source columns it's taken from, first one wins
+    __FIELDS = {
+        "scrape_date": ["Scrape Date"],
+        "full_name": ["Full Name"],
+        "dre": ["DRE", "DRE#"],
+        "phone": ["Phone", "Mobile #", "Office #"],
+        "email": ["Email"],
+        "url": ["Url"],
+    }
+
+    def __init__(self, path: str, batch_size: int = 100):
+        self.__batch_size = batch_size
+        self.__lock = threading.Lock()
+
+        # Agents added since their location's last save_progress
+        self.__pending = {}
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Workers and the async core share one connection, guarded by the lock
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+
+        # WAL lets exports read while a scrape is writing
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.execute("PRAGMA synchronous=NORMAL")
+
+        fields = ", ".join(f"{field} TEXT" for field in AgentStore.__FIELDS)
+        self.__db.executescript(f"""
+            CREATE TABLE IF NOT EXISTS agents (
+                source TEXT NOT NULL,
+                location TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                {fields},
+                data TEXT NOT NULL,
+                PRIMARY KEY (source, location, id)
+            );
+            CREATE TABLE IF NOT EXISTS inactive_agents (
+                source TEXT NOT NULL,
+                location TEXT NOT NULL,
+                inactive_since TEXT NOT NULL,
+                {fields},
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS agent_urls (
+                source TEXT NOT NULL,
+                location TEXT NOT NULL,
+                urls TEXT NOT NULL,
+                PRIMARY KEY (source, location)
+            );
+            CREATE TABLE IF NOT EXISTS progress (
+                source TEXT NOT NULL,
+                location TEXT NOT NULL,
+                last_id INTEGER NOT NULL,
+                skipped TEXT NOT NULL,
+                PRIMARY KEY (source, location)
+            );
+            CREATE INDEX IF NOT EXISTS agents_dre ON agents (dre);
+            CREATE INDEX IF NOT EXISTS agents_phone ON agents (phone);
+            CREATE INDEX IF NOT EXISTS agents_email ON agents (email);
+            CREATE INDEX IF NOT EXISTS inactive_agents_location
+                ON inactive_agents (source, location);
+            """)
+        self.__db.commit()
+
+    def close(self):
+        with self.__lock:
+            self.__db.commit()
+            self.__db.close()
+
+    def get_batch_size(self):
+        return self.__batch_size
+
+    def get_fields(self, row):
+        values = []
+        for columns in AgentStore.__FIELDS.values():
+            values.append(next((row[col] for col in columns if row.get(col)), None))
+        return values
+
+    # Agent urls
+
+    def has_urls(self, source, location):
+        return self.get_urls(source, location) is not None
+
+    def get_urls(self, source, location):
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT urls FROM agent_urls WHERE source = ? AND location = ?",
+                (source, location),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_urls(self, source, location, urls):
+        with self.__lock:
+            self.__db.execute(
+                "INSERT OR REPLACE INTO agent_urls VALUES (?, ?, ?)",
+                (source, location, json.dumps(urls)),
+            )
+            self.__db.commit()
+
+    # Agents and progress
+
+    def get_progress(self, source, location):
+        # { "last_id": 41, "skipped": [3, 17] } or None if never started
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT last_id, skipped FROM progress "
+                "WHERE source = ? AND location = ?",
+                (source, location),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"last_id": row[0], "skipped": json.loads(row[1])}
+
+    def add_agent(self, source, location, row):
+        # Not written until save_progress, so a crash drops the row and
+        # the agent is scraped again
+        values = (
+            source,
+            location,
+            int(row["Id"]),
+            *self.get_fields(row),
+            json.dumps(row),
+        )
+        with self.__lock:
+            self.__pending.setdefault((source, location), []).append(values)
+
+    def drop_pending(self, source, location):
+        # Forgets agents added but never saved, eg. by a restarted scrape
+        with self.__lock:
+            self.__pending.pop((source, location), None)
+
+    def save_progress(self, source, location, progress):
+        # Writes the agents added since the last save along with the progress,
+        # in one transaction
+        fields = ", ".join(AgentStore.__FIELDS)
+        marks = ", ".join("?" for _ in AgentStore.__FIELDS)
+        with self.__lock:
+            with self.__db:
+                self.__db.executemany(
+                    f"INSERT OR REPLACE INTO agents "
+                    f"(source, location, id, {fields}, data) "
+                    f"VALUES (?, ?, ?, {marks}, ?)",
+                    self.__pending.pop((source, location), []),
+                )
+                self.__db.execute(
+                    "INSERT OR REPLACE INTO progress VALUES (?, ?, ?, ?)",
+                    (
+                        source,
+                        location,
+                        progress["last_id"],
+                        json.dumps(progress["skipped"]),
+                    ),
+                )
+
+    def has_agents(self, source, location):
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT 1 FROM agents WHERE source = ? AND location = ? LIMIT 1",
+                (source, location),
+            ).fetchone()
+        return row is not None
+
+    def get_agents(self, source, location=None):
+        # Yields each agent as a dict of the source's columns, in id order
+        query = "SELECT data FROM agents WHERE source = ?"
+        params = [source]
+        if location is not None:
+            query += " AND location = ?"
+            params.append(location)
+        query += " ORDER BY location, id"
+
+        # A separate cursor so a long export doesn't hold the lock
+        cursor = self.__db.cursor()
+        with self.__lock:
+            cursor.execute(query, params)
+        while True:
+            with self.__lock:
+                rows = cursor.fetchmany(1000)
+            if not rows:
+                return
+            for row in rows:
+                yield json.loads(row[0])
+
+    def find_agents(self, dre=None, phone=None, email=None):
+        # Looks agents up across every source by any of the indexed fields
+        conditions = []
+        params = []
+        for field, value in [("dre", dre), ("phone", phone), ("email", email)]:
+            if value:
+                conditions.append(f"{field} = ?")
+                params.append(value)
+        if not conditions:
+            return []
+        with self.__lock:
+            rows = self.__db.execute(
+                f"SELECT data FROM agents WHERE {' OR '.join(conditions)}", params
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def clear_location(self, source, location):
+        # Drops the agents and progress of a location, eg. an abandoned delta
+        with self.__lock:
+            self.__pending.pop((source, location), None)
+            with self.__db:
+                for table in ["agents", "progress"]:
+                    self.__db.execute(
+                        f"DELETE FROM {table} WHERE source = ? AND location = ?",
+                        (source, location),
+                    )
+
+    def replace_location(self, source, staging, location, removed, inactive_since):
+        # Swaps the agents scraped under staging in for location and keeps the
+        # removed agents in inactive_agents, all in one transaction
+        fields = ", ".join(AgentStore.__FIELDS)
+        marks = ", ".join("?" for _ in AgentStore.__FIELDS)
+        with self.__lock:
+            with self.__db:
+                self.__db.executemany(
+                    f"INSERT INTO inactive_agents "
+                    f"(source, location, inactive_since, {fields}, data) "
+                    f"VALUES (?, ?, ?, {marks}, ?)",
+                    [
+                        (
+                            source,
+                            location,
+                            inactive_since,
+                            *self.get_fields(row),
+                            json.dumps(row),
+                        )
+                        for row in removed
+                    ],
+                )
+                for table in ["agents", "progress"]:
+                    self.__db.execute(
+                        f"DELETE FROM {table} WHERE source = ? AND location = ?",
+                        (source, location),
+                    )
+                    self.__db.execute(
+                        f"UPDATE {table} SET location = ? "
+                        f"WHERE source = ? AND location = ?",
+                        (location, source, staging),
+                    )
+
+    def export_csv(self, file, source, location=None):
+        # Streams agents to an open file in the same format the scrapers write
+        # Returns the number of agents written
+        writer = None
+        count = 0
+        for row in self.get_agents(source, location):
+            if writer is None:
+                writer = csv.DictWriter(
+                    file, list(row), quoting=csv.QUOTE_ALL, lineterminator="\n"
+                )
+                writer.writeheader()
+            writer.writerow(row)
+            count += 1
+        return count
+
+
+# Same interface as Checkpoint, for scrapes that write to an AgentStore
+# Agents are committed together with the progress, a batch at a time
+class StoreCheckpoint:
+    def __init__(self, store: AgentStore, source: str, location: str):
+        self.__store = store
+        self.__source = source
+        self.__location = location
+        self.__batch_size = store.get_batch_size()
+        self.__pending = 0
+        self.__progress = store.get_progress(source, location)
+
+        # Agents a crashed run added after its last save are scraped again
+        store.drop_pending(source, location)
+
+    def open(self):
+        return StoreOutput(self.__store, self.__source, self.__location)
+
+    def get_last_id(self, col_id):
+        if self.__progress is None:
+            self.__progress = {"last_id": -1, "skipped": []}
+        return self.__progress["last_id"]
+
+    def get_skipped(self):
+        return self.__progress["skipped"] if self.__progress else []
+
+    def done(self, id, output):
+        self.__progress["last_id"] = id
+        self.__pending += 1
+        if self.__pending >= self.__batch_size:
+            self.save(output)
+
+    def skip(self, id, output):
+        if id not in self.__progress["skipped"]:
+            self.__progress["skipped"].append(id)
+        self.done(id, output)
+
+    def save(self, output):
+        self.__store.save_progress(self.__source, self.__location, self.__progress)
+        self.__pending = 0
+
+
+# Takes the place of the open CSV file when writing to an AgentStore
+class StoreOutput:
+    def __init__(self, store: AgentStore, source: str, location: str):
+        self.__store = store
+        self.__source = source
+        self.__location = location
+
+    def write_agent(self, agent):
+        self.__store.add_agent(self.__source, self.__location, agent.to_dict())
+
+    def close(self):
+        pass
+
+
+_agent_stores = {}
+_agent_stores_lock = threading.Lock()
+
+
+# Scrapers, workers and scheduled jobs that use the same path share one store
+def get_agent_store(store_options: dict):
+    path = store_options["path"]
+    with _agent_stores_lock:
+        if path not in _agent_stores:
+            _agent_stores[path] = AgentStore(**store_options)
+        return _agent_stores[path]
@@ -1,12 +1,113 @@
 
 from python_utils import load_json, write_json
+from .agent_store import StoreCheckpoint
+from .checkpoint import Checkpoint
+from itertools import islice
+from operator import itemgetter
+import csv
+import io
 import json
 import os
 
-class Agents:
+# Column layout shared by every agent record of one source
+class AgentSchema:
     def __init__(self, columns):
-        self.agents = []
+        self.columns = list(columns)
+        self.index = {column: i for i, column in enumerate(self.columns)}
+
+    def create_agent(self, values):
+        # values = { "Location": "...", "Full Name": "...", ... }
+        # Missing columns are left empty
+        return Agent(self, tuple(values.get(column, "") for column in self.columns))
+
+# Compact agent row, values are stored in schema column order
+# Supports agent["Full Name"] lookups just like the dicts it replaces
+class Agent:
+    __slots__ = ("schema", "values")
+
+    def __init__(self, schema, values):
+        self.schema = schema
+        self.values = values
+
+    def __getitem__(self, column):
+        return self.values[self.schema.index[column]]
+
+    def __contains__(self, column):
+        return column in self.schema.index
+
+    def get(self, column, default=""):
+        if column not in self.schema.index:
+            return default
+        return self[column]
+
+    def to_dict(self):
+        return dict(zip(self.schema.columns, self.values))
+
+# Writes agent rows to an open file, a batch at a time
+# Every field is quoted and quotes inside fields are doubled
+class AgentCsvWriter:
+    def __init__(self, file, columns, batch_size=1000):
+        self.file = file
         self.columns = columns
+        self.batch_size = batch_size
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(
+            self.buffer, quoting=csv.QUOTE_ALL, lineterminator="\n"
+        )
+        self.pending = 0
+        # itemgetter returns a bare value instead of a tuple for one column
+        if len(columns) == 1:
+            self.get_values = lambda agent: (agent[columns[0]],)
+        else:
+            self.get_values = itemgetter(*columns)
+
+    def get_row(self, agent):
+        # Records that share our columns are already in row order
+        if isinstance(agent, Agent) and agent.schema.columns == self.columns:
+            return agent.values
+        return self.get_values(agent)
+
+    def write_headers(self):
+        self.writer.writerow(self.columns)
+        self.flush()
+
+    def write_agent(self, agent):
+        self.writer.writerow(self.get_row(agent))
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def write_agents(self, agents):
+        agents = iter(agents)
+        batch = list(islice(agents, self.batch_size))
+        while batch:
+            self.writer.writerows(map(self.get_row, batch))
+            self.pending += len(batch)
+            self.flush()
+            batch = list(islice(agents, self.batch_size))
+        self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer.getvalue())
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.pending = 0
+
+class Agents:
+    def __init__(self, columns, store=None):
+        # columns can be an AgentSchema or a list of column names
+        if isinstance(columns, AgentSchema):
+            self.schema = columns
+        else:
+            self.schema = AgentSchema(columns)
+        self.agents = []
+        self.columns = self.schema.columns
+
+        # Agents and urls go to an AgentStore instead of files when given
+        self.store = store
+
+    def create_agent(self, values):
+        return self.schema.create_agent(values)
   
     def add_agent(self, agent):
         # agent = {
@@ -18,38 +119,56 @@ class Agents:
         #     "Last Name": "..."
         #     ...
         # }
+        # Dicts are packed into Agent records to keep memory down
+        if not isinstance(agent, Agent):
+            agent = self.create_agent(agent)
         self.agents.append(agent)
 
     def get_headers_as_csv_string(self):
-        headers = ""
         # ex. "Location","Name","First Name","Last Name","Phone"\n
-        for i in range(0, len(self.columns)):
-            headers += f"\"{self.columns[i]}\""
-            headers += "," if i < len(self.columns) - 1 else "\n"
-
-        return headers
+        output = io.StringIO()
+        AgentCsvWriter(output, self.columns).write_headers()
+        return output.getvalue()
     
     def get_agent_as_csv_string(self, agent):
-        agent_string = ""
-        for i in range(0, len(self.columns)):
-            agent_string += f"\"{agent[self.columns[i]]}\""
-            agent_string += "," if i < len(self.columns) - 1 else "\n"
-        return agent_string
+        output = io.StringIO()
+        AgentCsvWriter(output, self.columns).write_agents([agent])
+        return output.getvalue()
 
     def get_all_agents_as_csv_string(self):
-        agents = ""
-        
-        agents += self.get_headers_as_csv_string()
-    
-        for agent in self.agents:
-            for i in range(0, len(self.columns)):
-                agents += f"\"{getattr(agent, self.columns[i])}\""
-                agents += "," if i < len(self.columns) - 1 else "\n"
-        
-        return agents
+        output = io.StringIO()
+        self.write_csv(output)
+        return output.getvalue()
+
+    # Stream headers and every agent to an open file
+    def write_csv(self, file, batch_size=1000):
+        writer = AgentCsvWriter(file, self.columns, batch_size)
+        writer.write_headers()
+        writer.write_agents(self.agents)
     
+    # Returns a Checkpoint for the location's CSV, or for the store if there is one
+    def get_checkpoint(self, folder, location):
+        if self.store:
+            return StoreCheckpoint(self.store, folder, location)
+        os.makedirs(f"agent_data/{folder}", exist_ok=True)
+        return Checkpoint(f"agent_data/{folder}/{location}.csv")
+
+    # Headers are only needed in CSVs
+    def write_headers(self, output):
+        if not self.store:
+            output.write(self.get_headers_as_csv_string())
+
+    # output is the file or store output from get_checkpoint(...).open()
+    def write_agent(self, output, agent):
+        if self.store:
+            output.write_agent(agent)
+        else:
+            output.write(self.get_agent_as_csv_string(agent))
+
     # Returns whether or not the urls are saved within a json file
     def are_urls_saved(self, folder, location):
+        if self.store:
+            return self.store.has_urls(folder, location)
         if os.path.exists(f"agent_urls/{folder}/{location}.json"):
             return True
         else:
@@ -57,6 +176,8 @@ class Agents:
     
     # Returns saved urls that are within a json file
     def get_saved_urls(self, folder, location):
+        if self.store:
+            return self.store.get_urls(folder, location)
         return load_json(f"agent_urls/{folder}/{location}.json")
     
     # Save urls within a json file
@@ -66,6 +187,10 @@ class Agents:
         #     ...
         # ]
 
+        if self.store:
+            self.store.save_urls(folder, location, urls)
+            return
+
         os.makedirs(f"agent_urls/{folder}", exist_ok=True)
         with open(f"agent_urls/{folder}/{location}.json", "w") as f:
             write_json(f, urls)
\ No newline at end of file
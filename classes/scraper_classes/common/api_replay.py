@@ -0,0 +1,213 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from .rate_limiter import RateLimiter
+import copy
+import json
+import time
+
+
+# Replays a search api captured in the HAR so pages can be requested directly
+class ApiReplay:
+    # Headers the http client sets on its own
+    __SKIP_HEADERS = ["content-length", "host", "accept-encoding", "connection"]
+
+    # Keys apis page with, picked over any other number that changes
+    __PAGING_KEYS = ["start", "offset", "from", "skip", "page", "pageNumber"]
+
+    # Keys apis take the page size in, when the caller doesn't know it
+    __SIZE_KEYS = ["limit", "size", "rows", "count", "pageSize", "perPage"]
+
+    # Numbers this big are epoch timestamps or cache busters, not positions
+    __MAX_POSITION = 10**9
+
+    def __init__(self, http, max_workers: int = 4, min_interval: float = 0.25):
+        self.__http = http
+        self.__max_workers = max_workers
+        self.__limiter = RateLimiter(min_interval)
+
+    def get_entries(self, har, pattern, body_pattern=None):
+        # body_pattern narrows down apis that share a url, eg. graphql
+        entries = []
+        for entry in har["log"]["entries"]:
+            if pattern not in entry["request"]["url"]:
+                continue
+            if body_pattern and body_pattern not in self.get_body_text(entry):
+                continue
+            entries.append(entry)
+        return entries
+
+    def wait_for_entries(self, bmp, pattern, count, body_pattern=None, timeout=10):
+        # Poll the HAR until the api has been called count times
+        end = time.monotonic() + timeout
+        entries = self.get_entries(bmp.har(), pattern, body_pattern)
+        while len(entries) < count and time.monotonic() < end:
+            time.sleep(0.5)
+            entries = self.get_entries(bmp.har(), pattern, body_pattern)
+        return entries
+
+    def get_body_text(self, entry):
+        post_data = entry["request"].get("postData") or {}
+        return post_data.get("text") or ""
+
+    def get_paging(self, first, second, page_size=None):
+        # Compare two consecutive requests and find the number that pages
+        # A known paging key wins, otherwise the number has to go up by 1
+        # (page numbers) or page_size (offsets)
+        # Returns (location, path, start, step) or None if there isn't one
+        query_first = dict(parse_qsl(urlsplit(first["request"]["url"]).query))
+        query_second = dict(parse_qsl(urlsplit(second["request"]["url"]).query))
+        fields = {"query": (self.__flatten(query_first), self.__flatten(query_second))}
+        try:
+            fields["body"] = (
+                self.__flatten(json.loads(self.get_body_text(first))),
+                self.__flatten(json.loads(self.get_body_text(second))),
+            )
+        except:
+            pass
+
+        steps = []
+        sizes = {1, page_size}
+        for location, (values_first, values_second) in fields.items():
+            for path, start, step in self.__find_steps(values_first, values_second):
+                steps.append((location, path, start, step))
+            for path, value in values_first.items():
+                if path[-1] in ApiReplay.__SIZE_KEYS and not page_size:
+                    try:
+                        sizes.add(int(value))
+                    except:
+                        pass
+
+        for paging in steps:
+            if paging[1][-1] in ApiReplay.__PAGING_KEYS:
+                return paging
+        for paging in steps:
+            if paging[3] in sizes:
+                return paging
+        return None
+
+    def request(self, template, paging, value):
+        # Send the template request with the paging value swapped in
+        request = template["request"]
+        location, path, start, step = paging
+
+        url = request["url"]
+        if location == "query":
+            parts = urlsplit(url)
+            query = dict(parse_qsl(parts.query))
+            query[path[0]] = str(value)
+            url = urlunsplit(parts._replace(query=urlencode(query)))
+
+        data = self.get_body_text(template) or None
+        if location == "body":
+            body = json.loads(data)
+            self.__set(body, path, value)
+            data = json.dumps(body)
+
+        self.__limiter.wait()
+        response = self.__http.request(
+            request["method"], url, headers=self.get_headers(template), data=data
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def request_batch(self, template, path, values):
+        # Sends the template body once per value in a single request, as a
+        # json array, which many graphql servers answer with an array of results
+        # path is where the value goes in the body, see find_path
+        request = template["request"]
+        body = json.loads(self.get_body_text(template))
+        bodies = []
+        for value in values:
+            batch_body = copy.deepcopy(body)
+            self.__set(batch_body, path, value)
+            bodies.append(batch_body)
+
+        self.__limiter.wait()
+        response = self.__http.request(
+            request["method"],
+            request["url"],
+            headers=self.get_headers(template),
+            data=json.dumps(bodies),
+        )
+        response.raise_for_status()
+        results = response.json()
+        if not isinstance(results, list) or len(results) != len(values):
+            raise ValueError("The api doesn't answer batched requests")
+        return results
+
+    def find_path(self, body, value, normalize=None):
+        # Returns the path of value in a json body, eg. ("variables", "id")
+        # normalize(value) lets differently formatted values match, eg. phones
+        if normalize:
+            value = normalize(value)
+        for path, found in self.__flatten(body).items():
+            if (normalize(found) if normalize else found) == value:
+                return path
+        return None
+
+    def get_value(self, body, path):
+        # Returns the value at a path from find_path, or None if it isn't there
+        try:
+            for key in path:
+                body = body[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+        return body
+
+    def get_headers(self, template):
+        headers = {}
+        for header in template["request"].get("headers", []):
+            name = header["name"]
+            if name.startswith(":") or name.lower() in ApiReplay.__SKIP_HEADERS:
+                continue
+            headers[name] = header["value"]
+        return headers
+
+    def replay_pages(self, template, paging, page_count, first_page: int = 0):
+        # Returns the json of pages first_page to page_count - 1 in page order,
+        # None for failed pages
+        location, path, start, step = paging
+
+        def get_page(page):
+            try:
+                return self.request(template, paging, start + step * page)
+            except:
+                return None
+
+        with ThreadPoolExecutor(self.__max_workers) as executor:
+            return list(executor.map(get_page, range(first_page, page_count)))
+
+    def __flatten(self, obj, path=()):
+        # Flattens nested dicts and lists to {(key, index, ...): value}
+        if isinstance(obj, list):
+            items = enumerate(obj)
+        elif isinstance(obj, dict):
+            items = obj.items()
+        else:
+            return {path: obj}
+        flat = {}
+        for key, value in items:
+            flat.update(self.__flatten(value, path + (key,)))
+        return flat
+
+    def __find_steps(self, first, second):
+        # Returns (path, start, step) for every number that goes up between
+        # the two requests, leaving out timestamps
+        steps = []
+        for path, value in first.items():
+            if path not in second:
+                continue
+            try:
+                start = int(value)
+                step = int(second[path]) - start
+            except:
+                continue
+            if step > 0 and start < ApiReplay.__MAX_POSITION:
+                steps.append((path, start, step))
+        return steps
+
+    def __set(self, obj, path, value):
+        for key in path[:-1]:
+            obj = obj[key]
+        # Keep the original type, some apis send numbers as strings
+        obj[path[-1]] = str(value) if isinstance(obj[path[-1]], str) else value
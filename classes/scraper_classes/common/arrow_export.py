@@ -0,0 +1,136 @@
+import csv
+import glob
+import os
+
+# pyarrow is only needed for exporting, scraping works without it
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+# Writes agents from every source to Parquet or Arrow files with one schema,
+# partitioned by source and location
+# ex. agent_data/parquet/source=bhhs/location=Los Angeles, CA, USA/agents.parquet
+#
+# Parquet files are compressed and let readers skip every column they don't
+# ask for. Arrow files are uncompressed, so
+# pyarrow.feather.read_table(path, memory_map=True) loads one without copying.
+class AgentArrowExporter:
+    # Unified column: the source columns it's taken from, first one wins
+    __COLUMNS = {
+        "source_url": ["Source"],
+        "scrape_date": ["Scrape Date"],
+        "id": ["Id"],
+        "full_name": ["Full Name"],
+        "first_name": ["First Name"],
+        "last_name": ["Last Name"],
+        "dre": ["DRE", "DRE#"],
+        "phone": ["Phone"],
+        "mobile_phone": ["Mobile #"],
+        "office_phone": ["Office #"],
+        "email": ["Email"],
+        "brokerage": ["Brokerage"],
+        "url": ["Url"],
+    }
+
+    __EXTENSIONS = {"parquet": "parquet", "arrow": "arrow"}
+
+    def __init__(self, format: str = "parquet"):
+        if pa is None:
+            raise ImportError("pyarrow is required to export Parquet or Arrow files")
+        if format not in AgentArrowExporter.__EXTENSIONS:
+            raise ValueError(f"Unknown format: {format}")
+        self.__format = format
+
+        # { (source, location): { column: [values] } }
+        self.__partitions = {}
+
+    @staticmethod
+    def get_schema():
+        fields = []
+        for column in AgentArrowExporter.__COLUMNS:
+            fields.append(
+                pa.field(column, pa.int32() if column == "id" else pa.string())
+            )
+        return pa.schema(fields)
+
+    def add_row(self, source, row):
+        # source is the short name used for folders, eg. "bhhs"
+        # row is a dict in that source's column layout
+        key = (source, row.get("Location", ""))
+        if key not in self.__partitions:
+            self.__partitions[key] = {
+                column: [] for column in AgentArrowExporter.__COLUMNS
+            }
+        partition = self.__partitions[key]
+
+        for column, source_columns in AgentArrowExporter.__COLUMNS.items():
+            value = next((row[col] for col in source_columns if col in row), None)
+            if column == "id":
+                value = int(value) if value not in (None, "") else None
+            elif value is not None:
+                value = str(value)
+            partition[column].append(value)
+
+    def add_agents(self, source, agents):
+        # agents is an Agents instance
+        for agent in agents.agents:
+            self.add_row(source, agent.to_dict())
+
+    def add_csv_folder(self, folder, sources):
+        # agent_data/<source>/<loc>.csv, skipping delta and inactive files
+        for source in sources:
+            for file_name in sorted(glob.glob(os.path.join(folder, source, "*.csv"))):
+                if os.path.basename(file_name).count(".") != 1:
+                    continue
+                with open(file_name, "r", encoding="utf-8", newline="") as f:
+                    for row in csv.DictReader(f):
+                        self.add_row(source, row)
+
+    def add_store(self, store, sources):
+        for source in sources:
+            for row in store.get_agents(source):
+                self.add_row(source, row)
+
+    def write(self, root):
+        # Each partition is replaced as a whole, so reruns don't duplicate rows
+        schema = AgentArrowExporter.get_schema()
+        extension = AgentArrowExporter.__EXTENSIONS[self.__format]
+        for (source, location), columns in self.__partitions.items():
+            table = pa.Table.from_pydict(columns, schema=schema)
+            folder = os.path.join(root, f"source={source}", f"location={location}")
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, f"agents.{extension}")
+            temp_path = f"{path}.tmp"
+            if self.__format == "parquet":
+                pq.write_table(table, temp_path, compression="zstd")
+            else:
+                feather.write_feather(table, temp_path, compression="uncompressed")
+            os.replace(temp_path, path)
+        return len(self.__partitions)
+
+
+def read_agents(root, format="parquet", columns=None, source=None, location=None):
+    # Loads an export as a pyarrow Table, reading only the columns asked for
+    # and only the partitions that match source and location
+    # ex. read_agents("agent_data/parquet", columns=["email"], location="Los Angeles, CA")
+    if pa is None:
+        raise ImportError("pyarrow is required to read Parquet or Arrow files")
+    dataset = ds.dataset(
+        root,
+        format="ipc" if format == "arrow" else "parquet",
+        partitioning="hive",
+        schema=AgentArrowExporter.get_schema()
+        .append(pa.field("source", pa.string()))
+        .append(pa.field("location", pa.string())),
+    )
+    condition = None
+    for field, value in [("source", source), ("location", location)]:
+        if value is not None:
+            expression = ds.field(field) == value
+            condition = expression if condition is None else condition & expression
+    return dataset.to_table(columns=columns, filter=condition)
@@ -0,0 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import asyncio
+import time
+
+
+# Lets rate requests through per second, with bursts of up to burst requests
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.__rate = rate
+        self.__burst = burst
+        self.__tokens = burst
+        self.__updated = time.monotonic()
+        self.__lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.__lock:
+            while True:
+                now = time.monotonic()
+                self.__tokens = min(
+                    self.__burst, self.__tokens + (now - self.__updated) * self.__rate
+                )
+                self.__updated = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.__tokens) / self.__rate)
+
+
+# Concurrency and rate limits for one domain
+class DomainLimit:
+    def __init__(self, concurrency: int = 4, rate: float = 2, burst: int = None):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate, burst or concurrency)
+
+
+# Runs blocking fetches and browser calls from asyncio without going over
+# each brokerage's throttling threshold
+#
+# async_options = {
+#     "default": {"concurrency": 4, "rate": 2},
+#     "limits": {
+#         "www.bhhs.com": {"concurrency": 16, "rate": 8},
+#     },
+#     "window": 200,  # Agents in flight before results are written
+# }
+#
+# The http client and Selenium are both blocking, so calls run on a thread
+# pool sized to the combined limits. The browser gets its own single thread
+# because a driver can only do one thing at a time.
+#
+# When the scraper already paces requests with an AdaptiveRateLimiter, pass
+# it as limiter so the token buckets are skipped and only one limiter waits
+class AsyncCore:
+    def __init__(self, async_options: dict, limiter=None):
+        self.__limiter = limiter
+        self.__default = async_options.get("default", {})
+        self.__options = async_options.get("limits", {})
+        self.__window = async_options.get("window", 200)
+        self.__limits = {}
+
+        size = self.__default.get("concurrency", 4)
+        for limit in self.__options.values():
+            size += limit.get("concurrency", 4)
+        self.__executor = ThreadPoolExecutor(size)
+        self.__browser = ThreadPoolExecutor(1)
+
+    def close(self):
+        self.__executor.shutdown()
+        self.__browser.shutdown()
+
+    def get_window(self):
+        return self.__window
+
+    def get_limit(self, url):
+        # Limits are created lazily so they belong to the running event loop
+        domain = urlsplit(url).netloc
+        if domain not in self.__limits:
+            options = self.__options.get(domain, self.__default)
+            self.__limits[domain] = DomainLimit(**options)
+        return self.__limits[domain]
+
+    async def run(self, url, func, *args):
+        # Run func(*args) once url's domain has room for another request
+        limit = self.get_limit(url)
+        async with limit.semaphore:
+            if not self.__limiter:
+                await limit.bucket.acquire()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.__executor, func, *args)
+
+    async def run_browser(self, url, func, *args):
+        # Browser calls take turns on one thread, and count against url's domain
+        limit = self.get_limit(url)
+        async with limit.semaphore:
+            if not self.__limiter:
+                await limit.bucket.acquire()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.__browser, func, *args)
+
+    async def map_in_order(self, ids, scrape, write):
+        # scrape(id) is a coroutine returning a result or None
+        # write(id, result) is called in the order of ids, a window at a time
+        for start in range(0, len(ids), self.__window):
+            window = ids[start : start + self.__window]
+            results = await asyncio.gather(*(scrape(id) for id in window))
+            for id, result in zip(window, results):
+                write(id, result)
+
+    def run_in_order(self, ids, scrape, write):
+        # Every asyncio.run gets a new event loop, so start with fresh limits
+        self.__limits = {}
+        asyncio.run(self.map_in_order(ids, scrape, write))
@@ -0,0 +1,73 @@
+from python_utils import get_last_id_in_csv_file
+import json
+import os
+
+
+# Progress file kept next to an output CSV so resuming doesn't rescan the CSV
+# ex. agent_data/bhhs/Los Angeles, CA, USA.checkpoint.json
+# {
+#     "last_id": 41,       # Last id that was written or skipped
+#     "offset": 10394,     # Size of the CSV when the checkpoint was saved
+#     "skipped": [3, 17],  # Ids skipped because of BadUrl or repeated timeouts
+# }
+class Checkpoint:
+    def __init__(self, file_name: str, batch_size: int = 10):
+        self.__file_name = file_name
+        self.__path = f"{os.path.splitext(file_name)[0]}.checkpoint.json"
+        self.__batch_size = batch_size
+        self.__pending = 0
+        self.__progress = None
+
+        if os.path.exists(self.__path):
+            with open(self.__path, "r") as f:
+                self.__progress = json.load(f)
+
+        # Ignore a checkpoint that doesn't match the CSV, eg. the CSV was deleted
+        if self.__progress and (
+            not os.path.exists(file_name)
+            or os.path.getsize(file_name) < self.__progress["offset"]
+        ):
+            self.__progress = None
+
+    def open(self):
+        # Rows written after the last checkpoint are dropped and scraped again
+        output = open(self.__file_name, "a+", encoding="utf-8")
+        if self.__progress:
+            output.truncate(self.__progress["offset"])
+            output.seek(self.__progress["offset"])
+        return output
+
+    def get_last_id(self, col_id):
+        if self.__progress:
+            return self.__progress["last_id"]
+
+        # CSVs from before checkpoints existed are scanned once
+        last_id = get_last_id_in_csv_file(self.__file_name, col_id)
+        self.__progress = {"last_id": last_id, "offset": 0, "skipped": []}
+        return last_id
+
+    def get_skipped(self):
+        return self.__progress["skipped"] if self.__progress else []
+
+    def done(self, id, output):
+        self.__progress["last_id"] = id
+        self.__pending += 1
+        if self.__pending >= self.__batch_size:
+            self.save(output)
+
+    def skip(self, id, output):
+        if id not in self.__progress["skipped"]:
+            self.__progress["skipped"].append(id)
+        self.done(id, output)
+
+    def save(self, output):
+        # Make sure every row counted in the checkpoint is on disk first
+        output.flush()
+        self.__progress["offset"] = output.tell()
+        self.__pending = 0
+
+        # Write to a temporary file and swap it in so a crash can't leave half a file
+        temp_path = f"{self.__path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.__progress, f)
+        os.replace(temp_path, self.__path)
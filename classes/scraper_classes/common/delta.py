@@ -0,0 +1,155 @@
+from python_utils import cprint
+import csv
+import json
+import os
+import zlib
+
+
+# Rescrapes a location by diffing its freshly discovered agent urls against
+# the urls of the last complete run, instead of crawling every profile again
+#   added     - new urls, scraped
+#   removed   - urls that disappeared, moved to <loc>.inactive.csv
+#   unchanged - copied from the old CSV, except for a rotating sample that is
+#               scraped again so every agent is rechecked every recheck_every runs
+#
+# The new agents are written under the location "<loc>.delta", ie.
+# <loc>.delta.csv or the same location in the AgentStore, and swapped in once
+# they're complete. <loc>.delta.json keeps the run count, and both url lists
+# while a delta is in progress so a restart resumes the same delta
+class DeltaScrape:
+    def __init__(self, source: str, loc: str, recheck_every: int = 4, store=None):
+        self.__source = source
+        self.__store = store
+        self.__file_name = f"agent_data/{source}/{loc}.csv"
+        self.__delta_name = f"agent_data/{source}/{loc}.delta.csv"
+        self.__inactive_name = f"agent_data/{source}/{loc}.inactive.csv"
+        self.__path = f"agent_data/{source}/{loc}.delta.json"
+        self.__loc = loc
+        self.__recheck_every = recheck_every
+
+        self.__state = {"run": 0}
+        if os.path.exists(self.__path):
+            with open(self.__path, "r") as f:
+                self.__state = json.load(f)
+
+        # { url: row of the old CSV } for agents that don't need scraping
+        self.__carried = {}
+        self.__removed = []
+
+    def can_start(self):
+        # A delta needs a previous run to diff against
+        if self.is_running():
+            return True
+        if self.__store:
+            return self.__store.has_agents(self.__source, self.__loc)
+        return os.path.exists(self.__file_name)
+
+    def is_running(self):
+        return "new" in self.__state
+
+    def start(self, old_urls, new_urls):
+        self.__state["old"] = old_urls
+        self.__state["new"] = new_urls
+        self.save()
+
+        # Don't resume a delta left over from a different pair of url lists
+        if self.__store:
+            self.__store.clear_location(self.__source, self.get_output_location())
+        for path in [self.__delta_name, self.get_checkpoint_name()]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def get_urls(self):
+        return self.__state["new"]
+
+    def get_output_location(self):
+        return f"{self.__loc}.delta"
+
+    def get_checkpoint_name(self):
+        return f"{os.path.splitext(self.__delta_name)[0]}.checkpoint.json"
+
+    def plan(self, col_id, get_url=None):
+        # get_url(row) returns the url of an old CSV row
+        # By default Id is an index into the old url list
+        old_urls = self.__state["old"]
+        if get_url is None:
+            get_url = lambda row: old_urls[int(row[col_id])]
+
+        new_urls = set(url for url in self.__state["new"] if url)
+        rows = {}
+        for row in self.get_old_rows():
+            try:
+                rows[get_url(row)] = row
+            except:
+                continue
+
+        run = self.__state["run"]
+        rechecked = 0
+        for url, row in rows.items():
+            if url not in new_urls:
+                self.__removed.append(row)
+            elif zlib.crc32(url.encode()) % self.__recheck_every == (
+                run % self.__recheck_every
+            ):
+                rechecked += 1
+            else:
+                self.__carried[url] = row
+
+        added = len(new_urls) - len(self.__carried) - rechecked
+        cprint(
+            f"<c>{self.__loc}<w> - <g>{added} added<w>, "
+            f"<r>{len(self.__removed)} removed<w>, "
+            f"{len(self.__carried)} unchanged, {rechecked} rechecked"
+        )
+
+    def get_old_rows(self):
+        if self.__store:
+            yield from self.__store.get_agents(self.__source, self.__loc)
+            return
+        with open(self.__file_name, "r", encoding="utf-8", newline="") as f:
+            yield from csv.DictReader(f)
+
+    def get_carried(self, url):
+        # Returns the old CSV row for url, or None if it has to be scraped
+        return self.__carried.get(url)
+
+    def finish(self, scrape_date, col_inactive="Inactive Since"):
+        if self.__store:
+            self.__store.replace_location(
+                self.__source,
+                self.get_output_location(),
+                self.__loc,
+                self.__removed,
+                scrape_date,
+            )
+        else:
+            self.finish_csv(scrape_date, col_inactive)
+
+        self.__state = {"run": self.__state["run"] + 1}
+        self.save()
+
+    def finish_csv(self, scrape_date, col_inactive):
+        # Keep removed agents around, marked with the date they disappeared
+        if self.__removed:
+            columns = list(self.__removed[0].keys()) + [col_inactive]
+            write_headers = not os.path.exists(self.__inactive_name)
+            with open(self.__inactive_name, "a", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(
+                    f, columns, quoting=csv.QUOTE_ALL, lineterminator="\n"
+                )
+                if write_headers:
+                    writer.writeheader()
+                for row in self.__removed:
+                    writer.writerow(dict(row, **{col_inactive: scrape_date}))
+
+        # Swap the new CSV and its checkpoint in for the old ones
+        os.replace(self.__delta_name, self.__file_name)
+        checkpoint_name = f"{os.path.splitext(self.__file_name)[0]}.checkpoint.json"
+        os.replace(self.get_checkpoint_name(), checkpoint_name)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.__path), exist_ok=True)
+        temp_path = f"{self.__path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.__state, f)
+        os.replace(temp_path, self.__path)
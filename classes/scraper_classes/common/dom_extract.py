@@ -0,0 +1,68 @@
+# Reads many fields off a page with a single WebDriver round trip
+#
+# fields = {
+#     "name": ".//div[contains(@class, 'agentCard-name')]",
+#     "dre": (".//ul[contains(@class, 'license')]", "data-license"),
+# }
+#
+# Each field is an xpath, or an (xpath, attribute) pair. Values are the
+# node's textContent unless an attribute is given, and None when the node
+# doesn't exist, so callers can keep their usual "" defaults.
+
+_SCRIPT = """
+const [cardXPath, fields] = arguments;
+
+function first(xpath, context) {
+    return document.evaluate(
+        xpath, context, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue;
+}
+
+function read(context) {
+    const row = {};
+    for (const [name, [xpath, attribute]] of Object.entries(fields)) {
+        const node = first(xpath, context);
+        if (!node) {
+            row[name] = null;
+        } else if (attribute === "textContent") {
+            row[name] = node.textContent;
+        } else {
+            row[name] = node.getAttribute(attribute);
+        }
+    }
+    return row;
+}
+
+if (cardXPath === null) {
+    return read(document);
+}
+
+const cards = document.evaluate(
+    cardXPath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+);
+const rows = [];
+for (let i = 0; i < cards.snapshotLength; i++) {
+    rows.push(read(cards.snapshotItem(i)));
+}
+return rows;
+"""
+
+
+def _get_field_args(fields):
+    args = {}
+    for name, field in fields.items():
+        if isinstance(field, str):
+            field = (field, "textContent")
+        args[name] = list(field)
+    return args
+
+
+def extract_cards(driver, card_xpath, fields):
+    # Returns one dict per node matching card_xpath
+    # Field xpaths are relative to the card, eg. ".//a[@class='phone']"
+    return driver.execute_script(_SCRIPT, card_xpath, _get_field_args(fields))
+
+
+def extract_fields(driver, fields):
+    # Returns one dict for the whole page, eg. an agent profile
+    return driver.execute_script(_SCRIPT, None, _get_field_args(fields))
@@ -0,0 +1,82 @@
+from python_utils import cprint
+import json
+import time
+
+
+# Reads the HAR a page at a time so it never grows past one page of traffic
+class HarStream:
+    def __init__(self, bmp, ref: str, pattern: str, parse):
+        # parse(content) returns a list of results from one matching response
+        self.__bmp = bmp
+        self.__ref = ref
+        self.__pattern = pattern
+        self.__parse = parse
+        self.__results = []
+        self.__new_har = None
+        self.__hands_back = False
+        self.__seen = set()
+
+    def start(self):
+        # browsermob's Client.new_har hands back (status, the HAR it replaced),
+        # so a poll can swap in a fresh HAR without losing responses that
+        # come in between. It's called directly when the proxy exposes it
+        self.__seen = set()
+        self.__new_har = getattr(self.__bmp, "new_har", None)
+        if self.__new_har:
+            self.__new_har(self.__ref)
+            return
+        self.__hands_back = isinstance(self.__bmp.start_har(self.__ref), tuple)
+        if not self.__hands_back:
+            cprint(
+                "<y>The proxy doesn't hand back its HAR, so responses that finish "
+                "while it restarts can be missed."
+            )
+
+    def get_results(self):
+        return self.__results
+
+    def read_har(self):
+        # Starts a fresh HAR so images, scripts and other bodies are dropped
+        # right away, and returns the one it replaced
+        if self.__new_har:
+            status, har = self.__new_har(self.__ref)
+        elif self.__hands_back:
+            status, har = self.__bmp.start_har(self.__ref)
+        else:
+            har = self.__bmp.har()
+            self.__bmp.start_har(self.__ref)
+        return har or {"log": {"entries": []}}
+
+    def poll(self):
+        # Keep the results of matching responses that weren't read yet
+        found = 0
+        for entry in self.read_har()["log"]["entries"]:
+            url = entry["request"]["url"]
+            if self.__pattern not in url:
+                continue
+            try:
+                text = entry["response"]["content"]["text"]
+                content = json.loads(text)
+            except:
+                continue
+
+            # The same response can be in more than one HAR read
+            key = (url, hash(text))
+            if key in self.__seen:
+                continue
+            self.__seen.add(key)
+            try:
+                self.__results += self.__parse(content)
+                found += 1
+            except:
+                continue
+        return found
+
+    def wait_for_responses(self, count: int = 1, timeout: int = 10):
+        # Poll until count matching responses have come in, or time runs out
+        end = time.monotonic() + timeout
+        found = self.poll()
+        while found < count and time.monotonic() < end:
+            time.sleep(0.5)
+            found += self.poll()
+        return found
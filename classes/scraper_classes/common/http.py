@@ -0,0 +1,81 @@
+from lxml import html
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import requests
+
+
+# Pooled HTTP session for pages that don't need a browser to render
+class HttpSession:
+    # Headers sent with every request so static fetches look like Chrome
+    __HEADERS = {
+        "User-Agent": (
+            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+            "(KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36"
+        ),
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Accept-Language": "en-US,en;q=0.9",
+    }
+
+    # Statuses that mean the server wants us to slow down
+    __THROTTLED = [429, 500, 502, 503, 504]
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        timeout: int = 10,
+        retries: int = 3,
+        limiter=None,
+    ):
+        # limiter is an optional AdaptiveRateLimiter shared with the browser
+        self.__timeout = timeout
+        self.__limiter = limiter
+        self.__s = requests.Session()
+        self.__s.headers.update(HttpSession.__HEADERS)
+
+        # Keep connections alive between profiles and retry transient errors
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=HttpSession.__THROTTLED,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.__s.mount("https://", adapter)
+        self.__s.mount("http://", adapter)
+
+    def close(self):
+        self.__s.close()
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.__timeout)
+        if not self.__limiter:
+            return self.__s.request(method, url, **kwargs)
+
+        self.__limiter.wait(url)
+        try:
+            response = self.__s.request(method, url, **kwargs)
+        except:
+            self.__limiter.failure(url)
+            raise
+        # Unexpected redirects are often how throttling shows up
+        throttled = response.status_code in HttpSession.__THROTTLED
+        if throttled or self.is_redirected(response, url):
+            self.__limiter.failure(url)
+        else:
+            self.__limiter.success(url)
+        return response
+
+    def get_validators(self, response):
+        # What to send back in a conditional request for the same page
+        return response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+    def is_redirected(self, response, url):
+        # Ignore trailing slashes the server adds on its own
+        return response.url.rstrip("/") != url.rstrip("/")
+
+    def parse_html(self, response):
+        return html.fromstring(response.content)
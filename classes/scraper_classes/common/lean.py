@@ -0,0 +1,53 @@
+# Url patterns blocked in lean mode, grouped so a source can allow a group back
+BLOCKED_URLS = {
+    "images": [
+        "*.png*",
+        "*.jpg*",
+        "*.jpeg*",
+        "*.gif*",
+        "*.webp*",
+        "*.svg*",
+        "*.ico*",
+    ],
+    "media": ["*.mp4*", "*.webm*", "*.mp3*", "*.m3u8*"],
+    "fonts": ["*.woff*", "*.woff2*", "*.ttf*", "*.otf*", "*.eot*"],
+    "trackers": [
+        "*google-analytics.com*",
+        "*googletagmanager.com*",
+        "*doubleclick.net*",
+        "*googlesyndication.com*",
+        "*facebook.net*",
+        "*connect.facebook.com*",
+        "*hotjar.com*",
+        "*newrelic.com*",
+        "*nr-data.net*",
+        "*segment.io*",
+        "*segment.com*",
+        "*optimizely.com*",
+        "*quantserve.com*",
+        "*scorecardresearch.com*",
+        "*bing.com/bat*",
+        "*tiktok.com*",
+        "*pinterest.com*",
+    ],
+}
+
+
+def get_blocked_urls(allow: list = []):
+    # allow can hold group names (eg. "images") or single patterns (eg. "*.svg*")
+    urls = []
+    for group, patterns in BLOCKED_URLS.items():
+        if group in allow:
+            continue
+        urls += [pattern for pattern in patterns if pattern not in allow]
+    return urls
+
+
+def use_lean_browsing(driver, lean_options: dict = None):
+    # Stop Chrome from requesting anything we never read
+    # Blocked requests never reach the proxy, so they stay out of the HAR as well
+    if not lean_options:
+        return
+    urls = get_blocked_urls(lean_options.get("allow", []))
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": urls})
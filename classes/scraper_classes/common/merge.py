@@ -0,0 +1,213 @@
+from difflib import SequenceMatcher
+import csv
+import glob
+import os
+import re
+
+
+# Merges the agents every source scraped into one row per person
+#
+# Rows are only compared when they share a normalized DRE, email or phone
+# (a block), so the work grows with the size of the blocks instead of with
+# every pair of rows. Within a block two rows are the same agent when their
+# names are similar enough for that key, eg. a shared office phone needs a
+# much closer name than a shared DRE.
+class AgentMerger:
+    # Source columns read for each field, the sources don't agree on names
+    __COLUMNS = {
+        "name": ["Full Name"],
+        "dre": ["DRE", "DRE#"],
+        "phone": ["Phone", "Mobile #", "Office #"],
+        "email": ["Email"],
+        "location": ["Location"],
+        "source": ["Source"],
+    }
+
+    __NON_DIGITS = re.compile(r"\D")
+    __NON_LETTERS = re.compile(r"[^a-z ]")
+
+    # Columns of the merged table, in order
+    COLUMNS = [
+        "Agent Id",
+        "Full Name",
+        "First Name",
+        "Last Name",
+        "DRE",
+        "Phones",
+        "Emails",
+        "Sources",
+        "Locations",
+        "Rows",
+    ]
+
+    def __init__(
+        self,
+        thresholds: dict = None,
+        max_block: int = 50,
+    ):
+        # Minimum name similarity (0 to 1) for rows sharing each key
+        self.__thresholds = thresholds or {"dre": 0.5, "email": 0.6, "phone": 0.85}
+        # Bigger blocks are usually a brokerage's office number or inbox,
+        # which say nothing about who the agent is
+        self.__max_block = max_block
+        self.__rows = []
+
+        # { ("email", "jane@x.com"): [row index, ...], ... }
+        self.__blocks = {}
+
+    # Normalizing
+
+    def normalize_dre(self, dre):
+        # "CA DRE# 01234567", "#01234567" and "1234567" are the same license
+        digits = AgentMerger.__NON_DIGITS.sub("", dre or "")
+        return digits.lstrip("0") or None
+
+    def normalize_phone(self, phone):
+        # Keeps the last 10 digits, which drops a leading country code
+        digits = AgentMerger.__NON_DIGITS.sub("", phone or "")
+        return digits[-10:] if len(digits) >= 10 else None
+
+    def normalize_email(self, email):
+        email = (email or "").strip().lower()
+        return email if "@" in email else None
+
+    def normalize_name(self, name):
+        # "Doe, Jane M." and "jane m doe" both become "doe jane m"
+        words = AgentMerger.__NON_LETTERS.sub(" ", (name or "").lower()).split()
+        return " ".join(sorted(words))
+
+    def get_values(self, row, field):
+        return [row[col] for col in AgentMerger.__COLUMNS[field] if row.get(col)]
+
+    # Loading
+
+    def add_row(self, row):
+        # row is a dict in any source's column layout
+        # Only the fields the merged table needs are kept
+        name = (self.get_values(row, "name") or [""])[0]
+        dres = list(filter(None, map(self.normalize_dre, self.get_values(row, "dre"))))
+        values = {
+            "name": name,
+            "key_name": self.normalize_name(name),
+            "dre": dres[0] if dres else None,
+            "phones": list(
+                dict.fromkeys(
+                    filter(
+                        None, map(self.normalize_phone, self.get_values(row, "phone"))
+                    )
+                )
+            ),
+            "emails": list(
+                dict.fromkeys(
+                    filter(
+                        None, map(self.normalize_email, self.get_values(row, "email"))
+                    )
+                )
+            ),
+            "source": row.get("Source", ""),
+            "location": row.get("Location", ""),
+        }
+
+        i = len(self.__rows)
+        self.__rows.append(values)
+        if values["dre"]:
+            self.__blocks.setdefault(("dre", values["dre"]), []).append(i)
+        for email in values["emails"]:
+            self.__blocks.setdefault(("email", email), []).append(i)
+        for phone in values["phones"]:
+            self.__blocks.setdefault(("phone", phone), []).append(i)
+
+    def add_csv(self, file_name):
+        with open(file_name, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                self.add_row(row)
+
+    def add_csv_folder(self, folder):
+        # agent_data/<source>/<loc>.csv, skipping delta and inactive files
+        for file_name in sorted(glob.glob(os.path.join(folder, "*", "*.csv"))):
+            if os.path.basename(file_name).count(".") == 1:
+                self.add_csv(file_name)
+
+    def add_store(self, store, sources):
+        for source in sources:
+            for row in store.get_agents(source):
+                self.add_row(row)
+
+    # Matching
+
+    def is_same_name(self, a, b, threshold):
+        if a == b:
+            return True
+        if not a or not b:
+            return False
+        return SequenceMatcher(None, a, b).ratio() >= threshold
+
+    def get_groups(self):
+        # Union-find over row indexes
+        parents = list(range(len(self.__rows)))
+
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        for (field, _), block in self.__blocks.items():
+            if len(block) < 2 or len(block) > self.__max_block:
+                continue
+            threshold = self.__thresholds[field]
+            for n, i in enumerate(block):
+                for j in block[n + 1 :]:
+                    root_i, root_j = find(i), find(j)
+                    if root_i == root_j:
+                        continue
+                    if self.is_same_name(
+                        self.__rows[i]["key_name"],
+                        self.__rows[j]["key_name"],
+                        threshold,
+                    ):
+                        parents[root_j] = root_i
+
+        groups = {}
+        for i in range(len(self.__rows)):
+            groups.setdefault(find(i), []).append(i)
+        return list(groups.values())
+
+    # Output
+
+    def merge_group(self, id, group):
+        rows = [self.__rows[i] for i in group]
+
+        # The longest name is usually the most complete one
+        name = max((values["name"] for values in rows), key=len).strip()
+
+        def unique(items):
+            return "; ".join(dict.fromkeys(item for item in items if item))
+
+        return {
+            "Agent Id": id,
+            "Full Name": name,
+            "First Name": name.split(" ")[0],
+            "Last Name": name.split(" ")[-1],
+            "DRE": unique(
+                f"#{values['dre'].zfill(8)}" for values in rows if values["dre"]
+            ),
+            "Phones": unique(phone for values in rows for phone in values["phones"]),
+            "Emails": unique(email for values in rows for email in values["emails"]),
+            "Sources": unique(values["source"] for values in rows),
+            "Locations": unique(values["location"] for values in rows),
+            "Rows": len(rows),
+        }
+
+    def merge(self):
+        # Returns one dict per agent, in the COLUMNS layout
+        return [
+            self.merge_group(id, group) for id, group in enumerate(self.get_groups())
+        ]
+
+    def write_csv(self, file):
+        writer = csv.DictWriter(
+            file, AgentMerger.COLUMNS, quoting=csv.QUOTE_ALL, lineterminator="\n"
+        )
+        writer.writeheader()
+        writer.writerows(self.merge())
@@ -0,0 +1,221 @@
+from selenium.common.exceptions import WebDriverException
+import json
+
+# Counts finished XHR / fetch calls whose url contains one of the patterns,
+# and keeps the last few of them
+# Installed on every new document so it's in place before the page's own
+# scripts make their first request
+_HOOK = """
+(() => {
+    if (window.__responseWaiter) return;
+    const waiter = (window.__responseWaiter = {
+        id: Math.random().toString(36).slice(2),
+        patterns: PATTERNS,
+        counts: {},
+        entries: {},
+    });
+
+    // Only the last few requests of each pattern are kept
+    const MAX_ENTRIES = 10;
+
+    // Requests are kept in the shape of HAR entries, so they can be replayed
+    function toRequest(method, url, headers, body) {
+        return {
+            method: (method || "GET").toUpperCase(),
+            url: new URL(String(url), location.href).href,
+            headers: Object.entries(headers).map(([name, value]) => ({ name, value })),
+            postData: { text: typeof body === "string" ? body : "" },
+        };
+    }
+
+    function done(request, status, text) {
+        for (const pattern of waiter.patterns) {
+            if (request.url.includes(pattern)) {
+                const entries = (waiter.entries[pattern] = waiter.entries[pattern] || []);
+                entries.push({ request, response: { status, content: { text } } });
+                if (entries.length > MAX_ENTRIES) entries.shift();
+                waiter.counts[pattern] = (waiter.counts[pattern] || 0) + 1;
+                window.dispatchEvent(new Event("responsewaiter"));
+            }
+        }
+    }
+
+    const open = XMLHttpRequest.prototype.open;
+    XMLHttpRequest.prototype.open = function (method, url) {
+        this.__request = { method, url, headers: {} };
+        return open.apply(this, arguments);
+    };
+
+    const setRequestHeader = XMLHttpRequest.prototype.setRequestHeader;
+    XMLHttpRequest.prototype.setRequestHeader = function (name, value) {
+        if (this.__request) this.__request.headers[name] = value;
+        return setRequestHeader.apply(this, arguments);
+    };
+
+    const send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function (body) {
+        const r = this.__request;
+        if (r) {
+            this.addEventListener("loadend", () => {
+                let text = "";
+                try {
+                    text = this.responseText;
+                } catch (e) {}
+                done(toRequest(r.method, r.url, r.headers, body), this.status, text);
+            });
+        }
+        return send.apply(this, arguments);
+    };
+
+    const fetch = window.fetch;
+    window.fetch = function (input, init) {
+        const options = init || {};
+        const url = (input && input.url) || input;
+        const method = options.method || (input && input.method) || "GET";
+        const headers = {};
+        try {
+            new Headers(options.headers || (input && input.headers) || {}).forEach(
+                (value, name) => (headers[name] = value)
+            );
+        } catch (e) {}
+        const request = toRequest(method, url, headers, options.body);
+
+        return fetch.apply(this, arguments).then(
+            (response) => {
+                // Count the response once its body has arrived
+                response.clone().text().then(
+                    (text) => done(request, response.status, text),
+                    () => done(request, response.status, "")
+                );
+                return response;
+            },
+            (error) => {
+                done(request, 0, "");
+                throw error;
+            }
+        );
+    };
+})();
+"""
+
+# Resolves as soon as enough responses have finished, or when time runs out
+_WAIT = """
+const [pattern, id, seen, count, timeout] = arguments;
+const callback = arguments[arguments.length - 1];
+const waiter = window.__responseWaiter;
+if (!waiter) return callback(null);
+
+// A new document starts counting from 0
+const target = (waiter.id === id ? seen : 0) + count;
+const state = () => ({ id: waiter.id, count: waiter.counts[pattern] || 0 });
+if (state().count >= target) return callback(state());
+
+function check() {
+    if (state().count >= target) {
+        clearTimeout(timer);
+        window.removeEventListener("responsewaiter", check);
+        callback(state());
+    }
+}
+const timer = setTimeout(() => {
+    window.removeEventListener("responsewaiter", check);
+    callback(state());
+}, timeout * 1000);
+window.addEventListener("responsewaiter", check);
+"""
+
+
+# Waits for the page's own api calls to finish instead of sleeping
+# ex. waiter.run_and_wait("solrAgentSearchServlet", button.click) returns once
+#     the search the click started is in, which is also when the proxy has it
+#     in the HAR
+class ResponseWaiter:
+    # Selenium's default script timeout, for drivers that can't report theirs
+    __SCRIPT_TIMEOUT = 30
+
+    def __init__(self, driver, patterns: list):
+        self.__dr = driver
+        self.__hook = _HOOK.replace("PATTERNS", json.dumps(patterns))
+        # { pattern: (document id, responses already waited for) }
+        self.__seen = {}
+        self.__installed = False
+        self.install()
+
+    def install(self):
+        # Call again after the tab is replaced, the hook belongs to the tab
+        try:
+            self.__dr.execute_cdp_cmd(
+                "Page.addScriptToEvaluateOnNewDocument", {"source": self.__hook}
+            )
+            self.__dr.execute_script(self.__hook)
+            self.__installed = True
+        except WebDriverException:
+            self.__installed = False
+        self.__seen = {}
+
+    def mark(self, pattern):
+        # Only wait for responses that finish after this
+        if not self.__installed:
+            return
+        try:
+            state = self.__dr.execute_script(
+                "const w = window.__responseWaiter;"
+                "return w ? { id: w.id, count: w.counts[arguments[0]] || 0 } : null;",
+                pattern,
+            )
+        except WebDriverException:
+            return
+        if state:
+            self.__seen[pattern] = (state["id"], state["count"])
+
+    def get_entries(self, pattern):
+        # The last few requests matching pattern with their responses, as HAR
+        # entries, eg. for ApiReplay when there's no proxy recording a HAR
+        if not self.__installed:
+            return []
+        try:
+            return self.__dr.execute_script(
+                "const w = window.__responseWaiter;"
+                "return w ? w.entries[arguments[0]] || [] : [];",
+                pattern,
+            )
+        except WebDriverException:
+            return []
+
+    def run_and_wait(self, pattern, action, count: int = 1, timeout: int = 10):
+        # Runs action (eg. a click) and waits for the responses it causes
+        self.mark(pattern)
+        action()
+        return self.wait_for(pattern, count, timeout)
+
+    def wait_for(self, pattern, count: int = 1, timeout: int = 10):
+        # Returns whether count more responses came in before the timeout
+        # Callers fall back to polling when this returns False
+        if not self.__installed:
+            return False
+        id, seen = self.__seen.get(pattern, (None, 0))
+
+        # Other scripts keep the driver's own script timeout
+        try:
+            previous = self.__dr.timeouts.script
+        except:
+            previous = ResponseWaiter.__SCRIPT_TIMEOUT
+        try:
+            self.__dr.set_script_timeout(timeout + 5)
+            state = self.__dr.execute_async_script(
+                _WAIT, pattern, id, seen, count, timeout
+            )
+        except WebDriverException:
+            # eg. the page navigated away while waiting
+            return False
+        finally:
+            try:
+                self.__dr.set_script_timeout(previous)
+            except WebDriverException:
+                pass
+        if state is None:
+            return False
+
+        target = (seen if state["id"] == id else 0) + count
+        self.__seen[pattern] = (state["id"], state["count"])
+        return state["count"] >= target
@@ -0,0 +1,134 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# On-disk cache of the fields scraped from each agent profile, keyed by url
+# Entries younger than ttl seconds are used as is. Older entries are
+# revalidated with the ETag / Last-Modified the server sent, so a profile
+# that hasn't changed costs a 304 instead of a full scrape.
+# Once there are more than max_entries, the least recently used are dropped.
+#
+# cache_options = {
+#     "path": "agent_data/profile_cache.sqlite3",
+#     "ttl": 7 * 24 * 60 * 60,
+#     "max_entries": 200000,
+# }
+class ProfileCache:
+    def __init__(
+        self,
+        path: str,
+        ttl: int = 7 * 24 * 60 * 60,
+        max_entries: int = 200000,
+        evict_every: int = 100,
+    ):
+        self.__ttl = ttl
+        self.__max_entries = max_entries
+        self.__evict_every = evict_every
+        self.__puts = 0
+        self.__lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Workers and the async core share one connection, guarded by the lock
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.execute("""
+            CREATE TABLE IF NOT EXISTS profiles (
+                url TEXT PRIMARY KEY,
+                fields TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            )
+            """)
+        self.__db.execute(
+            "CREATE INDEX IF NOT EXISTS profiles_used_at ON profiles (used_at)"
+        )
+        self.__db.commit()
+
+    def save(self):
+        with self.__lock:
+            self.__db.commit()
+
+    def get(self, url):
+        # Returns None when the profile has never been scraped
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT fields, etag, last_modified, fetched_at FROM profiles "
+                "WHERE url = ?",
+                (url,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.__db.execute(
+                "UPDATE profiles SET used_at = ? WHERE url = ?", (time.time(), url)
+            )
+        return {
+            "fields": json.loads(row[0]),
+            "etag": row[1],
+            "last_modified": row[2],
+            "fetched_at": row[3],
+        }
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.__ttl
+
+    def get_validators(self, entry):
+        # Headers for a conditional request, empty if the server sent none
+        headers = {}
+        if entry and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def put(self, url, fields, etag=None, last_modified=None):
+        now = time.time()
+        with self.__lock:
+            self.__db.execute(
+                "INSERT OR REPLACE INTO profiles "
+                "(url, fields, etag, last_modified, fetched_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, json.dumps(fields), etag, last_modified, now, now),
+            )
+            self.__changed()
+
+    def revalidated(self, url):
+        # The server said the profile hasn't changed, so it's fresh again
+        now = time.time()
+        with self.__lock:
+            self.__db.execute(
+                "UPDATE profiles SET fetched_at = ?, used_at = ? WHERE url = ?",
+                (now, now, url),
+            )
+            self.__changed()
+
+    def __changed(self):
+        # Commit and trim the cache every evict_every writes
+        self.__puts += 1
+        if self.__puts % self.__evict_every == 0:
+            self.__evict()
+            self.__db.commit()
+
+    def __evict(self):
+        self.__db.execute(
+            "DELETE FROM profiles WHERE url IN ("
+            "SELECT url FROM profiles ORDER BY used_at DESC LIMIT -1 OFFSET ?"
+            ")",
+            (self.__max_entries,),
+        )
+
+
+_profile_caches = {}
+_profile_caches_lock = threading.Lock()
+
+
+# Scrapers and workers that use the same path share one cache
+def get_profile_cache(cache_options: dict):
+    path = cache_options["path"]
+    with _profile_caches_lock:
+        if path not in _profile_caches:
+            _profile_caches[path] = ProfileCache(**cache_options)
+        return _profile_caches[path]
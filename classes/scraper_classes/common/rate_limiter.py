@@ -0,0 +1,104 @@
+from urllib.parse import urlsplit
+import json
+import os
+import threading
+import time
+
+
+# Spaces out requests so at most one starts every min_interval seconds
+class RateLimiter:
+    def __init__(self, min_interval: float = 0.25):
+        self.__interval = min_interval
+        self.__next = 0
+        self.__lock = threading.Lock()
+
+    def wait(self):
+        with self.__lock:
+            now = time.monotonic()
+            if self.__next > now:
+                time.sleep(self.__next - now)
+                now = self.__next
+            self.__next = now + self.__interval
+
+
+# Learns how fast each host can be hit (AIMD)
+# The rate creeps up after every success and halves after a failure such as a
+# 429, a server error, a timeout or an unexpected redirect
+# Rates are saved to path so the next run starts where this one left off
+class AdaptiveRateLimiter:
+    def __init__(
+        self,
+        path: str = None,
+        start_rate: float = 1.0,
+        min_rate: float = 0.1,
+        max_rate: float = 10.0,
+        increase: float = 0.05,
+        decrease: float = 0.5,
+        save_every: int = 20,
+    ):
+        self.__path = path
+        self.__start_rate = start_rate
+        self.__min_rate = min_rate
+        self.__max_rate = max_rate
+        self.__increase = increase
+        self.__decrease = decrease
+        self.__save_every = save_every
+        self.__updates = 0
+        self.__lock = threading.Lock()
+
+        # { "www.bhhs.com": 2.35, ... } in requests per second
+        self.__rates = {}
+        self.__next = {}
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                self.__rates = json.load(f)
+
+    def get_rate(self, url):
+        return self.__rates.get(urlsplit(url).netloc, self.__start_rate)
+
+    def wait(self, url):
+        host = urlsplit(url).netloc
+        with self.__lock:
+            now = time.monotonic()
+            start = max(now, self.__next.get(host, 0))
+            self.__next[host] = start + 1 / self.get_rate(url)
+        if start > now:
+            time.sleep(start - now)
+
+    def success(self, url):
+        self.__update(url, lambda rate: min(self.__max_rate, rate + self.__increase))
+
+    def failure(self, url):
+        self.__update(url, lambda rate: max(self.__min_rate, rate * self.__decrease))
+
+    def save(self):
+        if not self.__path:
+            return
+        with self.__lock:
+            rates = dict(self.__rates)
+        os.makedirs(os.path.dirname(self.__path) or ".", exist_ok=True)
+        temp_path = f"{self.__path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(rates, f, indent=2)
+        os.replace(temp_path, self.__path)
+
+    def __update(self, url, change):
+        with self.__lock:
+            self.__rates[urlsplit(url).netloc] = change(self.get_rate(url))
+            self.__updates += 1
+            should_save = self.__updates % self.__save_every == 0
+        if should_save:
+            self.save()
+
+
+_adaptive_rate_limiters = {}
+_adaptive_rate_limiters_lock = threading.Lock()
+
+
+# Scrapers, workers and scheduled jobs that use the same path share one limiter
+def get_adaptive_rate_limiter(rate_options: dict):
+    path = rate_options.get("path")
+    with _adaptive_rate_limiters_lock:
+        if path not in _adaptive_rate_limiters:
+            _adaptive_rate_limiters[path] = AdaptiveRateLimiter(**rate_options)
+        return _adaptive_rate_limiters[path]
@@ -0,0 +1,16 @@
+from selenium.common.exceptions import WebDriverException
+
+
+# Swap a stuck tab for a fresh one while Chrome and the proxy keep running
+# Returns False if the browser itself is gone and needs a full restart
+def reset_tab(driver):
+    try:
+        stuck = driver.current_window_handle
+        driver.switch_to.new_window("tab")
+        fresh = driver.current_window_handle
+        driver.switch_to.window(stuck)
+        driver.close()
+        driver.switch_to.window(fresh)
+        return True
+    except WebDriverException:
+        return False
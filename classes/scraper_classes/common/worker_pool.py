@@ -0,0 +1,185 @@
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+import os
+import shutil
+import tempfile
+import threading
+
+
+# Chrome locks its user data directory, so workers run on a fresh profile
+def get_worker_chrome_options(chrome_options: dict):
+    options = dict(chrome_options)
+    options.pop("user_data_path", None)
+    options.pop("profile_path", None)
+    return options
+
+
+# Files copied from the template profile, everything else starts empty
+# Local State holds the key Chrome encrypts cookies with
+_COOKIE_FILES = [
+    "Cookies",
+    "Cookies-journal",
+    os.path.join("Network", "Cookies"),
+    os.path.join("Network", "Cookies-journal"),
+]
+
+
+# Copies only the cookies of the Chrome profile in chrome_options into a
+# throwaway user data directory, so many browsers can start from the same
+# logins at once without a copy of the whole profile
+#
+# pool_options = {
+#     "headless": True,
+#     "root": "/dev/shm",     # Where copies go, tmpfs keeps them in memory
+#     "recycle_after": 200,   # Jobs a worker runs before it's replaced
+# }
+def clone_chrome_profile(chrome_options: dict, pool_options: dict):
+    root = pool_options.get("root")
+    if not root or not os.path.isdir(root):
+        root = tempfile.gettempdir()
+    user_data_path = tempfile.mkdtemp(prefix="chrome-", dir=root)
+    profile_path = chrome_options.get("profile_path") or "Default"
+
+    template = chrome_options.get("user_data_path")
+    if template:
+        files = ["Local State"]
+        for file_name in _COOKIE_FILES:
+            files.append(os.path.join(profile_path, file_name))
+        for file_name in files:
+            source = os.path.join(template, file_name)
+            target = os.path.join(user_data_path, file_name)
+            if not os.path.exists(source):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                shutil.copyfile(source, target)
+            except OSError:
+                # eg. locked by the Chrome using the template
+                continue
+
+    options = dict(
+        chrome_options, user_data_path=user_data_path, profile_path=profile_path
+    )
+    if pool_options.get("headless", True):
+        options["headless"] = True
+    return options
+
+
+def remove_chrome_profile(chrome_options: dict):
+    # Only for options from clone_chrome_profile
+    shutil.rmtree(chrome_options["user_data_path"], ignore_errors=True)
+
+
+# Runs profile jobs across several browsers and hands results back in id order
+# With pool_options, each browser gets a cloned profile and is replaced after
+# recycle_after jobs so memory doesn't keep growing
+class WorkerPool:
+    def __init__(
+        self,
+        create_worker,
+        size: int,
+        chrome_options: dict = None,
+        pool_options: dict = None,
+    ):
+        # create_worker(chrome_options) should return an object with a close() method
+        self.__create_worker = create_worker
+        self.__size = size
+        self.__chrome_options = chrome_options or {}
+        self.__pool_options = pool_options
+        self.__recycle_after = (pool_options or {}).get("recycle_after")
+
+        # [(worker, its chrome options, jobs run), ...]
+        self.__workers = []
+
+    def get_size(self):
+        return self.__size
+
+    def start(self):
+        if self.__workers:
+            return
+
+        # Launching Chrome is slow, so start every worker at once
+        with ThreadPoolExecutor(self.__size) as executor:
+            futures = [executor.submit(self.launch) for _ in range(self.__size)]
+            self.__workers = [future.result() for future in futures]
+
+    def launch(self):
+        if self.__pool_options:
+            options = clone_chrome_profile(self.__chrome_options, self.__pool_options)
+        else:
+            options = get_worker_chrome_options(self.__chrome_options)
+        try:
+            return [self.__create_worker(options), options, 0]
+        except:
+            self.dispose(None, options)
+            raise
+
+    def dispose(self, worker, options):
+        if worker is not None:
+            try:
+                worker.close()
+            except:
+                pass
+        if self.__pool_options:
+            remove_chrome_profile(options)
+
+    def close(self):
+        for worker, options, _ in self.__workers:
+            self.dispose(worker, options)
+        self.__workers = []
+
+    def run(self, ids: list, job, write, skip=None):
+        # job(worker, id) returns a result, or None to skip the id
+        # write(id, result) and skip(id) are called from one thread at a time
+        # in the order of ids
+        self.start()
+
+        queue = Queue()
+        for id in ids:
+            queue.put(id)
+
+        lock = threading.Lock()
+        stop = threading.Event()
+        results = {}
+        position = 0
+
+        def flush():
+            nonlocal position
+            # Write every finished result that is next in line
+            while position < len(ids) and ids[position] in results:
+                result = results.pop(ids[position])
+                if result is not None:
+                    write(ids[position], result)
+                elif skip:
+                    skip(ids[position])
+                position += 1
+
+        def work(n):
+            while not stop.is_set():
+                try:
+                    id = queue.get_nowait()
+                except Empty:
+                    return
+
+                # Swap a worker that has run enough jobs for a fresh one
+                worker, options, jobs = self.__workers[n]
+                if self.__recycle_after and jobs >= self.__recycle_after:
+                    self.dispose(worker, options)
+                    self.__workers[n] = self.launch()
+                    worker, options, jobs = self.__workers[n]
+
+                try:
+                    result = job(worker, id)
+                except:
+                    # Let the other workers finish what they have and bail out
+                    stop.set()
+                    raise
+                self.__workers[n][2] += 1
+                with lock:
+                    results[id] = result
+                    flush()
+
+        with ThreadPoolExecutor(len(self.__workers)) as executor:
+            futures = [executor.submit(work, n) for n in range(len(self.__workers))]
+            for future in futures:
+                future.result()
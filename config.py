@@ -24,6 +24,95 @@ chrome_options = {
 
 bmp_options = {"browsermob_proxy_path": os.getenv("__BROWSERMOB_PROXY_PATH")}
 
+# Fetch agent profiles over plain http where the source supports it
+# Set to None to render every profile in Chrome
+http_options = {"pool_size": 10, "timeout": 10}
+
+# Number of browsers visiting agent profiles at once (bhhs, coldwell, kw)
+workers = 1
+
+# Give each worker and sweep browser a throwaway copy of the profile above
+# with only its cookies, in root (tmpfs), so many headless browsers can run
+# at once. Workers are replaced after recycle_after profiles to cap memory
+# Off by default, so workers run on empty profiles
+# eg. {"headless": True, "root": "/dev/shm", "recycle_after": 200}
+pool_options = None
+
+# Learn how fast each site can be hit instead of backing off blindly
+# Rates are kept in path between runs. Off by default, using exponential backoff
+# eg. {
+#     "path": "agent_data/rate_limits.json",
+#     "start_rate": 1.0,
+#     "min_rate": 0.1,
+#     "max_rate": 10.0,
+# }
+rate_options = None
+
+# Keep agents, agent urls and progress in one SQLite database instead of
+# agent_data/*.csv and agent_urls/*.json (every source)
+# Export CSVs with "python main.py export <source> [location]"
+# Off by default, so CSVs are written to agent_data/<source>/<loc>.csv
+# eg. {"path": "agent_data/agents.sqlite3", "batch_size": 100}
+store_options = None
+
+# Reuse agent profiles scraped on earlier runs (bhhs, coldwell)
+# Profiles older than ttl seconds are checked with ETag / Last-Modified first
+# Off by default, so every profile is scraped on every run
+# eg. {
+#     "path": "agent_data/profile_cache.sqlite3",
+#     "ttl": 7 * 24 * 60 * 60,
+#     "max_entries": 200000,
+# }
+cache_options = None
+
+# Diff freshly found agent urls against the last run and only scrape new
+# agents, plus a rotating sample so each agent is rechecked every
+# recheck_every runs (bhhs, coldwell). Off by default, so every agent is scraped
+# eg. {"recheck_every": 4}
+delta_options = None
+
+# Fetch many profiles at once with per-domain limits (bhhs, coldwell)
+# Takes priority over workers when set. Off by default
+# eg. {
+#     "default": {"concurrency": 4, "rate": 2},
+#     "limits": {
+#         "www.bhhs.com": {"concurrency": 16, "rate": 8},
+#         "www.coldwellbanker.com": {"concurrency": 16, "rate": 8},
+#     },
+#     "window": 200,
+# }
+async_options = None
+
+# Replay the search api captured in the HAR instead of clicking through pages
+# (bhhs, coldwell, compass, kw). Off by default, so pages load in the browser
+# realtor.com always replays its search api, with defaults when this is None
+# eg. {"max_workers": 4, "min_interval": 0.25}
+replay_options = None
+
+# Block images, media, fonts and trackers in Chrome
+# "allow" takes group names from common/lean.py or single url patterns
+# Set a source to None to load pages in full
+lean_options = {
+    "bhhs": {"allow": []},
+    "coldwell": {"allow": []},
+    "compass": {"allow": []},
+    "kw": {"allow": []},
+    "realtor.com": {"allow": []},
+}
+
+# Columnar export of every source with "python main.py arrow"
+# format is "parquet" (compressed) or "arrow" (uncompressed, memory-mappable)
+arrow_options = {"root": "agent_data/parquet", "format": "parquet"}
+
+# Merging agents across sources with "python main.py merge"
+# thresholds are how alike (0 to 1) two names must be to count as one agent
+# when they share a DRE, email or phone. Keys shared by more than max_block
+# rows, like an office phone, are ignored
+merge_options = {
+    "thresholds": {"dre": 0.5, "email": 0.6, "phone": 0.85},
+    "max_block": 50,
+}
+
 locations = {
     "bhhs": ["Santa Clara, CA, USA"],
     "coldwell": [
@@ -37,3 +126,65 @@ locations = {
 }
 
 timeouts = {"default": 5}
+
+# Nightly sweep over every source, run with "python main.py sweep"
+# Each running scrape uses proxy_port + its slot, so ports don't collide
+sweep = {
+    "sources": ["bhhs", "coldwell", "compass", "kw", "realtor.com"],
+    "max_browsers": 4,
+    "proxy_port": 8090,
+}
+
+# The eight counties, named the way each source searches for them
+sweep_locations = {
+    "bhhs": [
+        "Sacramento, CA, USA",
+        "Los Angeles, CA, USA",
+        "San Diego, CA, USA",
+        "Riverside, CA, USA",
+        "Orange, CA, USA",
+        "Contra Costa, CA, USA",
+        "Alameda, CA, USA",
+        "Santa Clara, CA, USA",
+    ],
+    "coldwell": [
+        "Sacramento, CA",
+        "Los Angeles, CA",
+        "San Diego, CA",
+        "Riverside, CA",
+        "Orange, CA",
+        "Contra Costa, CA",
+        "Alameda, CA",
+        "Santa Clara, CA",
+    ],
+    "compass": [
+        "Sacramento County, CA",
+        "Los Angeles County, CA",
+        "San Diego County, CA",
+        "Riverside County, CA",
+        "Orange County, CA",
+        "Contra Costa County, CA",
+        "Alameda County, CA",
+        "Santa Clara County, CA",
+    ],
+    "kw": [
+        "Sacramento, CA",
+        "Los Angeles, CA",
+        "San Diego, CA",
+        "Riverside, CA",
+        "Orange County, CA",
+        "Contra Costa County, CA",
+        "Alameda, CA",
+        "Santa Clara, CA",
+    ],
+    "realtor.com": [
+        "Sacramento, CA",
+        "Los Angeles, CA",
+        "San Diego, CA",
+        "Riverside, CA",
+        "Orange, CA",
+        "Contra Costa, CA",
+        "Alameda, CA",
+        "Santa Clara, CA",
+    ],
+}
@@ -1,49 +1,101 @@
 from python_utils import cprint, pause, print_trace
 from classes.Exceptions import RestartScrape
+from classes.Scheduler import Scheduler
 from classes.scraper_classes import BhhsScraper
 from classes.scraper_classes import ColdwellScraper
 from classes.scraper_classes import CompassScraper
 from classes.scraper_classes import KellerWilliamsScraper
 from classes.scraper_classes import RealtorComScraper
+from classes.scraper_classes.common import (
+    AgentArrowExporter,
+    AgentMerger,
+    clone_chrome_profile,
+    get_agent_store,
+    get_worker_chrome_options,
+    remove_chrome_profile,
+)
 import config as cfg
 from cookies import realtor_com_cookies
+import os
+import sys
 
 
-def get_scraper(source):
+def get_scraper(
+    source,
+    locations=None,
+    chrome_options=cfg.chrome_options,
+    bmp_options=cfg.bmp_options,
+):
+    if locations is None:
+        locations = cfg.locations[source]
+
     if source == "bhhs":
         return BhhsScraper(
-            chrome_options=cfg.chrome_options,
-            bmp_options=cfg.bmp_options,
-            locations=cfg.locations[source],
+            chrome_options=chrome_options,
+            bmp_options=bmp_options,
+            locations=locations,
             timeout_default=cfg.timeouts["default"],
+            lean_options=cfg.lean_options[source],
+            http_options=cfg.http_options,
+            workers=cfg.workers,
+            pool_options=cfg.pool_options,
+            replay_options=cfg.replay_options,
+            async_options=cfg.async_options,
+            rate_options=cfg.rate_options,
+            cache_options=cfg.cache_options,
+            delta_options=cfg.delta_options,
+            store_options=cfg.store_options,
         )
     elif source == "coldwell":
         return ColdwellScraper(
-            chrome_options=cfg.chrome_options,
-            bmp_options=cfg.bmp_options,
-            locations=cfg.locations[source],
+            chrome_options=chrome_options,
+            bmp_options=bmp_options,
+            locations=locations,
             timeout_default=cfg.timeouts["default"],
+            lean_options=cfg.lean_options[source],
+            workers=cfg.workers,
+            pool_options=cfg.pool_options,
+            rate_options=cfg.rate_options,
+            cache_options=cfg.cache_options,
+            delta_options=cfg.delta_options,
+            store_options=cfg.store_options,
+            http_options=cfg.http_options,
+            async_options=cfg.async_options,
+            replay_options=cfg.replay_options,
         )
     elif source == "compass":
         return CompassScraper(
-            chrome_options=cfg.chrome_options,
-            locations=cfg.locations[source],
+            chrome_options=chrome_options,
+            locations=locations,
             timeout_default=cfg.timeouts["default"],
+            lean_options=cfg.lean_options[source],
+            http_options=cfg.http_options,
+            replay_options=cfg.replay_options,
+            store_options=cfg.store_options,
         )
     elif source == "kw":
         return KellerWilliamsScraper(
-            chrome_options=cfg.chrome_options,
-            bmp_options=cfg.bmp_options,
-            locations=cfg.locations[source],
+            chrome_options=chrome_options,
+            bmp_options=bmp_options,
+            locations=locations,
             timeout_default=cfg.timeouts["default"],
+            lean_options=cfg.lean_options[source],
+            workers=cfg.workers,
+            pool_options=cfg.pool_options,
+            replay_options=cfg.replay_options,
+            store_options=cfg.store_options,
         )
     elif source == "realtor.com":
         return RealtorComScraper(
-            chrome_options=cfg.chrome_options,
+            chrome_options=chrome_options,
             cookies=realtor_com_cookies,
-            bmp_options=cfg.bmp_options,
-            locations=cfg.locations[source],
+            bmp_options=bmp_options,
+            locations=locations,
             timeout_default=cfg.timeouts["default"],
+            lean_options=cfg.lean_options[source],
+            http_options=cfg.http_options,
+            replay_options=cfg.replay_options,
+            store_options=cfg.store_options,
         )
 
 
@@ -66,5 +118,124 @@ def main():
     cprint("Finished <g>scrape-agent-info.py<w>.")
 
 
+# { slot: chrome options of its cloned profile }, reused by every location
+# that runs in the slot
+sweep_profiles = {}
+
+
+def get_sweep_chrome_options(slot):
+    if not cfg.pool_options:
+        return get_worker_chrome_options(cfg.chrome_options)
+    if slot not in sweep_profiles:
+        sweep_profiles[slot] = clone_chrome_profile(
+            cfg.chrome_options, cfg.pool_options
+        )
+    return sweep_profiles[slot]
+
+
+def create_sweep_scraper(source, location, slot):
+    # Each running scrape gets its own proxy port and a Chrome profile
+    # that isn't locked by the other browsers
+    return get_scraper(
+        source,
+        locations=[location],
+        chrome_options=get_sweep_chrome_options(slot),
+        bmp_options=dict(cfg.bmp_options, port=cfg.sweep["proxy_port"] + slot),
+    )
+
+
+def sweep():
+    cprint("<g>Sweeping agent info...")
+    jobs = []
+    for source in cfg.sweep["sources"]:
+        for location in cfg.sweep_locations[source]:
+            jobs.append((source, location))
+
+    # Profile workers are browsers too
+    browsers_per_job = 1 + (cfg.workers if cfg.workers > 1 else 0)
+    scheduler = Scheduler(
+        create_sweep_scraper,
+        jobs,
+        max_browsers=cfg.sweep["max_browsers"],
+        browsers_per_job=browsers_per_job,
+    )
+    try:
+        scheduler.run()
+    finally:
+        for options in sweep_profiles.values():
+            remove_chrome_profile(options)
+    cprint("Finished <g>sweep<w>.")
+
+
+# Folder and store name of sources that don't save under their own name
+# eg. realtor.com writes to agent_data/realtor_com
+storage_names = {"realtor.com": "realtor_com"}
+
+
+def get_storage_sources():
+    return [storage_names.get(source, source) for source in cfg.sweep["sources"]]
+
+
+def export(source, location=None):
+    # Dump agents from the store to agent_data/<source>/<location>.csv,
+    # or agent_data/<source>.csv for every location
+    if not cfg.store_options:
+        cprint("<r>Set store_options in config.py to export from the store.")
+        return
+    source = storage_names.get(source, source)
+    store = get_agent_store(cfg.store_options)
+    if location:
+        os.makedirs(f"agent_data/{source}", exist_ok=True)
+        file_name = f"agent_data/{source}/{location}.csv"
+    else:
+        os.makedirs("agent_data", exist_ok=True)
+        file_name = f"agent_data/{source}.csv"
+
+    cprint(f"Exporting <c>{source}<w> agents to <c>{file_name}<w>...")
+    with open(file_name, "w", encoding="utf-8", newline="") as f:
+        count = store.export_csv(f, source, location)
+    store.close()
+    if count == 0:
+        cprint(f"<y>No <c>{source}<y> agents found in the store.")
+    cprint("Finished <g>export<w>.")
+
+
+def merge():
+    # One row per agent across every source, in agent_data/merged.csv
+    merger = AgentMerger(**cfg.merge_options)
+    if cfg.store_options:
+        merger.add_store(get_agent_store(cfg.store_options), get_storage_sources())
+    else:
+        merger.add_csv_folder("agent_data")
+
+    cprint("Merging agents into <c>agent_data/merged.csv<w>...")
+    with open("agent_data/merged.csv", "w", encoding="utf-8", newline="") as f:
+        merger.write_csv(f)
+    cprint("Finished <g>merge<w>.")
+
+
+def export_arrow():
+    # Every source in one schema, partitioned by source and location
+    exporter = AgentArrowExporter(cfg.arrow_options["format"])
+    if cfg.store_options:
+        exporter.add_store(get_agent_store(cfg.store_options), get_storage_sources())
+    else:
+        exporter.add_csv_folder("agent_data", get_storage_sources())
+
+    root = cfg.arrow_options["root"]
+    cprint(f"Exporting agents to <c>{root}<w>...")
+    count = exporter.write(root)
+    cprint(f"Finished <g>arrow export<w> ({count} locations).")
+
+
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == "sweep":
+        sweep()
+    elif len(sys.argv) > 1 and sys.argv[1] == "arrow":
+        export_arrow()
+    elif len(sys.argv) > 1 and sys.argv[1] == "merge":
+        merge()
+    elif len(sys.argv) > 2 and sys.argv[1] == "export":
+        export(*sys.argv[2:4])
+    else:
+        main()
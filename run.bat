@@ -4,6 +4,7 @@ REM make.bat is designed to replicated make functionality or npm scripts
 
 REM Local Workplace Commands
 if %1 EQU app .env\Scripts\python.exe main.py
+if %1 EQU sweep .env\Scripts\python.exe main.py sweep
 
 REM Remind user of available functions
 IF %1 EQU --help (
@@ -11,5 +12,6 @@ IF %1 EQU --help (
   ECHO AVAILABLE ARGS
   ECHO --------------
   ECHO app
+  ECHO sweep
   ECHO --------------
 )
\ No newline at end of file